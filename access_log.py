@@ -0,0 +1,169 @@
+import os
+import sys
+import queue
+import atexit
+import random
+import time
+import logging
+import threading
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# One line per request, key=value fields, on its own logger so it can be
+# routed or silenced separately from application logs
+access_logger = logging.getLogger('access')
+
+# Sampled playlist body dumps, for debugging the rewriter in production
+body_logger = logging.getLogger('access.body')
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full.
+
+    Formatting and writing happen on a QueueListener thread, so a request
+    thread only pays for an enqueue. The listener is (re)started lazily in
+    each process, so gunicorn workers forked from a preloaded app do not
+    log into a queue nobody drains.
+    """
+
+    def __init__(self, handlers, queue_size: int):
+        super().__init__(queue.Queue(queue_size))
+        self._handlers = handlers
+        self._queue_size = queue_size
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._listener_pid == os.getpid():
+                return
+            if self._listener_pid is not None:
+                # Forked child: the parent's queue may hold records its
+                # listener thread will never write here
+                self.queue = queue.Queue(self._queue_size)
+            self._listener = logging.handlers.QueueListener(
+                self.queue, *self._handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            self._listener_pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener_pid = None
+
+
+_queue_handler = None
+
+
+def configure_logging(level: str = 'INFO', queue_size: int = 10000):
+    """Route all logging through a bounded queue drained by a background thread"""
+    global _queue_handler
+    if _queue_handler is not None:
+        return _queue_handler
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    _queue_handler = NonBlockingQueueHandler([stream], queue_size)
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(level)
+    # httpx logs every upstream request at INFO, which would add a line per
+    # fetch on top of the sampled access log
+    for name in ('httpx', 'httpcore'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    atexit.register(_queue_handler.stop)
+    return _queue_handler
+
+
+class AccessLog:
+    """Compact, sampled access log.
+
+    record() writes one key=value line for a sample_rate fraction of
+    requests; duration is in seconds and float fields are written with
+    one decimal. sample_body() decides, at body_sample_rate, whether a
+    request's playlist bodies are dumped at DEBUG; at the default rate of
+    0 bodies are never even decoded.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, body_sample_rate: float = 0.0):
+        self.sample_rate = sample_rate
+        self.body_sample_rate = body_sample_rate
+        if body_sample_rate > 0:
+            body_logger.setLevel(logging.DEBUG)
+
+    def sample_body(self) -> bool:
+        return self.body_sample_rate > 0 and random.random() < self.body_sample_rate
+
+    def dump_body(self, label: str, path: str, body: bytes):
+        body_logger.debug("%s %s:\n%s", label, path, body.decode('utf-8', errors='replace'))
+
+    def record(self, method: str, path: str, status: int, duration: float, **fields):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        line = f"method={method} path={path} status={status} ms={duration * 1000:.1f}"
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if isinstance(value, float):
+                value = f"{value:.1f}"
+            line += f" {name}={value}"
+        access_logger.info(line)
+
+
+class AccessLogMiddleware:
+    """ASGI middleware writing one access line per HTTP request once its body is sent.
+
+    Handlers add fields for the line to the scope['access'] dict. With a
+    metrics registry, the same numbers are also recorded there.
+    """
+
+    def __init__(self, app, access_log: AccessLog, metrics=None):
+        self.app = app
+        self.access_log = access_log
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        scope['access'] = fields = {}
+        progress = {'status': 500, 'ttfb': None, 'bytes': 0}
+        if self.metrics is not None:
+            self.metrics.request_started()
+
+        async def send_and_measure(message):
+            if message['type'] == 'http.response.start':
+                progress['status'] = message['status']
+                progress['ttfb'] = time.perf_counter() - started
+            elif message['type'] == 'http.response.body':
+                progress['bytes'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            duration = time.perf_counter() - started
+            ttfb = progress['ttfb'] if progress['ttfb'] is not None else duration
+            self.access_log.record(
+                scope['method'], scope['path'], progress['status'], duration,
+                ttfb_ms=ttfb * 1000, bytes=progress['bytes'], **fields
+            )
+            if self.metrics is not None:
+                self.metrics.request_finished(
+                    scope['path'], progress['status'], duration, ttfb, progress['bytes'], fields
+                )
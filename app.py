@@ -1,28 +1,148 @@
-from flask import Flask, Response, request, send_from_directory, __version__ as flask_version
+from flask import Flask, Response, g, request, send_file, send_from_directory, __version__ as flask_version
 import requests
 import urllib.parse
 import logging
-import json
 import os
-import sys
+import time
+from typing import List
 from flask_cors import CORS
+from werkzeug.http import unquote_etag
+from werkzeug.wsgi import ClosingIterator
 from datetime import datetime
-
-# Configure logging before anything else
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
+from access_log import AccessLog, configure_logging
+from metrics import MetricsRegistry
+from circuit_breaker import CircuitOpenError
+from concurrency_limit import AdaptiveConcurrencyLimit, ConcurrencyLimitExceeded
+from hedging import HedgePolicy
+from origin_pool import OriginPool
+from upstream import get_upstream_client
+from playlist_cache import ExpiringSet, PlaylistCache
+from segment_cache import SegmentCache
+from singleflight import SingleFlight
+from storage_handler import LeasewebStorageHandler
+from video_catalog import (
+    FALLBACK_VIDEOS, VideoCatalog, bucket_change_lister, bucket_metadata_loader, bucket_video_lister
+)
+from proxy_common import (
+    FORWARDED_REQUEST_HEADERS, PROXY_RESPONSE_HEADERS, RELAYED_RESPONSE_HEADERS, STREAM_CHUNK_SIZE, PlaylistBody,
+    get_content_type, precomputed_playlist_path, retry_after_header, validate_m3u8
 )
+from config import (
+    ACCESS_LOG_CONFIG, CDN_ORIGIN_URLS, HEDGE_CONFIG, ORIGIN_POOL_CONFIG, LOGGING_CONFIG, METRICS_CONFIG, LEASEWEB_CONTROL_CONFIG, LEASEWEB_CDN_CONFIG, PLAYLIST_CACHE_CONFIG, SEGMENT_CACHE_CONFIG,
+    PROXY_UPSTREAM_CONFIG, SINGLE_FLIGHT_WAIT_TIMEOUT, VIDEO_CATALOG_CONFIG, VIDEO_CATALOG_PAGE_SIZE,
+    VIDEO_CATALOG_MAX_PAGE_SIZE, UPSTREAM_CONCURRENCY_LIMIT_CONFIG, UPSTREAM_CONCURRENCY_LIMIT_ENABLED
+)
+
+# Configure logging before anything else; records are written by a
+# background thread so request threads never block on stdout
+configure_logging(**LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
-def create_app():
-    """Create and configure the Flask application"""
+def create_app(cdn_origins: List[str] = None):
+    """Create and configure the Flask application, proxying to cdn_origins"""
     app = Flask(__name__)
     CORS(app)
 
+    # CDN origins in latency order, with health checks, circuit breakers and
+    # failover, behind a cap on upstream requests in flight
+    origins = OriginPool(
+        cdn_origins or CDN_ORIGIN_URLS, hedging=HedgePolicy(**HEDGE_CONFIG),
+        concurrency_limit=AdaptiveConcurrencyLimit(**UPSTREAM_CONCURRENCY_LIMIT_CONFIG)
+        if UPSTREAM_CONCURRENCY_LIMIT_ENABLED else None,
+        **ORIGIN_POOL_CONFIG
+    )
+
+    # Rewritten playlists, shared by all requests handled by this worker
+    playlist_cache = PlaylistCache(**PLAYLIST_CACHE_CONFIG)
+
+    # Playlists with no pre-rewritten variant (titles ingested before they
+    # were published); rewritten here instead of first probing for one.
+    # Keyed by playlist, since a title may have a variant for some of its
+    # playlists and not others (e.g. no master.m3u8 outside ABR ingest)
+    legacy_playlists = ExpiringSet(PLAYLIST_CACHE_CONFIG['max_entries'], PLAYLIST_CACHE_CONFIG['ttl'])
+
+    # Segments and keys, shared with the other workers through the filesystem
+    segment_cache = None
+    if SEGMENT_CACHE_CONFIG['directory']:
+        segment_cache = SegmentCache(**SEGMENT_CACHE_CONFIG)
+
+    # Identical concurrent fetches wait for one leader instead of each going
+    # upstream. Segments coalesce across workers through lock files next to
+    # the disk cache they fill. Playlists only coalesce within a worker,
+    # because the playlist cache is per process: under the default sync
+    # workers (one request each) that merges nothing, and it takes
+    # --worker-class gthread to have concurrent requests to merge.
+    playlist_flights = SingleFlight(wait_timeout=SINGLE_FLIGHT_WAIT_TIMEOUT)
+    segment_flights = None
+    if segment_cache is not None:
+        segment_flights = SingleFlight(
+            lock_dir=segment_cache.lock_dir,
+            wait_timeout=SINGLE_FLIGHT_WAIT_TIMEOUT
+        )
+
+    # With more than one origin a gateway error fails over to the next one
+    # (and counts against the first's circuit) rather than being retried
+    # against the same origin with backoff
+    upstream_config = {**PROXY_UPSTREAM_CONFIG, 'status_retries': 0 if len(origins.origins) > 1 else None}
+
+    def upstream_client():
+        return get_upstream_client(upstream_config)
+
+    # Titles and their ingest metadata listed from the control bucket;
+    # without storage credentials (local development), or until the bucket
+    # can first be listed, the library falls back to the built-in list
+    try:
+        storage = LeasewebStorageHandler(LEASEWEB_CONTROL_CONFIG, LEASEWEB_CDN_CONFIG)
+        video_catalog = VideoCatalog(
+            bucket_video_lister(storage.control_session, storage.control_bucket),
+            load_metadata=bucket_metadata_loader(storage.control_session, storage.control_bucket),
+            list_added=bucket_change_lister(storage.control_session, storage.control_bucket),
+            fallback=FALLBACK_VIDEOS,
+            **VIDEO_CATALOG_CONFIG
+        )
+    except ValueError as e:
+        logger.warning(f"Video catalog using built-in list: {str(e)}")
+        video_catalog = VideoCatalog(lambda: FALLBACK_VIDEOS, **VIDEO_CATALOG_CONFIG)
+
+    # One compact line per request; playlist bodies only when sampled
+    access_log = AccessLog(**ACCESS_LOG_CONFIG)
+
+    # Counters and latency histograms, summed across workers at /metrics
+    metrics = MetricsRegistry(**METRICS_CONFIG)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        g.access = {}
+        metrics.request_started()
+
+    @app.after_request
+    def log_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        # Streamed responses finish after this hook, so their line is written
+        # once the body is done; ttfb_ms is the time to the response headers
+        method, path, status = request.method, request.path, response.status_code
+        ttfb = time.perf_counter() - started
+        length = response.headers.get('Content-Length')
+        fields = g.access
+
+        def write_access_line():
+            duration = time.perf_counter() - started
+            access_log.record(method, path, status, duration, ttfb_ms=ttfb * 1000, bytes=length, **fields)
+            metrics.request_finished(path, status, duration, ttfb, length, fields)
+
+        # Files handed to the server's sendfile are left unwrapped so the
+        # zero-copy path still applies; their line is written right away
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        sendfile = isinstance(file_wrapper, type) and isinstance(response.response, file_wrapper)
+        if response.is_streamed and not sendfile:
+            response.response = ClosingIterator(response.response, write_access_line)
+        else:
+            write_access_line()
+        return response
+
     @app.route('/health')
     def health_check():
         """Lightweight health check endpoint"""
@@ -97,6 +217,11 @@ def create_app():
                     align-items: center;
                     justify-content: center;
                 }
+                .video-thumbnail img {
+                    width: 100%;
+                    height: 100%;
+                    object-fit: cover;
+                }
                 .video-info {
                     padding: 15px;
                 }
@@ -105,6 +230,11 @@ def create_app():
                     font-size: 18px;
                     color: #333;
                 }
+                .video-details {
+                    margin: 5px 0 0;
+                    font-size: 14px;
+                    color: #666;
+                }
                 .search-bar {
                     margin-bottom: 20px;
                     text-align: center;
@@ -122,26 +252,52 @@ def create_app():
                     font-size: 18px;
                     color: #666;
                 }
+                .load-more {
+                    display: none;
+                    margin: 0 auto 20px;
+                    padding: 10px 20px;
+                    border: none;
+                    border-radius: 4px;
+                    background: #4a90e2;
+                    color: white;
+                    font-size: 16px;
+                    cursor: pointer;
+                }
             </style>
         </head>
         <body>
             <div class="container">
                 <h1>Video Library</h1>
                 <div class="search-bar">
-                    <input type="text" id="searchInput" placeholder="Search videos..." oninput="filterVideos()">
+                    <input type="text" id="searchInput" placeholder="Search videos..." oninput="searchVideos()">
                 </div>
                 <div id="videoGrid" class="video-grid">
                     <div class="loading">Loading videos...</div>
                 </div>
+                <button id="loadMore" class="load-more" onclick="loadVideos(false)">Load more</button>
             </div>
 
             <script>
-                // Function to load videos
-                async function loadVideos() {
+                // Paging state; search and pagination happen on the server
+                let query = '';
+                let loaded = 0;
+                let searchTimer = null;
+
+                // Function to load videos, replacing the grid or appending the next page
+                async function loadVideos(reset) {
+                    if (reset) {
+                        loaded = 0;
+                    }
                     try {
-                        const response = await fetch('/videos');
-                        const videos = await response.json();
-                        displayVideos(videos);
+                        const params = new URLSearchParams({q: query, offset: loaded});
+                        const response = await fetch('/videos?' + params);
+                        const page = await response.json();
+                        if (query !== params.get('q')) {
+                            return;  // a newer search has started
+                        }
+                        displayVideos(page.videos, reset);
+                        loaded += page.videos.length;
+                        document.getElementById('loadMore').style.display = loaded < page.total ? 'block' : 'none';
                     } catch (error) {
                         console.error('Error loading videos:', error);
                         document.getElementById('videoGrid').innerHTML = 
@@ -150,35 +306,57 @@ def create_app():
                 }
 
                 // Function to display videos
-                function displayVideos(videos) {
+                function displayVideos(videos, reset) {
                     const grid = document.getElementById('videoGrid');
-                    if (videos.length === 0) {
+                    if (reset && videos.length === 0) {
                         grid.innerHTML = '<div style="text-align: center; grid-column: 1/-1;">No videos available</div>';
                         return;
                     }
-                    grid.innerHTML = videos.map(video => `
-                        <div class="video-card" onclick="playVideo('${video}')">
+                    const cards = videos.map(video => `
+                        <div class="video-card" onclick="playVideo('${video.name}')">
                             <div class="video-thumbnail">
+                                ${video.poster ? `<img src="/proxy/videos/${video.name}/${video.poster}" alt="" loading="lazy">` : `
                                 <svg width="64" height="64" viewBox="0 0 24 24" fill="#666">
                                     <path d="M8 5v14l11-7z"/>
-                                </svg>
+                                </svg>`}
                             </div>
                             <div class="video-info">
-                                <h3 class="video-title">${video}</h3>
+                                <h3 class="video-title">${video.name}</h3>
+                                <p class="video-details">${describeVideo(video)}</p>
                             </div>
                         </div>
                     `).join('');
+                    if (reset) {
+                        grid.innerHTML = cards;
+                    } else {
+                        grid.insertAdjacentHTML('beforeend', cards);
+                    }
                 }
 
-                // Function to filter videos
-                function filterVideos() {
-                    const search = document.getElementById('searchInput').value.toLowerCase();
-                    const cards = document.getElementsByClassName('video-card');
-                    
-                    for (let card of cards) {
-                        const title = card.getElementsByClassName('video-title')[0].textContent.toLowerCase();
-                        card.style.display = title.includes(search) ? '' : 'none';
+                // Function to summarise the ingest metadata shown on a card
+                function describeVideo(video) {
+                    const details = [];
+                    if (video.duration) {
+                        const minutes = Math.floor(video.duration / 60);
+                        const seconds = Math.floor(video.duration % 60).toString().padStart(2, '0');
+                        details.push(`${minutes}:${seconds}`);
+                    }
+                    if (video.height) {
+                        details.push(`${video.height}p`);
                     }
+                    if (video.renditions) {
+                        details.push(`${video.renditions.length} qualities`);
+                    }
+                    return details.join(' · ');
+                }
+
+                // Function to search videos by name prefix, once typing pauses
+                function searchVideos() {
+                    clearTimeout(searchTimer);
+                    searchTimer = setTimeout(() => {
+                        query = document.getElementById('searchInput').value.trim();
+                        loadVideos(true);
+                    }, 250);
                 }
 
                 // Function to play video
@@ -187,7 +365,7 @@ def create_app():
                 }
 
                 // Load videos when page loads
-                loadVideos();
+                loadVideos(true);
             </script>
         </body>
         </html>
@@ -196,9 +374,13 @@ def create_app():
 
     @app.route('/videos')
     def get_videos():
-        """Get list of available videos"""
-        videos = ['fly', 'song', 'sparkle', 'maverick', 'transformers', 'whiplash']
-        return json.dumps(videos)
+        """Get one page of available videos with their metadata, optionally filtered by name prefix"""
+        query = request.args.get('q', '').strip()
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', VIDEO_CATALOG_PAGE_SIZE, type=int), 1), VIDEO_CATALOG_MAX_PAGE_SIZE)
+        total, names = video_catalog.search(query, offset, limit)
+        videos = [video_catalog.describe(name) for name in names]
+        return {"videos": videos, "total": total, "offset": offset, "limit": limit}
 
     @app.route('/player')
     def serve_video_player():
@@ -207,6 +389,13 @@ def create_app():
         if not video_name:
             return "Video name not specified", 400
 
+        # ABR titles (their ingest metadata lists renditions) play from
+        # master.m3u8 and the rest from stream.m3u8. Only a title without
+        # metadata has its master playlist tried if stream.m3u8 fails.
+        metadata = video_catalog.describe(video_name)
+        playlist = 'master.m3u8' if metadata.get('renditions') else 'stream.m3u8'
+        fallback_playlist = 'master.m3u8' if set(metadata) == {'name'} else ''
+
         html = f"""
 <!DOCTYPE html>
 <html>
@@ -237,6 +426,14 @@ def create_app():
             max-width: 1000px;
             margin: 0 auto;
         }}
+        .scrub-preview {{
+            display: none;
+            position: absolute;
+            bottom: 40px;
+            border: 2px solid white;
+            pointer-events: none;
+            z-index: 2;
+        }}
         .info-section {{
             margin-top: 20px;
             padding: 15px;
@@ -322,7 +519,7 @@ def create_app():
                    class="video-js vjs-default-skin vjs-big-play-centered"
                    controls
                    preload="auto">
-                <source src="/proxy/videos/{video_name}/stream.m3u8" type="application/x-mpegURL">
+                <source src="/proxy/videos/{video_name}/{playlist}" type="application/x-mpegURL">
                 <p class="vjs-no-js">
                     To view this video please enable JavaScript, and consider upgrading to a
                     web browser that <a href="https://videojs.com/html5-video-support/" target="_blank">supports HTML5 video</a>
@@ -346,7 +543,7 @@ def create_app():
                 <p><strong>Stream Type:</strong> HLS (HTTP Live Streaming)</p>
                 <p><strong>CDN Provider:</strong> Leaseweb CDN</p>
                 <p><strong>Source URL:</strong><br>
-                <code>https://di-yusrkfqf.leasewebultracdn.com/videos/{video_name}/stream.m3u8</code></p>
+                <code>{origins.origins[0].url}/videos/{video_name}/{playlist}</code></p>
                 <p class="note">This video is served through Leaseweb's Content Delivery Network (CDN) for optimal streaming performance and global availability.</p>
             </div>
         </div>
@@ -410,10 +607,70 @@ def create_app():
             }});
 
             player.on('error', function(error) {{
+                // Titles without ingest metadata may be ABR-only
+                const fallbackPlaylist = '{fallback_playlist}';
+                if (fallbackPlaylist && !player.currentSrc().endsWith('/' + fallbackPlaylist)) {{
+                    updateStatus('No single-rendition playlist, loading master playlist...');
+                    player.error(null);
+                    player.src({{ src: '/proxy/videos/{video_name}/' + fallbackPlaylist, type: 'application/x-mpegURL' }});
+                    return;
+                }}
                 updateStatus('Error occurred');
                 showError('Player Error: ' + player.error().message);
             }});
 
+            // Poster and scrub previews, for titles ingested with thumbnails
+            const thumbnailBase = '/proxy/videos/{video_name}/thumbnails/';
+            const poster = new Image();
+            poster.onload = function() {{
+                player.poster(poster.src);
+            }};
+            poster.src = thumbnailBase + 'poster.jpg';
+
+            function parseVttTime(value) {{
+                const parts = value.split(':').map(parseFloat);
+                return parts[0] * 3600 + parts[1] * 60 + parts[2];
+            }}
+
+            fetch(thumbnailBase + 'thumbnails.vtt').then(function(response) {{
+                return response.ok ? response.text() : '';
+            }}).then(function(vtt) {{
+                const cues = [];
+                const pattern = /([\d:.]+) --> ([\d:.]+)\s+(\S+)#xywh=(\d+),(\d+),(\d+),(\d+)/g;
+                let match;
+                while ((match = pattern.exec(vtt)) !== null) {{
+                    cues.push({{
+                        start: parseVttTime(match[1]),
+                        end: parseVttTime(match[2]),
+                        url: thumbnailBase + match[3],
+                        x: +match[4], y: +match[5], w: +match[6], h: +match[7]
+                    }});
+                }}
+                if (cues.length === 0) {{
+                    return;
+                }}
+
+                const preview = document.createElement('div');
+                preview.className = 'scrub-preview';
+                player.el().appendChild(preview);
+                const progress = player.controlBar.progressControl.el();
+
+                progress.addEventListener('mousemove', function(event) {{
+                    const rect = progress.getBoundingClientRect();
+                    const time = (event.clientX - rect.left) / rect.width * player.duration();
+                    const cue = cues.find(c => time >= c.start && time < c.end) || cues[cues.length - 1];
+                    preview.style.width = cue.w + 'px';
+                    preview.style.height = cue.h + 'px';
+                    preview.style.background = `url(${{cue.url}}) -${{cue.x}}px -${{cue.y}}px`;
+                    preview.style.left = Math.min(Math.max(event.clientX - player.el().getBoundingClientRect().left - cue.w / 2, 0),
+                                                  player.el().offsetWidth - cue.w) + 'px';
+                    preview.style.display = 'block';
+                }});
+                progress.addEventListener('mouseleave', function() {{
+                    preview.style.display = 'none';
+                }});
+            }}).catch(function() {{}});
+
             // Cleanup on page unload
             window.addEventListener('beforeunload', function() {{
                 player.dispose();
@@ -429,138 +686,239 @@ def create_app():
     def test_cdn(video_name):
         """Test CDN connectivity for a specific video"""
         try:
-            # Test m3u8 playlist
-            playlist_url = f"https://di-yusrkfqf.leasewebultracdn.com/videos/{video_name}/stream.m3u8"
-            logger.info(f"Testing CDN connection to: {playlist_url}")
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': '*/*',
-                'Accept-Encoding': 'identity'
-            }
-            
-            response = requests.head(playlist_url, headers=headers, timeout=10)
-            
+            # Test the m3u8 playlist on every origin
+            upstream = upstream_client()
+            results = []
+            for origin in origins.origins:
+                playlist_url = f"{origin.url}/videos/{video_name}/stream.m3u8"
+                logger.info(f"Testing CDN connection to: {playlist_url}")
+                try:
+                    response = upstream.head(playlist_url, timeout=(upstream.timeout[0], 10))
+                except requests.RequestException as e:
+                    results.append({"url_tested": playlist_url, "error": str(e)})
+                    continue
+                results.append({
+                    "url_tested": playlist_url,
+                    "status_code": response.status_code,
+                    "headers": dict(response.headers)
+                })
+
             return {
-                "status": "success" if response.status_code == 200 else "error",
-                "url_tested": playlist_url,
-                "status_code": response.status_code,
-                "headers": dict(response.headers)
+                "status": "success" if any(result.get("status_code") == 200 for result in results) else "error",
+                "origins": results
             }
-            
+
         except Exception as e:
             logger.error(f"CDN test failed: {str(e)}", exc_info=True)
             return {"status": "error", "message": str(e)}, 500
 
+    @app.route('/upstream-stats')
+    def upstream_stats():
+        """Connection pool, reuse and origin statistics for this worker"""
+        return {**upstream_client().stats(), "origin_pool": origins.stats()}
+
+    @app.route('/cache-stats')
+    def cache_stats():
+        """Cache and catalog statistics for this worker"""
+        return {
+            "playlist_cache": playlist_cache.stats(),
+            "segment_cache": segment_cache.stats() if segment_cache else None,
+            "playlist_flights": playlist_flights.stats(),
+            "segment_flights": segment_flights.stats() if segment_flights else None,
+            "video_catalog": video_catalog.stats()
+        }
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Request, cache and upstream metrics for all workers, in Prometheus text format"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
     @app.route('/proxy/<path:target_path>')
+    @metrics.timed('proxy_request')
     def proxy_request(target_path):
         """Handle proxy requests to CDN"""
+        flight = None
         try:
-            logger.info(f"=== Starting proxy request for: {target_path} ===")
-
             # Extract video name from the path
             path_parts = target_path.split('/')
             if len(path_parts) >= 2 and path_parts[0] == 'videos':
                 video_name = path_parts[1]
-                logger.info(f"Extracted video name: {video_name}")
             else:
                 logger.error(f"Invalid path format: {target_path}")
                 return {"error": "Invalid path", "message": "Could not extract video name"}, 400
 
-            # Construct the CDN URL
-            cdn_url = f"https://di-yusrkfqf.leasewebultracdn.com/{target_path}"
-            logger.info(f"Requesting from CDN: {cdn_url}")
+            # Serve playlists from the cache, revalidating stale entries upstream
+            cached = None
+            upstream_path = target_path
+            if target_path.endswith('.m3u8'):
+                cached = playlist_cache.get(target_path)
+                if cached is not None and cached.is_fresh():
+                    g.access['cache'] = 'hit'
+                    return cached_playlist_response(cached, target_path)
+
+                # Let a fetch already in flight for this playlist fill the cache
+                flight = playlist_flights.acquire(target_path)
+                if flight is None:
+                    playlist_flights.wait(target_path)
+                    cached = playlist_cache.get(target_path)
+                    if cached is not None and cached.is_fresh():
+                        g.access['cache'] = 'coalesced'
+                        return cached_playlist_response(cached, target_path)
+
+                if cached is not None and not cached.can_revalidate():
+                    cached = None
+
+                # Prefer the proxy-ready variant published at ingest, served
+                # byte-for-byte; legacy playlists fall back to the runtime rewrite
+                if cached is not None:
+                    upstream_path = cached.upstream_path or target_path
+                elif target_path not in legacy_playlists:
+                    upstream_path = precomputed_playlist_path(target_path) or target_path
+            elif segment_cache is not None and segment_cache.is_cacheable(target_path):
+                cached_file = segment_cache.lookup(target_path)
+                if cached_file is not None:
+                    g.access['cache'] = 'hit'
+                    return cached_segment_response(cached_file, target_path)
+
+                # Whole-object requests wait for another request (in any worker)
+                # that is already filling the disk cache with this segment
+                if 'Range' not in request.headers:
+                    flight = segment_flights.acquire(target_path)
+                    if flight is None:
+                        segment_flights.wait(target_path)
+                        cached_file = segment_cache.lookup(target_path)
+                        if cached_file is not None:
+                            g.access['cache'] = 'coalesced'
+                            return cached_segment_response(cached_file, target_path)
+                        # The leader gave up without filling the cache
+                        flight = segment_flights.acquire(target_path)
+
+            logger.debug(f"Requesting from CDN: {upstream_path}")
+            g.access['cache'] = 'miss'
 
             try:
-                # Set up headers for the CDN request
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept': '*/*',
-                    'Accept-Encoding': 'identity',  # Request uncompressed content
-                    'Connection': 'keep-alive'
-                }
+                # Playlists are revalidated with the cache's own validators;
+                # segment requests carry the client's Range/conditional headers
+                if target_path.endswith('.m3u8'):
+                    upstream_headers = cached.validator_headers() if cached else None
+                else:
+                    upstream_headers = client_conditional_headers()
 
-                # Make the request to the CDN
-                response = requests.get(cdn_url, headers=headers, timeout=30, stream=True)
-                logger.info(f"CDN response status: {response.status_code}")
-                logger.info(f"CDN response headers: {dict(response.headers)}")
+                # Make the request to the best CDN origin over this worker's
+                # pooled connections, failing over to the others
+                upstream = upstream_client()
+                upstream_started = time.perf_counter()
+                response = origins.get(upstream, upstream_path, headers=upstream_headers)
 
-                if response.status_code == 200:
-                    content = response.content
-                    logger.info(f"Received content length: {len(content)} bytes")
-
-                    # If this is an m3u8 file, modify the URLs
-                    if target_path.endswith('.m3u8'):
-                        try:
-                            decoded_content = content.decode('utf-8')
-                            logger.info("=== Original m3u8 content ===")
-                            logger.info(decoded_content)
-                            logger.info("=== End original m3u8 content ===")
-                            
-                            # Basic content validation
-                            if not decoded_content.strip():
-                                logger.error("Empty m3u8 content received")
-                                return {"error": "Invalid Content", "message": "Empty m3u8 file received"}, 500
-
-                            # Check for HLS header
-                            if not decoded_content.strip().startswith('#EXTM3U'):
-                                logger.error("Invalid m3u8 content - missing #EXTM3U header")
-                                return {"error": "Invalid Content", "message": "Invalid m3u8 file format"}, 500
-
-                            # Modify URLs
-                            content = modify_m3u8_urls(decoded_content, video_name)
-                            content = content.encode('utf-8')
-                            
-                            logger.info("=== Modified m3u8 content ===")
-                            logger.info(content.decode('utf-8'))
-                            logger.info("=== End modified m3u8 content ===")
-                            
-                        except UnicodeDecodeError as e:
-                            logger.error(f"Failed to decode m3u8 content: {str(e)}")
-                            return {"error": "Processing Error", "message": "Failed to decode m3u8 content"}, 500
-                        except Exception as e:
-                            logger.error(f"Error processing m3u8: {str(e)}", exc_info=True)
-                            return {"error": "Processing Error", "message": f"Failed to process m3u8: {str(e)}"}, 500
+                if upstream_path != target_path and response.status_code in (403, 404):
+                    response.close()
+                    logger.debug(f"No precomputed playlist for {target_path}, rewriting at request time")
+                    legacy_playlists.add(target_path)
+                    cached = None
+                    upstream_path = target_path
+                    response = origins.get(upstream, target_path)
+                    g.access['variant'] = 'legacy'
+                g.access['upstream_status'] = response.status_code
+                g.access['upstream_ms'] = (time.perf_counter() - upstream_started) * 1000
+
+                if response.status_code == 304 and cached is not None:
+                    response.close()
+                    g.access['cache'] = 'revalidated'
+                    playlist_cache.refresh(cached)
+                    return cached_playlist_response(cached, target_path)
+
+                elif response.status_code == 304 and not target_path.endswith('.m3u8'):
+                    response.close()
+                    return not_modified_response(response)
+
+                elif response.status_code == 206 and not target_path.endswith('.m3u8'):
+                    return stream_cdn_response(response, target_path)
+
+                elif response.status_code == 200:
+                    # Segments and keys are relayed as they arrive instead of
+                    # being buffered in the worker first; the stream releases
+                    # the flight once the disk cache entry is complete
+                    if not target_path.endswith('.m3u8'):
+                        handed_off, flight = flight, None
+                        return stream_cdn_response(response, target_path, handed_off)
+
+                    # Modify URLs as the playlist arrives, unless ingest already did
+                    dump_bodies = access_log.sample_body()
+                    playlist = read_playlist(
+                        response, target_path, rewrite_uris=upstream_path == target_path, keep_original=dump_bodies
+                    )
+                    content = playlist.finish()
+
+                    try:
+                        if dump_bodies:
+                            access_log.dump_body("Original playlist", target_path, playlist.original())
+
+                        # Basic content validation
+                        validation_error = validate_m3u8(playlist.head)
+                        if validation_error:
+                            logger.error(validation_error)
+                            return {"error": "Invalid Content", "message": validation_error}, 500
+
+                        playlist_cache.put(
+                            target_path, content,
+                            etag=response.headers.get('ETag'),
+                            last_modified=response.headers.get('Last-Modified'),
+                            upstream_path=upstream_path
+                        )
+
+                        if dump_bodies:
+                            access_log.dump_body("Rewritten playlist", target_path, content)
+
+                    except Exception as e:
+                        logger.error(f"Error processing m3u8: {str(e)}", exc_info=True)
+                        return {"error": "Processing Error", "message": f"Failed to process m3u8: {str(e)}"}, 500
 
                     # Determine content type
                     content_type = get_content_type(target_path)
-                    logger.info(f"Content-Type determined: {content_type}")
 
                     # Create response with proper headers
                     flask_response = Response(content)
                     flask_response.headers['Content-Type'] = content_type
                     flask_response.headers['Content-Length'] = len(content)
-                    flask_response.headers['Access-Control-Allow-Origin'] = '*'
-                    flask_response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-                    flask_response.headers['Access-Control-Allow-Headers'] = '*'
-                    flask_response.headers['Cache-Control'] = 'public, max-age=3600'
-                    
-                    logger.info("=== Response headers ===")
-                    logger.info(dict(flask_response.headers))
-                    logger.info("=== End response headers ===")
-                    
+                    flask_response.headers.update(PROXY_RESPONSE_HEADERS)
+                    flask_response = make_conditional_response(
+                        flask_response,
+                        etag=response.headers.get('ETag'),
+                        last_modified=response.headers.get('Last-Modified')
+                    )
+
                     return flask_response
                     
                 elif response.status_code == 501:
                     logger.error("CDN returned 501 Not Implemented - retrying without compression")
                     # Retry without any encoding
-                    headers['Accept-Encoding'] = 'identity'
-                    response = requests.get(cdn_url, headers=headers, timeout=30)
+                    response.close()
+                    response = origins.get(upstream, upstream_path, headers={'Accept-Encoding': 'identity'})
                     if response.status_code == 200:
-                        return handle_cdn_response(response, target_path, video_name)
+                        return handle_cdn_response(response, target_path, video_name, upstream_path)
                     else:
+                        response.close()
                         error_msg = f"CDN retry failed with status {response.status_code}"
                         logger.error(error_msg)
                         return {"error": "CDN Error", "message": error_msg}, response.status_code
                 else:
+                    content = response.content
+                    response.close()
                     error_msg = f"CDN returned status {response.status_code}"
-                    if response.content:
-                        error_msg += f": {response.content.decode('utf-8', errors='ignore')}"
+                    if content:
+                        error_msg += f": {content.decode('utf-8', errors='ignore')}"
                     logger.error(error_msg)
                     return {"error": "CDN Error", "message": error_msg}, response.status_code
 
+            except (CircuitOpenError, ConcurrencyLimitExceeded) as e:
+                # Fail fast rather than tie up the worker on a struggling CDN
+                g.access['shed'] = 'circuit' if isinstance(e, CircuitOpenError) else 'limit'
+                return (
+                    {"error": "Service Unavailable", "message": str(e)}, 503,
+                    {'Retry-After': retry_after_header(e.retry_after)}
+                )
             except requests.Timeout:
-                logger.error(f"Timeout while fetching: {cdn_url}")
+                logger.error(f"Timeout while fetching: {upstream_path}")
                 return {"error": "Gateway Timeout", "message": "Request to CDN timed out"}, 504
             except requests.RequestException as e:
                 logger.error(f"Request error: {str(e)}")
@@ -570,86 +928,168 @@ def create_app():
             logger.error(f"Proxy error: {str(e)}", exc_info=True)
             return {"error": "Internal Server Error", "message": str(e)}, 500
 
-    def handle_cdn_response(response, target_path, video_name):
-        """Helper function to process CDN response"""
+        finally:
+            if flight is not None:
+                flight.release()
+
+    @metrics.timed('handle_cdn_response')
+    def handle_cdn_response(response, target_path, video_name, upstream_path=None):
+        """Helper function to process CDN response.
+
+        upstream_path is the object actually fetched; a proxy-ready variant
+        is served as it is rather than rewritten again.
+        """
+        upstream_path = upstream_path or target_path
         try:
-            content = response.content
-            logger.info(f"Received content length: {len(content)} bytes")
+            if not target_path.endswith('.m3u8'):
+                return stream_cdn_response(response, target_path)
 
-            if target_path.endswith('.m3u8'):
-                try:
-                    decoded_content = content.decode('utf-8')
-                    logger.info("=== Original m3u8 content ===")
-                    logger.info(decoded_content)
-                    logger.info("=== End original m3u8 content ===")
-                    
-                    if not decoded_content.strip():
-                        logger.error("Empty m3u8 content received")
-                        return {"error": "Invalid Content", "message": "Empty m3u8 file received"}, 500
+            dump_bodies = access_log.sample_body()
+            playlist = read_playlist(
+                response, target_path, rewrite_uris=upstream_path == target_path, keep_original=dump_bodies
+            )
+            content = playlist.finish()
 
-                    if not decoded_content.strip().startswith('#EXTM3U'):
-                        logger.error("Invalid m3u8 content - missing #EXTM3U header")
-                        return {"error": "Invalid Content", "message": "Invalid m3u8 file format"}, 500
+            if dump_bodies:
+                access_log.dump_body("Original playlist", target_path, playlist.original())
 
-                    content = modify_m3u8_urls(decoded_content, video_name)
-                    content = content.encode('utf-8')
-                    
-                    logger.info("=== Modified m3u8 content ===")
-                    logger.info(content.decode('utf-8'))
-                    logger.info("=== End modified m3u8 content ===")
-                    
-                except UnicodeDecodeError as e:
-                    logger.error(f"Failed to decode m3u8 content: {str(e)}")
-                    return {"error": "Processing Error", "message": "Failed to decode m3u8 content"}, 500
+            validation_error = validate_m3u8(playlist.head)
+            if validation_error:
+                logger.error(validation_error)
+                return {"error": "Invalid Content", "message": validation_error}, 500
+
+            playlist_cache.put(
+                target_path, content,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                upstream_path=upstream_path
+            )
+
+            if dump_bodies:
+                access_log.dump_body("Rewritten playlist", target_path, content)
 
             content_type = get_content_type(target_path)
             flask_response = Response(content)
             flask_response.headers['Content-Type'] = content_type
             flask_response.headers['Content-Length'] = len(content)
-            flask_response.headers['Access-Control-Allow-Origin'] = '*'
-            flask_response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            flask_response.headers['Access-Control-Allow-Headers'] = '*'
-            flask_response.headers['Cache-Control'] = 'public, max-age=3600'
+            flask_response.headers.update(PROXY_RESPONSE_HEADERS)
             
-            return flask_response
+            return make_conditional_response(
+                flask_response,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
 
         except Exception as e:
             logger.error(f"Error handling CDN response: {str(e)}", exc_info=True)
             return {"error": "Processing Error", "message": str(e)}, 500
 
-    def get_content_type(path):
-        """Determine content type based on file extension"""
-        if path.endswith('.m3u8'):
-            return 'application/vnd.apple.mpegurl'
-        elif path.endswith('.ts'):
-            return 'video/mp2t'
-        elif path.endswith('.key'):
-            return 'application/octet-stream'
-        else:
-            return 'application/octet-stream'
+    def read_playlist(response, target_path, rewrite_uris=True, keep_original=False):
+        """Read an upstream playlist chunk by chunk, rewriting its URIs as they arrive"""
+        playlist = PlaylistBody(target_path, rewrite=rewrite_uris, keep_original=keep_original)
+        try:
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                playlist.feed(chunk)
+        finally:
+            response.close()
+        if rewrite_uris:
+            metrics.observe('proxy_stage_duration_seconds', playlist.rewrite_seconds, stage='rewrite_playlist')
+        return playlist
 
-    def modify_m3u8_urls(content, video_name=None):
-        """Modify URLs in m3u8 file to use our proxy"""
-        lines = content.split('\n')
-        modified_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line.endswith('.ts') or line.endswith('.m3u8') or line.endswith('.key'):
-                # Convert the segment path to our proxy URL
-                if not line.startswith('http'):
-                    # If it's a segment file and doesn't have the full path
-                    if line.startswith('segments/') or line.endswith('.ts'):
-                        modified_lines.append(f'/proxy/videos/{video_name}/{line}')
-                    else:
-                        modified_lines.append(f'/proxy/videos/{video_name}/{line}')
-                else:
-                    modified_lines.append(line)
-            else:
-                modified_lines.append(line)
-        
-        logger.info(f"Modified m3u8 content:\n{'\n'.join(modified_lines)}")
-        return '\n'.join(modified_lines)
+    def cached_playlist_response(entry, target_path):
+        """Serve an already-rewritten playlist from the playlist cache"""
+        flask_response = Response(entry.body)
+        flask_response.headers['Content-Type'] = get_content_type(target_path)
+        flask_response.headers['Content-Length'] = len(entry.body)
+        flask_response.headers.update(PROXY_RESPONSE_HEADERS)
+
+        return make_conditional_response(flask_response, etag=entry.etag, last_modified=entry.last_modified)
+
+    def cached_segment_response(path, target_path):
+        """Serve a segment or key from the disk cache via the server's sendfile.
+
+        Range and conditional requests are answered locally, using the ETag
+        the CDN sent when the entry was filled.
+        """
+        upstream_etag, _ = unquote_etag(segment_cache.etag_for(path))
+        flask_response = send_file(
+            path,
+            mimetype=get_content_type(target_path),
+            conditional=True,
+            etag=upstream_etag or True
+        )
+        flask_response.headers.update(PROXY_RESPONSE_HEADERS)
+
+        return flask_response
+
+    def client_conditional_headers():
+        """Range and validator headers from the client to forward to the CDN"""
+        return {
+            name: request.headers[name]
+            for name in FORWARDED_REQUEST_HEADERS
+            if name in request.headers
+        }
+
+    def make_conditional_response(flask_response, etag=None, last_modified=None):
+        """Attach upstream validators and answer conditional/Range requests for a buffered body"""
+        if etag:
+            flask_response.headers['ETag'] = etag
+        if last_modified:
+            flask_response.headers['Last-Modified'] = last_modified
+        return flask_response.make_conditional(request, accept_ranges=True)
+
+    def not_modified_response(response):
+        """Relay a 304 from the CDN with its validators and our CORS headers"""
+        flask_response = Response(status=304)
+        for name in RELAYED_RESPONSE_HEADERS:
+            if name in response.headers:
+                flask_response.headers[name] = response.headers[name]
+        flask_response.headers.update(PROXY_RESPONSE_HEADERS)
+
+        return flask_response
+
+    def stream_cdn_response(response, target_path, flight=None):
+        """Relay a non-playlist CDN response to the client chunk by chunk"""
+        def generate():
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                if chunk:
+                    yield chunk
+
+        content_type = get_content_type(target_path)
+        content_length = response.headers.get('Content-Length')
+
+        # Release the upstream connection (and the flight, waking requests
+        # waiting for the cache) when the server closes the body, which also
+        # happens for HEAD requests and client disconnects where the
+        # generator never runs to completion (or never starts)
+        on_close = [response.close] + ([flight.release] if flight is not None else [])
+        chunks = generate()
+
+        # Only complete bodies are worth caching; a 206 is a slice of the
+        # segment. The cache fills at upstream speed on its own thread and
+        # owns the upstream response and the flight from then on, so a slow
+        # client does not hold up the requests waiting for the entry.
+        if response.status_code == 200 and segment_cache is not None and segment_cache.is_cacheable(target_path):
+            chunks = segment_cache.fill_in_background(
+                target_path, chunks,
+                expected_length=int(content_length) if content_length else None,
+                etag=response.headers.get('ETag'),
+                on_done=on_close
+            )
+            on_close = []
+
+        chunks = ClosingIterator(chunks, on_close)
+
+        flask_response = Response(chunks, status=response.status_code, direct_passthrough=True)
+        flask_response.headers['Content-Type'] = content_type
+        if content_length:
+            flask_response.headers['Content-Length'] = content_length
+        for name in RELAYED_RESPONSE_HEADERS:
+            if name in response.headers:
+                flask_response.headers[name] = response.headers[name]
+        flask_response.headers.update(PROXY_RESPONSE_HEADERS)
+
+        return flask_response
 
     return app
 
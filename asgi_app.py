@@ -0,0 +1,269 @@
+import os
+import time
+import logging
+import contextlib
+from typing import List
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from access_log import AccessLog, AccessLogMiddleware, configure_logging
+from metrics import MetricsRegistry
+from circuit_breaker import CircuitOpenError
+from concurrency_limit import AdaptiveConcurrencyLimit, ConcurrencyLimitExceeded
+from hedging import HedgePolicy
+from origin_pool import OriginPool
+from upstream import DEFAULT_HEADERS
+from playlist_cache import ExpiringSet, PlaylistCache
+from proxy_common import (
+    FORWARDED_REQUEST_HEADERS, PROXY_RESPONSE_HEADERS, RELAYED_RESPONSE_HEADERS, STREAM_CHUNK_SIZE, PlaylistBody,
+    extract_video_name, get_content_type, precomputed_playlist_path, retry_after_header, validate_m3u8
+)
+from config import (
+    ACCESS_LOG_CONFIG, CDN_ORIGIN_URLS, HEDGE_CONFIG, LOGGING_CONFIG, METRICS_CONFIG, ORIGIN_POOL_CONFIG,
+    PROXY_UPSTREAM_CONFIG, PLAYLIST_CACHE_CONFIG, UPSTREAM_CONCURRENCY_LIMIT_CONFIG, UPSTREAM_CONCURRENCY_LIMIT_ENABLED
+)
+
+# Async alternative to the Flask app for the /proxy route. A slow CDN fetch
+# only parks a coroutine instead of a whole sync worker. Select it from the
+# start command:
+#   python -m gunicorn asgi_app:app --worker-class uvicorn.workers.UvicornWorker --workers 4 ...
+# or run it directly with `python asgi_app.py`.
+
+configure_logging(**LOGGING_CONFIG)
+logger = logging.getLogger(__name__)
+
+
+def create_async_client() -> httpx.AsyncClient:
+    """Create the pooled upstream client for this worker's event loop"""
+    return httpx.AsyncClient(
+        headers=DEFAULT_HEADERS,
+        limits=httpx.Limits(
+            max_connections=PROXY_UPSTREAM_CONFIG['pool_maxsize'],
+            max_keepalive_connections=PROXY_UPSTREAM_CONFIG['pool_maxsize']
+        ),
+        timeout=httpx.Timeout(
+            PROXY_UPSTREAM_CONFIG['read_timeout'],
+            connect=PROXY_UPSTREAM_CONFIG['connect_timeout']
+        ),
+        # httpx only retries failed connection attempts, which matches the
+        # sync client's policy of never retrying a read timeout
+        transport=httpx.AsyncHTTPTransport(retries=PROXY_UPSTREAM_CONFIG['max_retries'])
+    )
+
+
+def create_app(cdn_origins: List[str] = None):
+    """Create and configure the ASGI application, proxying to cdn_origins"""
+    origins = OriginPool(
+        cdn_origins or CDN_ORIGIN_URLS, hedging=HedgePolicy(**HEDGE_CONFIG),
+        concurrency_limit=AdaptiveConcurrencyLimit(**UPSTREAM_CONCURRENCY_LIMIT_CONFIG)
+        if UPSTREAM_CONCURRENCY_LIMIT_ENABLED else None,
+        **ORIGIN_POOL_CONFIG
+    )
+    playlist_cache = PlaylistCache(**PLAYLIST_CACHE_CONFIG)
+    legacy_playlists = ExpiringSet(PLAYLIST_CACHE_CONFIG['max_entries'], PLAYLIST_CACHE_CONFIG['ttl'])
+    access_log = AccessLog(**ACCESS_LOG_CONFIG)
+    metrics = MetricsRegistry(**METRICS_CONFIG)
+    state = {}
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        state['client'] = create_async_client()
+        try:
+            yield
+        finally:
+            await state['client'].aclose()
+
+    def error_response(error, message, status_code, headers=None):
+        return JSONResponse({"error": error, "message": message}, status_code=status_code, headers=headers)
+
+    def relayed_headers(response):
+        headers = dict(PROXY_RESPONSE_HEADERS)
+        for name in RELAYED_RESPONSE_HEADERS:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        return headers
+
+    def playlist_response(request, body, target_path, etag=None):
+        headers = dict(PROXY_RESPONSE_HEADERS)
+        if etag:
+            headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                return Response(status_code=304, headers=headers)
+        headers['Content-Type'] = get_content_type(target_path)
+        return Response(body, headers=headers)
+
+    async def health_check(request):
+        """Lightweight health check endpoint"""
+        return JSONResponse({"status": "healthy"})
+
+    async def metrics_endpoint(request):
+        """Request, cache and upstream metrics for all workers, in Prometheus text format"""
+        return Response(metrics.render(), media_type='text/plain; version=0.0.4')
+
+    async def proxy_request(request):
+        """Handle proxy requests to CDN"""
+        target_path = request.path_params['target_path']
+        access = request.scope.get('access', {})
+        try:
+            video_name = extract_video_name(target_path)
+            if video_name is None:
+                logger.error(f"Invalid path format: {target_path}")
+                return error_response("Invalid path", "Could not extract video name", 400)
+
+            # Serve playlists from the cache, revalidating stale entries upstream
+            cached = None
+            upstream_path = target_path
+            if target_path.endswith('.m3u8'):
+                cached = playlist_cache.get(target_path)
+                if cached is not None and cached.is_fresh():
+                    access['cache'] = 'hit'
+                    return playlist_response(request, cached.body, target_path, cached.etag)
+                if cached is not None and not cached.can_revalidate():
+                    cached = None
+
+                # Prefer the proxy-ready variant published at ingest
+                if cached is not None:
+                    upstream_path = cached.upstream_path or target_path
+                elif target_path not in legacy_playlists:
+                    upstream_path = precomputed_playlist_path(target_path) or target_path
+
+            client = state['client']
+            access['cache'] = 'miss'
+            try:
+                # Playlists are revalidated with the cache's own validators;
+                # segment requests carry the client's Range/conditional headers
+                if target_path.endswith('.m3u8'):
+                    upstream_headers = cached.validator_headers() if cached else None
+                else:
+                    upstream_headers = {
+                        name: request.headers[name]
+                        for name in FORWARDED_REQUEST_HEADERS
+                        if name in request.headers
+                    }
+
+                upstream_started = time.perf_counter()
+                response = await origins.get_async(client, upstream_path, headers=upstream_headers)
+
+                if upstream_path != target_path and response.status_code in (403, 404):
+                    await response.aclose()
+                    legacy_playlists.add(target_path)
+                    cached = None
+                    upstream_path = target_path
+                    response = await origins.get_async(client, target_path)
+                    access['variant'] = 'legacy'
+                access['upstream_status'] = response.status_code
+                access['upstream_ms'] = (time.perf_counter() - upstream_started) * 1000
+
+                if response.status_code == 501:
+                    logger.error("CDN returned 501 Not Implemented - retrying without compression")
+                    await response.aclose()
+                    response = await origins.get_async(client, upstream_path, headers={'Accept-Encoding': 'identity'})
+                    if response.status_code != 200:
+                        await response.aclose()
+                        error_msg = f"CDN retry failed with status {response.status_code}"
+                        logger.error(error_msg)
+                        return error_response("CDN Error", error_msg, response.status_code)
+
+                if response.status_code == 304 and cached is not None:
+                    await response.aclose()
+                    playlist_cache.refresh(cached)
+                    access['cache'] = 'revalidated'
+                    return playlist_response(request, cached.body, target_path, cached.etag)
+
+                if response.status_code == 304 and not target_path.endswith('.m3u8'):
+                    await response.aclose()
+                    return Response(status_code=304, headers=relayed_headers(response))
+
+                if response.status_code not in (200, 206):
+                    content = await response.aread()
+                    await response.aclose()
+                    error_msg = f"CDN returned status {response.status_code}"
+                    if content:
+                        error_msg += f": {content.decode('utf-8', errors='ignore')}"
+                    logger.error(error_msg)
+                    return error_response("CDN Error", error_msg, response.status_code)
+
+                # Segments and keys are relayed chunk by chunk as they arrive
+                if not target_path.endswith('.m3u8'):
+                    headers = relayed_headers(response)
+                    if response.headers.get('Content-Length'):
+                        headers['Content-Length'] = response.headers['Content-Length']
+                    return StreamingResponse(
+                        response.aiter_bytes(STREAM_CHUNK_SIZE),
+                        status_code=response.status_code,
+                        headers=headers,
+                        media_type=get_content_type(target_path),
+                        background=BackgroundTask(response.aclose)
+                    )
+
+                # Modify URLs as the playlist arrives, unless ingest already did
+                dump_bodies = access_log.sample_body()
+                rewrite_uris = upstream_path == target_path
+                playlist = PlaylistBody(target_path, rewrite=rewrite_uris, keep_original=dump_bodies)
+                try:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        playlist.feed(chunk)
+                finally:
+                    await response.aclose()
+                body = playlist.finish()
+                if rewrite_uris:
+                    metrics.observe('proxy_stage_duration_seconds', playlist.rewrite_seconds, stage='rewrite_playlist')
+
+                validation_error = validate_m3u8(playlist.head)
+                if validation_error:
+                    logger.error(validation_error)
+                    return error_response("Invalid Content", validation_error, 500)
+
+                if dump_bodies:
+                    access_log.dump_body("Original playlist", target_path, playlist.original())
+                    access_log.dump_body("Rewritten playlist", target_path, body)
+                entry = playlist_cache.put(
+                    target_path, body,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    upstream_path=upstream_path
+                )
+                return playlist_response(request, body, target_path, entry.etag)
+
+            except (CircuitOpenError, ConcurrencyLimitExceeded) as e:
+                # Fail fast rather than pile up requests on a struggling CDN
+                access['shed'] = 'circuit' if isinstance(e, CircuitOpenError) else 'limit'
+                return error_response(
+                    "Service Unavailable", str(e), 503, headers={'Retry-After': retry_after_header(e.retry_after)}
+                )
+            except httpx.TimeoutException:
+                logger.error(f"Timeout while fetching: {upstream_path}")
+                return error_response("Gateway Timeout", "Request to CDN timed out", 504)
+            except httpx.HTTPError as e:
+                logger.error(f"Request error: {str(e)}")
+                return error_response("CDN Request Failed", str(e), 502)
+
+        except Exception as e:
+            logger.error(f"Proxy error: {str(e)}", exc_info=True)
+            return error_response("Internal Server Error", str(e), 500)
+
+    return Starlette(
+        routes=[
+            Route('/health', health_check),
+            Route('/metrics', metrics_endpoint),
+            Route('/proxy/{target_path:path}', proxy_request)
+        ],
+        middleware=[
+            Middleware(AccessLogMiddleware, access_log=access_log, metrics=metrics),
+            Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'OPTIONS'], allow_headers=['*'])
+        ],
+        lifespan=lifespan
+    )
+
+
+# Create the application instance
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.environ.get('PORT', 8000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
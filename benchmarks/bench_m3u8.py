@@ -0,0 +1,75 @@
+"""Micro-benchmark for the playlist rewriter on large playlists.
+
+    python benchmarks/bench_m3u8.py [--segments 10000] [--rounds 20]
+
+Rewrites a VOD media playlist with the given number of AES-128 segments
+(plus EXT-X-MAP and key rotation tags) and its I-frame playlist, and
+reports throughput for the in-memory and the chunked streaming paths.
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m3u8_parser import PlaylistRewriter, rewrite_playlist  # noqa: E402
+
+PLAYLIST_PATH = 'videos/benchmark/720p/stream.m3u8'
+
+
+def media_playlist(segments: int, key_every: int = 500) -> bytes:
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:4',
+             '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-MAP:URI="init.mp4"']
+    for i in range(segments):
+        if i % key_every == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="../key.key",IV=0x{i:032x}')
+        lines.append('#EXTINF:4.000000,')
+        lines.append(f'segments/segment_{i:05d}.ts')
+    lines.append('#EXT-X-ENDLIST')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def iframe_playlist(segments: int) -> bytes:
+    lines = ['#EXTM3U', '#EXT-X-VERSION:4', '#EXT-X-TARGETDURATION:4', '#EXT-X-I-FRAMES-ONLY']
+    for i in range(segments):
+        lines.append('#EXTINF:4.000000,')
+        lines.append('#EXT-X-BYTERANGE:188000@0')
+        lines.append(f'segments/segment_{i:05d}.ts')
+    lines.append('#EXT-X-ENDLIST')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def chunked(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def measure(label: str, fn, body: bytes, segments: int, rounds: int):
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds
+    print(f"{label:<28} {elapsed * 1000:8.2f} ms  "
+          f"{len(body) / elapsed / 1e6:8.1f} MB/s  {segments / elapsed:12,.0f} segments/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    for name, body in (('media', media_playlist(args.segments)), ('i-frame', iframe_playlist(args.segments))):
+        print(f"{name} playlist: {args.segments} segments, {len(body) / 1024:.0f} KiB")
+        chunks = chunked(body, args.chunk_size)
+        rewriter = PlaylistRewriter('videos/benchmark/720p')
+        measure('  rewrite_playlist (bytes)', lambda: rewrite_playlist(body, PLAYLIST_PATH),
+                body, args.segments, args.rounds)
+        measure('  rewrite (streamed chunks)', lambda: sum(map(len, rewriter.rewrite(chunks))),
+                body, args.segments, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Local stand-in for the CDN, serving synthetic HLS titles.
+
+    python benchmarks/fake_cdn.py --port 9000 --latency-ms 20 --slow-fraction 0.01
+
+Every title under /videos/<name>/ exists: stream.m3u8 lists --segments
+AES-128 segments of --segment-kb each, plus key.key. Responses are delayed
+by --latency-ms (+/- --jitter-ms), a --slow-fraction of them by a further
+--slow-ms to model a degraded edge, and bodies are paced to
+--bandwidth-mbps. Segments honour Range and If-None-Match like the real CDN.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from m3u8_parser import rewrite_playlist  # noqa: E402
+
+WRITE_CHUNK_SIZE = 64 * 1024
+
+PATH_PATTERN = re.compile(r'^/videos/([^/]+)/(.+)$')
+
+
+class FakeCDNSettings:
+    def __init__(self, segments: int = 60, segment_kb: int = 512, latency_ms: float = 20, jitter_ms: float = 5,
+                 slow_fraction: float = 0.0, slow_ms: float = 500, bandwidth_mbps: float = 0,
+                 precomputed: bool = False):
+        self.segments = segments
+        self.segment_bytes = segment_kb * 1024
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_fraction = slow_fraction
+        self.slow_ms = slow_ms
+        self.bandwidth_mbps = bandwidth_mbps
+        self.precomputed = precomputed
+        # Every title shares one segment body; only its length matters
+        self.segment_body = bytes(random.getrandbits(8) for _ in range(256)) * (self.segment_bytes // 256 + 1)
+        self.segment_body = self.segment_body[:self.segment_bytes]
+        self.requests = 0
+        self.slow_requests = 0
+        self.lock = threading.Lock()
+
+    def delay(self) -> float:
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        slow = random.random() < self.slow_fraction
+        if slow:
+            delay += self.slow_ms
+        with self.lock:
+            self.requests += 1
+            self.slow_requests += slow
+        return max(delay, 0) / 1000
+
+    def playlist(self, name: str) -> bytes:
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6',
+                 '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-KEY:METHOD=AES-128,URI="key.key"']
+        for i in range(self.segments):
+            lines.append('#EXTINF:6.000000,')
+            lines.append(f'segments/segment_{i:03d}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "slow_requests": self.slow_requests}
+
+
+class FakeCDNHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings: FakeCDNSettings = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # The proxy closed a kept-alive connection, e.g. a hedge's loser
+            self.close_connection = True
+
+    def do_HEAD(self):
+        self.do_GET(head_only=True)
+
+    def do_GET(self, head_only=False):
+        time.sleep(self.settings.delay())
+        match = PATH_PATTERN.match(self.path.split('?', 1)[0])
+        if not match:
+            return self.send_body(404, b'Not Found', 'text/plain')
+        name, rest = match.groups()
+
+        if rest == 'stream.m3u8':
+            return self.send_body(200, self.settings.playlist(name), 'application/vnd.apple.mpegurl', head_only)
+        if rest == 'stream.proxy.m3u8':
+            if not self.settings.precomputed:
+                return self.send_body(404, b'Not Found', 'text/plain')
+            body = rewrite_playlist(self.settings.playlist(name), f'videos/{name}/stream.m3u8')
+            return self.send_body(200, body, 'application/vnd.apple.mpegurl', head_only)
+        if rest == 'key.key':
+            return self.send_body(200, b'k' * 16, 'application/octet-stream', head_only)
+        if rest.startswith('segments/') and rest.endswith('.ts'):
+            return self.send_segment(head_only)
+        return self.send_body(404, b'Not Found', 'text/plain')
+
+    def send_segment(self, head_only):
+        body = self.settings.segment_body
+        etag = f'"{len(body)}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        range_match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if range_match and range_match.group(1):
+            start = int(range_match.group(1))
+            end = min(int(range_match.group(2) or len(body) - 1), len(body) - 1)
+            self.send_body(206, body[start:end + 1], 'video/mp2t', head_only, etag=etag,
+                           extra={'Content-Range': f'bytes {start}-{end}/{len(body)}'})
+        else:
+            self.send_body(200, body, 'video/mp2t', head_only, etag=etag)
+
+    def send_body(self, status, body, content_type, head_only=False, etag=None, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if etag:
+            self.send_header('ETag', etag)
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if head_only:
+            return
+
+        bytes_per_second = self.settings.bandwidth_mbps * 125000
+        view = memoryview(body)
+        try:
+            for offset in range(0, len(body), WRITE_CHUNK_SIZE):
+                chunk = view[offset:offset + WRITE_CHUNK_SIZE]
+                self.wfile.write(chunk)
+                if bytes_per_second:
+                    time.sleep(len(chunk) / bytes_per_second)
+        except (BrokenPipeError, ConnectionResetError):
+            # The proxy gave up on this response (timeout or a hedge won)
+            self.close_connection = True
+
+
+def start_fake_cdn(settings: FakeCDNSettings, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Serve settings on a background thread; server.server_address has the bound port"""
+    handler = type('BoundFakeCDNHandler', (FakeCDNHandler,), {'settings': settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-cdn', daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group('fake CDN')
+    group.add_argument('--segments', type=int, default=60, help='segments per title')
+    group.add_argument('--segment-kb', type=int, default=512)
+    group.add_argument('--latency-ms', type=float, default=20, help='time to first byte of every response')
+    group.add_argument('--jitter-ms', type=float, default=5)
+    group.add_argument('--slow-fraction', type=float, default=0.0, help='fraction of responses delayed by --slow-ms')
+    group.add_argument('--slow-ms', type=float, default=500)
+    group.add_argument('--bandwidth-mbps', type=float, default=0, help='per-response body rate, 0 for unlimited')
+    group.add_argument('--precomputed', action='store_true', help='also serve ingest-style .proxy.m3u8 variants')
+
+
+def settings_from_args(args) -> FakeCDNSettings:
+    return FakeCDNSettings(
+        segments=args.segments, segment_kb=args.segment_kb, latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms, slow_fraction=args.slow_fraction, slow_ms=args.slow_ms,
+        bandwidth_mbps=args.bandwidth_mbps, precomputed=args.precomputed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_fake_cdn(settings_from_args(args), args.host, args.port)
+    print(f"Fake CDN on http://{args.host}:{server.server_address[1]} (CDN_ORIGIN_URL)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
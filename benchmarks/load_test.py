@@ -0,0 +1,320 @@
+"""Load test for the proxy against a local fake CDN.
+
+    python benchmarks/load_test.py --viewers 50 --duration 30 --output run.json
+
+Starts benchmarks/fake_cdn.py on a free port, starts the proxy pointed at
+it through CDN_ORIGIN_URL (gunicorn with --workers, like the Procfile),
+and runs --viewers simulated HLS viewers. Each one fetches a title's
+playlist and then its key and segments in order, moving on to the next
+title at the end. The report is JSON: request rate, throughput and
+p50/p95/p99 latency per request kind, plus the RSS of every worker.
+Compare reports from before and after a change.
+
+--engine asgi runs asgi_app under uvicorn workers instead, --engine dev
+runs `python app.py` where gunicorn is not installed, and --proxy-url
+skips starting a proxy and loads an already running one.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_cdn import add_arguments, settings_from_args, start_fake_cdn  # noqa: E402
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def proxy_command(engine: str, workers: int, port: int) -> list:
+    bind = f'127.0.0.1:{port}'
+    if engine == 'flask':
+        return [sys.executable, '-m', 'gunicorn', 'app:app', '--workers', str(workers), '--bind', bind]
+    if engine == 'asgi':
+        return [sys.executable, '-m', 'gunicorn', 'asgi_app:app', '--worker-class', 'uvicorn.workers.UvicornWorker',
+                '--workers', str(workers), '--bind', bind]
+    return [sys.executable, 'app.py']
+
+
+def wait_until_healthy(proxy_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Proxy exited with status {process.returncode} during startup")
+        try:
+            if requests.get(f'{proxy_url}/health', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Proxy at {proxy_url} did not become healthy within {timeout}s")
+
+
+def process_tree(root_pid: int) -> list:
+    """root_pid and all its descendants, from /proc (Linux only)"""
+    children = defaultdict(list)
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children[ppid].append(int(entry))
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def rss_bytes(pid: int):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class MemorySampler:
+    """Samples the RSS of every process in the proxy's tree once a second"""
+
+    def __init__(self, root_pid: int, interval: float = 1.0):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return {
+            str(pid): {
+                "role": "master" if pid == self.root_pid and len(self.peak) > 1 else "worker",
+                "rss_mb_peak": round(self.peak[pid] / 2 ** 20, 1),
+                "rss_mb_end": round(self.last[pid] / 2 ** 20, 1) if pid in self.last else None
+            }
+            for pid in sorted(self.peak)
+        }
+
+    def _sample(self):
+        current = {}
+        for pid in process_tree(self.root_pid):
+            rss = rss_bytes(pid)
+            if rss is not None:
+                current[pid] = rss
+                self.peak[pid] = max(self.peak.get(pid, 0), rss)
+        self.last = current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # kind -> [(total, ttfb, bytes, ok)]
+        self.errors = defaultdict(int)
+
+    def add(self, kind: str, total: float, ttfb: float, size: int, status: int):
+        with self.lock:
+            self.samples[kind].append((total, ttfb, size, status < 400))
+            if status >= 400:
+                self.errors[str(status)] += 1
+
+    def error(self, reason: str):
+        with self.lock:
+            self.errors[reason] += 1
+
+
+def fetch(session, url: str, kind: str, recorder: Recorder, timeout: float) -> bytes:
+    started = time.perf_counter()
+    try:
+        with session.get(url, stream=True, timeout=timeout) as response:
+            ttfb = time.perf_counter() - started
+            body = b''.join(response.iter_content(READ_CHUNK_SIZE)) if kind == 'playlist' else None
+            size = len(body) if body is not None else sum(len(c) for c in response.iter_content(READ_CHUNK_SIZE))
+            recorder.add(kind, time.perf_counter() - started, ttfb, size, response.status_code)
+            return body if response.status_code == 200 else None
+    except requests.Timeout:
+        recorder.error('timeout')
+    except requests.RequestException as e:
+        recorder.error(type(e).__name__)
+    return None
+
+
+def viewer(proxy_url: str, titles: list, deadline: float, pace: float, timeout: float, recorder: Recorder):
+    session = requests.Session()
+    title_index = random.randrange(len(titles))
+    while time.monotonic() < deadline:
+        title = titles[title_index % len(titles)]
+        title_index += 1
+        playlist = fetch(session, f'{proxy_url}/proxy/videos/{title}/stream.m3u8', 'playlist', recorder, timeout)
+        if playlist is None:
+            time.sleep(0.5)
+            continue
+        for line in playlist.decode('utf-8', errors='replace').splitlines():
+            if time.monotonic() >= deadline:
+                break
+            if line.startswith('#EXT-X-KEY') and 'URI="' in line:
+                fetch(session, proxy_url + line.split('URI="', 1)[1].split('"', 1)[0], 'key', recorder, timeout)
+            elif line and not line.startswith('#'):
+                fetch(session, proxy_url + line, 'segment', recorder, timeout)
+                if pace:
+                    time.sleep(pace)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    totals = sorted(sample[0] for sample in samples)
+    ttfbs = sorted(sample[1] for sample in samples)
+    size = sum(sample[2] for sample in samples)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": len(samples),
+        "failed": sum(1 for sample in samples if not sample[3]),
+        "requests_per_second": round(len(samples) / elapsed, 1),
+        "throughput_mbps": round(size * 8 / elapsed / 1e6, 2),
+        "latency_ms": {
+            "p50": ms(percentile(totals, 0.50)), "p95": ms(percentile(totals, 0.95)),
+            "p99": ms(percentile(totals, 0.99)), "max": ms(totals[-1] if totals else None)
+        },
+        "ttfb_ms": {
+            "p50": ms(percentile(ttfbs, 0.50)), "p95": ms(percentile(ttfbs, 0.95)),
+            "p99": ms(percentile(ttfbs, 0.99)), "max": ms(ttfbs[-1] if ttfbs else None)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', choices=('flask', 'asgi', 'dev'), default='flask')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--proxy-url', help='load an already running proxy instead of starting one')
+    parser.add_argument('--viewers', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after warm-up')
+    parser.add_argument('--titles', type=int, default=10)
+    parser.add_argument('--pace', type=float, default=0, help='seconds between a viewer\'s segments, 0 for none')
+    parser.add_argument('--timeout', type=float, default=60, help='client timeout per request')
+    parser.add_argument('--proxy-log', help='file for the proxy\'s output (discarded by default)')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    settings = settings_from_args(args)
+    cdn = start_fake_cdn(settings)
+    cdn_url = f'http://127.0.0.1:{cdn.server_address[1]}'
+
+    process = None
+    proxy_log = open(args.proxy_log, 'ab') if args.proxy_log else subprocess.DEVNULL
+    if args.proxy_url:
+        proxy_url = args.proxy_url.rstrip('/')
+    else:
+        port = free_port()
+        proxy_url = f'http://127.0.0.1:{port}'
+        env = dict(
+            os.environ, CDN_ORIGIN_URL=cdn_url, PORT=str(port),
+            METRICS_DIR=os.environ.get('METRICS_DIR') or tempfile.mkdtemp(prefix='proxy-metrics-')
+        )
+        process = subprocess.Popen(
+            proxy_command(args.engine, args.workers, port), cwd=REPO_DIR, env=env,
+            stdout=proxy_log, stderr=subprocess.STDOUT
+        )
+
+    try:
+        wait_until_healthy(proxy_url, process)
+        sampler = MemorySampler(process.pid) if process is not None else None
+        if sampler is not None:
+            sampler.start()
+
+        recorder = Recorder()
+        titles = [f'bench{i:03d}' for i in range(args.titles)]
+        started = time.monotonic()
+        deadline = started + args.duration
+        threads = [
+            threading.Thread(target=viewer, args=(proxy_url, titles, deadline, args.pace, args.timeout, recorder),
+                             daemon=True)
+            for _ in range(args.viewers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        all_samples = [sample for samples in recorder.samples.values() for sample in samples]
+        report = {
+            "config": {
+                "engine": None if args.proxy_url else args.engine,
+                "workers": None if args.proxy_url else args.workers,
+                "viewers": args.viewers, "duration": args.duration, "titles": args.titles, "pace": args.pace,
+                "cdn": {
+                    "segments": args.segments, "segment_kb": args.segment_kb, "latency_ms": args.latency_ms,
+                    "jitter_ms": args.jitter_ms, "slow_fraction": args.slow_fraction, "slow_ms": args.slow_ms,
+                    "bandwidth_mbps": args.bandwidth_mbps, "precomputed": args.precomputed
+                }
+            },
+            "elapsed_seconds": round(elapsed, 2),
+            "overall": summarize(all_samples, elapsed),
+            "by_kind": {kind: summarize(samples, elapsed) for kind, samples in sorted(recorder.samples.items())},
+            "errors": dict(recorder.errors),
+            "cdn": settings.stats(),
+            "memory": sampler.stop() if sampler is not None else None
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        cdn.shutdown()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
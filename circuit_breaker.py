@@ -0,0 +1,128 @@
+import time
+import threading
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request through an open circuit"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one upstream.
+
+    Closed, requests flow and failure_threshold failures in a row open the
+    circuit. Open, requests fail fast for reset_timeout seconds. After
+    that it is half-open: up to half_open_probes requests go through, and
+    the first result decides. A success closes the circuit; a failure opens
+    it again for twice as long (up to max_reset_timeout), so an origin that
+    stays down is probed less and less often.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 10, max_reset_timeout: float = 120,
+                 half_open_probes: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.half_open_probes = half_open_probes
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._open_for = reset_timeout
+        self._probes = 0
+        self.consecutive_failures = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._expire()
+            return self._state
+
+    def _expire(self):
+        if self._state == OPEN and time.monotonic() >= self._opened_at + self._open_for:
+            self._state = HALF_OPEN
+            self._probes = 0
+
+    def available(self) -> bool:
+        """Whether acquire() would currently let a request through"""
+        with self._lock:
+            self._expire()
+            return self._state == CLOSED or (self._state == HALF_OPEN and self._probes < self.half_open_probes)
+
+    def acquire(self) -> bool:
+        """Admit a request, taking a probe slot when half-open"""
+        with self._lock:
+            self._expire()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def release(self):
+        """Give back a probe slot for a request abandoned without a result"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self) -> bool:
+        """Count a success; True when it closed the circuit"""
+        with self._lock:
+            self.consecutive_failures = 0
+            if self._state == CLOSED:
+                return False
+            self._state = CLOSED
+            self._open_for = self.reset_timeout
+            return True
+
+    def record_failure(self) -> bool:
+        """Count a failure; True when it opened the circuit"""
+        with self._lock:
+            self._expire()
+            self.consecutive_failures += 1
+            if self._state == HALF_OPEN:
+                self._trip(min(self._open_for * 2, self.max_reset_timeout))
+                return True
+            if self._state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._trip(self.reset_timeout)
+                return True
+            return False
+
+    def trip(self) -> bool:
+        """Open the circuit now, e.g. on a failed health check; True if it was not open"""
+        with self._lock:
+            self._expire()
+            if self._state == OPEN:
+                return False
+            self._trip(self._open_for if self._state == HALF_OPEN else self.reset_timeout)
+            return True
+
+    def allow_probe(self):
+        """Skip the rest of the open period, e.g. once a health check passes"""
+        with self._lock:
+            if self._state == OPEN:
+                self._state = HALF_OPEN
+                self._probes = 0
+
+    def _trip(self, open_for: float):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._open_for = open_for
+        self.times_opened += 1
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a probe through"""
+        with self._lock:
+            self._expire()
+            if self._state != OPEN:
+                return 0.0
+            return max(self._opened_at + self._open_for - time.monotonic(), 0.0)
@@ -0,0 +1,63 @@
+import threading
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Raised instead of starting an upstream request over the limit"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveConcurrencyLimit:
+    """AIMD limit on concurrent upstream requests in one worker process.
+
+    A request over the limit is rejected at once rather than queued. Each
+    success answered within latency_threshold seconds, while at least half
+    the limit is in use, raises the limit by 1/limit (about one per round
+    of `limit` requests). A failure or a slower answer multiplies it by
+    backoff_ratio. When the CDN slows down the limit shrinks towards
+    min_limit, so the worker sheds the excess instead of parking it in
+    upstream timeouts, and it grows back as the CDN recovers.
+    """
+
+    def __init__(self, initial_limit: float = 32, min_limit: float = 4, max_limit: float = 256,
+                 backoff_ratio: float = 0.9, latency_threshold: float = 2.0, retry_after: float = 1):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_threshold = latency_threshold
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float = None, dropped: bool = False):
+        """Finish a request; latency None releases it without adjusting the limit"""
+        with self._lock:
+            busy = self.in_flight
+            self.in_flight -= 1
+            if latency is None:
+                return
+            if dropped or latency > self.latency_threshold:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif busy * 2 >= self.limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": round(self.limit, 1),
+                "in_flight": self.in_flight,
+                "rejected": self.rejected
+            }
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -27,9 +28,81 @@ LEASEWEB_CDN_CONFIG = {
     'region': os.getenv('LEASEWEB_REGION', 'nl')
 }
 
-# Validate required configuration
-if not LEASEWEB_CONTROL_CONFIG['access_key'] or not LEASEWEB_CONTROL_CONFIG['secret_key']:
-    raise ValueError("Missing required environment variables: LEASEWEB_ACCESS_KEY and/or LEASEWEB_SECRET_KEY")
+# Public CDN the proxy fetches playlists, keys and segments from; point it
+# at a local stand-in (see benchmarks/) to load-test the proxy
+CDN_ORIGIN_URL = os.getenv('CDN_ORIGIN_URL', 'https://di-yusrkfqf.leasewebultracdn.com').rstrip('/')
+
+# Origins serving the same content, tried in latency order and failed over
+# to; CDN_ORIGIN_URLS (comma-separated) replaces the single origin above
+CDN_ORIGIN_URLS = [
+    url.strip().rstrip('/') for url in os.getenv('CDN_ORIGIN_URLS', CDN_ORIGIN_URL).split(',') if url.strip()
+]
+ORIGIN_POOL_CONFIG = {
+    'health_check_interval': float(os.getenv('ORIGIN_HEALTH_CHECK_INTERVAL', '10')),
+    'health_check_path': os.getenv('ORIGIN_HEALTH_CHECK_PATH', '/'),
+    'health_check_timeout': float(os.getenv('ORIGIN_HEALTH_CHECK_TIMEOUT', '2')),
+    # Circuit breaker: consecutive failures that open an origin's circuit,
+    # and how long it then fails fast before a probe (doubling, up to the
+    # max, while probes keep failing)
+    'failure_threshold': int(os.getenv('ORIGIN_FAILURE_THRESHOLD', '3')),
+    'circuit_reset_timeout': float(os.getenv('ORIGIN_CIRCUIT_RESET_TIMEOUT', '10')),
+    'circuit_max_reset_timeout': float(os.getenv('ORIGIN_CIRCUIT_MAX_RESET_TIMEOUT', '120')),
+    'ewma_alpha': float(os.getenv('ORIGIN_LATENCY_EWMA_ALPHA', '0.3')),
+    'hedge_workers': int(os.getenv('ORIGIN_HEDGE_WORKERS', '16'))
+}
+
+# Hedged upstream GETs: a request still waiting for headers after
+# ORIGIN_HEDGE_AFTER_MS, or else after the ORIGIN_HEDGE_PERCENTILE of recent
+# response times (never below ORIGIN_HEDGE_MIN_MS), is sent a second time and
+# the first response wins. ORIGIN_HEDGE_BUDGET caps hedges as a fraction of
+# all GETs (e.g. 0.05); it defaults to 0, which turns hedging off, since
+# every hedge is an extra request to the CDN
+HEDGE_CONFIG = {
+    'fixed_delay': float(os.getenv('ORIGIN_HEDGE_AFTER_MS', '0')) / 1000,
+    'percentile': float(os.getenv('ORIGIN_HEDGE_PERCENTILE', '95')),
+    'min_delay': float(os.getenv('ORIGIN_HEDGE_MIN_MS', '10')) / 1000,
+    'window': int(os.getenv('ORIGIN_HEDGE_WINDOW', '1000')),
+    'min_samples': int(os.getenv('ORIGIN_HEDGE_MIN_SAMPLES', '100')),
+    'budget': float(os.getenv('ORIGIN_HEDGE_BUDGET', '0')),
+    'burst': float(os.getenv('ORIGIN_HEDGE_BURST', '10'))
+}
+
+# Adaptive (AIMD) cap on upstream requests in flight per worker. Requests
+# over it get a 503 with Retry-After instead of queueing; the cap shrinks
+# while upstream requests fail or take longer than
+# UPSTREAM_LIMIT_LATENCY_MS, and grows back while they succeed. Off by
+# default: a sync gunicorn worker (the Procfile/railway.toml command) only
+# ever has one request in flight, so the cap never bites. Enable it with
+# --worker-class gthread or the ASGI engine (asgi_app.py)
+UPSTREAM_CONCURRENCY_LIMIT_ENABLED = os.getenv('UPSTREAM_CONCURRENCY_LIMIT_ENABLED', 'false').lower() == 'true'
+UPSTREAM_CONCURRENCY_LIMIT_CONFIG = {
+    'initial_limit': float(os.getenv('UPSTREAM_LIMIT_INITIAL', '32')),
+    'min_limit': float(os.getenv('UPSTREAM_LIMIT_MIN', '4')),
+    'max_limit': float(os.getenv('UPSTREAM_LIMIT_MAX', '256')),
+    'backoff_ratio': float(os.getenv('UPSTREAM_LIMIT_BACKOFF_RATIO', '0.9')),
+    'latency_threshold': float(os.getenv('UPSTREAM_LIMIT_LATENCY_MS', '2000')) / 1000,
+    'retry_after': float(os.getenv('UPSTREAM_LIMIT_RETRY_AFTER', '1'))
+}
+
+# Storage credentials are validated by LeasewebStorageHandler so that the
+# proxy can import this module without them
+
+# Parallel upload tuning for LeasewebStorageHandler
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '8'))
+UPLOAD_MAX_RETRIES = int(os.getenv('UPLOAD_MAX_RETRIES', '3'))
+UPLOAD_RETRY_BACKOFF = float(os.getenv('UPLOAD_RETRY_BACKOFF', '0.5'))
+
+# How long bucket listings used to diff local output against storage stay cached
+INVENTORY_CACHE_TTL = float(os.getenv('INVENTORY_CACHE_TTL', '300'))
+
+# Upload segments while ffmpeg is still producing them
+PIPELINED_UPLOAD = os.getenv('PIPELINED_UPLOAD', 'false').lower() == 'true'
+
+# Batch ingest: titles processed at once, and separate caps on concurrent
+# ffmpeg runs (CPU-bound) and concurrent title uploads (network-bound)
+INGEST_PARALLEL_VIDEOS = int(os.getenv('INGEST_PARALLEL_VIDEOS', '1'))
+INGEST_FFMPEG_CONCURRENCY = int(os.getenv('INGEST_FFMPEG_CONCURRENCY', str(max((os.cpu_count() or 2) // 2, 1))))
+INGEST_UPLOAD_CONCURRENCY = int(os.getenv('INGEST_UPLOAD_CONCURRENCY', '2'))
 
 # Directory Configuration
 INPUT_DIR = BASE_DIR / 'input'
@@ -37,5 +110,96 @@ OUTPUT_DIR = BASE_DIR / 'output'
 
 # FFmpeg Configuration (optional in production)
 FFMPEG_PATH = os.getenv('FFMPEG_PATH', r"C:\ffmpeg\ffmpeg.exe")
+# ffprobe normally sits next to ffmpeg
+FFPROBE_PATH = os.getenv('FFPROBE_PATH', 'ffprobe'.join(FFMPEG_PATH.rsplit('ffmpeg', 1)))
 SEGMENT_DURATION = int(os.getenv('SEGMENT_DURATION', '6'))
-KEY_LENGTH = int(os.getenv('KEY_LENGTH', '16'))  # 128-bit key 
\ No newline at end of file
+KEY_LENGTH = int(os.getenv('KEY_LENGTH', '16'))  # 128-bit key
+
+# Adaptive bitrate ladder as comma-separated name:height:video_kbps:audio_kbps
+# renditions, e.g. "1080p:1080:5000:192,720p:720:2800:128,480p:480:1400:128,360p:360:800:96".
+# Empty keeps the single-rendition stream copy.
+ABR_LADDER = [
+    {
+        'name': name,
+        'height': int(height),
+        'video_bitrate': int(video_kbps),
+        'audio_bitrate': int(audio_kbps)
+    }
+    for name, height, video_kbps, audio_kbps in (
+        rendition.strip().split(':') for rendition in os.getenv('ABR_LADDER', '').split(',') if rendition.strip()
+    )
+]
+ABR_X264_PRESET = os.getenv('ABR_X264_PRESET', 'veryfast')
+
+# Poster frame, scrub-preview sprite sheet and WebVTT thumbnail track,
+# extracted by seeking to keyframes found while segmenting
+THUMBNAIL_CONFIG = {
+    'enabled': os.getenv('THUMBNAILS_ENABLED', 'true').lower() == 'true',
+    'tile_width': int(os.getenv('THUMBNAIL_TILE_WIDTH', '160')),
+    'tile_height': int(os.getenv('THUMBNAIL_TILE_HEIGHT', '90')),
+    'columns': int(os.getenv('THUMBNAIL_SPRITE_COLUMNS', '10')),
+    'max_tiles': int(os.getenv('THUMBNAIL_MAX_TILES', '200')),
+    'poster_width': int(os.getenv('THUMBNAIL_POSTER_WIDTH', '640')),
+    'concurrency': int(os.getenv('THUMBNAIL_CONCURRENCY', '4'))
+}
+
+# Proxy upstream HTTP client configuration (one pooled session per worker)
+PROXY_UPSTREAM_CONFIG = {
+    'pool_connections': int(os.getenv('PROXY_POOL_CONNECTIONS', '4')),
+    'pool_maxsize': int(os.getenv('PROXY_POOL_MAXSIZE', '32')),
+    'max_retries': int(os.getenv('PROXY_MAX_RETRIES', '2')),
+    'backoff_factor': float(os.getenv('PROXY_RETRY_BACKOFF', '0.2')),
+    'connect_timeout': float(os.getenv('PROXY_CONNECT_TIMEOUT', '5')),
+    'read_timeout': float(os.getenv('PROXY_READ_TIMEOUT', '30'))
+}
+
+# In-process cache of rewritten playlists served by the proxy
+PLAYLIST_CACHE_CONFIG = {
+    'max_entries': int(os.getenv('PLAYLIST_CACHE_MAX_ENTRIES', '1024')),
+    'max_bytes': int(os.getenv('PLAYLIST_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+    'ttl': float(os.getenv('PLAYLIST_CACHE_TTL', '60'))
+}
+
+# Optional on-disk segment/key cache shared by all workers (disabled when
+# SEGMENT_CACHE_DIR is empty)
+SEGMENT_CACHE_CONFIG = {
+    'directory': os.getenv('SEGMENT_CACHE_DIR', ''),
+    'max_bytes': int(os.getenv('SEGMENT_CACHE_MAX_BYTES', str(2 * 1024 * 1024 * 1024))),
+    'policy': os.getenv('SEGMENT_CACHE_POLICY', 'lru')
+}
+
+# How long a request waits for an identical in-flight upstream fetch before
+# fetching on its own
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '30'))
+
+# Video library catalog built from the control bucket's videos/<name>/ prefixes;
+# between full listings it only reads the change log of newly ingested titles
+VIDEO_CATALOG_CONFIG = {
+    'refresh_interval': float(os.getenv('VIDEO_CATALOG_REFRESH_INTERVAL', '60')),
+    'stale_ttl': float(os.getenv('VIDEO_CATALOG_STALE_TTL', '3600')),
+    'full_refresh_interval': float(os.getenv('VIDEO_CATALOG_FULL_REFRESH_INTERVAL', '3600'))
+}
+VIDEO_CATALOG_PAGE_SIZE = int(os.getenv('VIDEO_CATALOG_PAGE_SIZE', '48'))
+VIDEO_CATALOG_MAX_PAGE_SIZE = int(os.getenv('VIDEO_CATALOG_MAX_PAGE_SIZE', '500'))
+
+# Logging goes through a bounded queue drained by a background thread;
+# records are dropped rather than blocking requests when it is full
+LOGGING_CONFIG = {
+    'level': os.getenv('LOG_LEVEL', 'INFO').upper(),
+    'queue_size': int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+}
+
+# Fraction of proxy requests written to the access log, and of playlist
+# responses whose original and rewritten bodies are dumped at DEBUG
+ACCESS_LOG_CONFIG = {
+    'sample_rate': float(os.getenv('ACCESS_LOG_SAMPLE_RATE', '1.0')),
+    'body_sample_rate': float(os.getenv('PLAYLIST_BODY_LOG_SAMPLE_RATE', '0'))
+}
+
+# Each worker writes its metrics here every flush_interval seconds so
+# /metrics can report totals across all gunicorn workers; an empty
+# METRICS_DIR keeps metrics per worker
+METRICS_CONFIG = {
+    'directory': os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'hls-proxy-metrics')),
+    'flush_interval': float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+}
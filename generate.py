@@ -1,18 +1,75 @@
 import os
 import sys
+import json
 import secrets
 import subprocess
 import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Optional
-from config import LEASEWEB_CONTROL_CONFIG, LEASEWEB_CDN_CONFIG, INPUT_DIR, OUTPUT_DIR, FFMPEG_PATH, SEGMENT_DURATION, KEY_LENGTH
-from storage_handler import LeasewebStorageHandler
+from typing import Dict, List, Optional, Tuple
+from config import (
+    LEASEWEB_CONTROL_CONFIG, LEASEWEB_CDN_CONFIG, INPUT_DIR, OUTPUT_DIR, FFMPEG_PATH, FFPROBE_PATH, SEGMENT_DURATION, KEY_LENGTH,
+    ABR_LADDER, ABR_X264_PRESET, THUMBNAIL_CONFIG,
+    UPLOAD_CONCURRENCY, UPLOAD_MAX_RETRIES, UPLOAD_RETRY_BACKOFF, INVENTORY_CACHE_TTL, PIPELINED_UPLOAD,
+    INGEST_PARALLEL_VIDEOS, INGEST_FFMPEG_CONCURRENCY, INGEST_UPLOAD_CONCURRENCY
+)
+from storage_handler import LeasewebStorageHandler, SegmentUploader
+from ingest_manifest import IngestManifest, MANIFEST_FILENAME
+
+# How often the pipelined mode checks the segment directories for finished segments
+SEGMENT_POLL_INTERVAL = 0.5
+
+# Segments are AES-128-CBC encrypted, so byte ranges end on whole cipher blocks
+AES_BLOCK_SIZE = 16
+
+
+def _vtt_timestamp(seconds: float) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def _segment_index(segment: Path) -> int:
+    """Numeric index of segment_%03d.ts (names stop sorting correctly past 999)"""
+    return int(segment.stem.rsplit("_", 1)[-1])
+
+
+def _decrypting_input(segment: Path, key: bytes) -> List[str]:
+    """ffmpeg/ffprobe input options that read an encrypted segment as plain MPEG-TS.
+
+    key_info has no IV line, so ffmpeg encrypts each segment with its
+    sequence number, which is also its file number, as the IV.
+    """
+    return ["-key", key.hex(), "-iv", f"{_segment_index(segment):032x}", "-i", f"crypto:{segment}"]
 
 class VideoProcessor:
-    def __init__(self, input_dir: str, output_dir: str, storage_handler: LeasewebStorageHandler):
+    def __init__(self, input_dir: str, output_dir: str, storage_handler: LeasewebStorageHandler,
+                 pipelined_upload: bool = False, parallel_videos: int = 1,
+                 ffmpeg_concurrency: int = 1, upload_concurrency: int = 1, abr_ladder: List[dict] = None,
+                 thumbnail_config: dict = None):
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.storage = storage_handler
+        self.pipelined_upload = pipelined_upload
+        self.parallel_videos = parallel_videos
+
+        # Renditions to encode into a master playlist; empty stream-copies
+        # the source into a single stream.m3u8
+        self.abr_ladder = abr_ladder or []
+
+        # Poster/sprite/VTT stage settings; None skips the stage
+        self.thumbnail_config = thumbnail_config if thumbnail_config and thumbnail_config['enabled'] else None
+
+        # With several videos in flight, ffmpeg (CPU-bound) and uploads
+        # (network-bound) are limited separately
+        self._ffmpeg_slots = threading.BoundedSemaphore(ffmpeg_concurrency)
+        self._upload_slots = threading.BoundedSemaphore(upload_concurrency)
+
+        # Per-video stage timings in seconds, filled in by process_video
+        self.video_stats = {}
 
     def test_storage_connection(self) -> bool:
         """Test connection to storage and basic operations"""
@@ -66,20 +123,42 @@ class VideoProcessor:
         return key, "key.key"
 
     def _setup_video_directory(self, video_name: str) -> Dict[str, Path]:
-        """Create output directory structure for a video."""
+        """Create output directory structure for a video.
+
+        With an ABR ladder each rendition gets its own directory holding its
+        stream.m3u8 and segments/, next to master.m3u8 and the shared key.
+        """
         video_dir = self.output_dir / video_name
-        segments_dir = video_dir / "segments"
+        rendition_dirs = self._rendition_dirs(video_dir)
         
         # Clean up any existing directory
         if video_dir.exists():
             shutil.rmtree(video_dir)
         
         # Create directories
-        segments_dir.mkdir(parents=True, exist_ok=True)
+        for rendition_dir in rendition_dirs:
+            (rendition_dir / "segments").mkdir(parents=True, exist_ok=True)
         
         return {
             "video_dir": video_dir,
-            "segments_dir": segments_dir
+            "rendition_dirs": rendition_dirs
+        }
+
+    def _rendition_dirs(self, video_dir: Path) -> List[Path]:
+        """Directories holding each rendition's stream.m3u8 and segments/"""
+        if self.abr_ladder:
+            return [video_dir / rendition["name"] for rendition in self.abr_ladder]
+        return [video_dir]
+
+    def _source_fingerprint(self, input_file: Path) -> dict:
+        """What the encoded output depends on; a change means re-encoding"""
+        stat = input_file.stat()
+        return {
+            "input": str(input_file.resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "segment_duration": SEGMENT_DURATION,
+            "abr_ladder": self.abr_ladder
         }
 
     def _write_key_file(self, video_dir: Path, key: bytes, key_url: str):
@@ -92,93 +171,583 @@ class VideoProcessor:
         with open(video_dir / "key_info", "w") as f:
             f.write(f"{key_url}\n{str(video_dir / 'key.key')}\n")
 
-    def _create_iframe_playlist(self, input_file: Path, video_dir: Path):
-        """Create iframe playlist without generating segments."""
-        temp_dir = video_dir / "temp_iframes"
-        temp_dir.mkdir(exist_ok=True)
-        
+    def _probe_keyframe(self, segment: Path, key: bytes) -> int:
+        """Bytes from the start of a segment to the end of its leading I-frame.
+
+        Segments are cut on keyframes, so the first video packet is the
+        I-frame; it ends where the next video packet starts (or, for a
+        single-frame segment, at the end of the file). The range starts at
+        offset 0: the segment is one CBC stream from its IV, so only a
+        range from the start can be decrypted, and it also carries the
+        PAT/PMT a player needs. It is rounded up to whole cipher blocks.
+        """
+        probe_cmd = [
+            FFPROBE_PATH, "-v", "error",
+            "-select_streams", "v:0",
+            "-read_intervals", "%+#2",
+            "-show_entries", "packet=pos,size,flags",
+            "-of", "json",
+            *_decrypting_input(segment, key)
+        ]
+        output = subprocess.run(probe_cmd, check=True, capture_output=True, text=True).stdout
+        packets = json.loads(output).get("packets") or []
+        if not packets or "K" not in packets[0].get("flags", ""):
+            raise ValueError(f"{segment.name} does not start with a keyframe")
+
+        segment_size = segment.stat().st_size
+        if len(packets) < 2:
+            return segment_size
+        end = int(packets[1]["pos"])
+        return min(-(-end // AES_BLOCK_SIZE) * AES_BLOCK_SIZE, segment_size)
+
+    def _create_iframe_playlist(self, video_dir: Path, segments_dir: Path, key: bytes) -> List[Tuple[float, Path]]:
+        """Build iframes.m3u8 from the segments the stream pass already wrote.
+
+        Segments are cut on keyframes, so each one starts with an I-frame
+        and no second ffmpeg pass over the input is needed. Each entry's
+        byte range covers just that I-frame (see _probe_keyframe). There is
+        one entry per segment, which keeps the implicit sequence-number IVs
+        in step with stream.m3u8.
+
+        Returns the keyframe positions as (start seconds, segment file) pairs.
+        """
+        iframe_lines = ["#EXTM3U", "#EXT-X-VERSION:4", "#EXT-X-I-FRAMES-ONLY"]
+        keyframes = []
+        position = 0.0
+        duration = 0.0
+
+        for line in (video_dir / "stream.m3u8").read_text().splitlines():
+            line = line.strip()
+            if not line or line == "#EXTM3U" or line.startswith("#EXT-X-VERSION"):
+                continue
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+                iframe_lines.append(line)
+            elif line.startswith("#"):
+                # Target duration, media sequence, playlist type, key, end list
+                iframe_lines.append(line)
+            else:
+                segment = segments_dir / line.rsplit("/", 1)[-1]
+                iframe_lines.append(f"#EXT-X-BYTERANGE:{self._probe_keyframe(segment, key)}@0")
+                iframe_lines.append(line)
+                keyframes.append((position, segment))
+                position += duration
+
+        (video_dir / "iframes.m3u8").write_text("\n".join(iframe_lines) + "\n")
+        return keyframes
+
+    def _stream_command(self, input_file: Path, video_dir: Path) -> list:
+        """ffmpeg command copying the source into a single encrypted rendition"""
+        segments_dir = video_dir / "segments"
+        return [
+            FFMPEG_PATH,
+            "-i", str(input_file),
+            "-hls_time", str(SEGMENT_DURATION),
+            "-hls_key_info_file", str(video_dir / "key_info"),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_filename", str(segments_dir / "segment_%03d.ts"),
+            "-hls_flags", "independent_segments",
+            "-hls_list_size", "0",
+            "-hls_base_url", "segments/",
+            "-c", "copy",
+            str(video_dir / "stream.m3u8")
+        ]
+
+    def _abr_command(self, input_file: Path, video_dir: Path) -> list:
+        """ffmpeg command encoding every ladder rendition from a single decode.
+
+        The decoded video is split once and scaled per rendition. Keyframes
+        are forced on segment boundaries so all renditions switch cleanly,
+        and every rendition is encrypted with the same key.
+        """
+        count = len(self.abr_ladder)
+        filter_graph = f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))
+        for i, rendition in enumerate(self.abr_ladder):
+            filter_graph += f";[v{i}]scale=-2:{rendition['height']}[v{i}out]"
+
+        # Silent sources get video-only renditions
+        has_audio = self._has_audio(input_file)
+
+        cmd = [FFMPEG_PATH, "-i", str(input_file), "-filter_complex", filter_graph]
+        stream_map = []
+        for i, rendition in enumerate(self.abr_ladder):
+            video_kbps = rendition["video_bitrate"]
+            cmd += [
+                "-map", f"[v{i}out]",
+                f"-c:v:{i}", "libx264",
+                f"-b:v:{i}", f"{video_kbps}k",
+                f"-maxrate:v:{i}", f"{int(video_kbps * 1.07)}k",
+                f"-bufsize:v:{i}", f"{int(video_kbps * 1.5)}k"
+            ]
+            if has_audio:
+                cmd += [
+                    "-map", "0:a:0?",
+                    f"-c:a:{i}", "aac",
+                    f"-b:a:{i}", f"{rendition['audio_bitrate']}k"
+                ]
+                stream_map.append(f"v:{i},a:{i},name:{rendition['name']}")
+            else:
+                stream_map.append(f"v:{i},name:{rendition['name']}")
+
+        cmd += [
+            "-preset", ABR_X264_PRESET,
+            "-sc_threshold", "0",
+            "-force_key_frames", f"expr:gte(t,n_forced*{SEGMENT_DURATION})",
+            "-f", "hls",
+            "-hls_time", str(SEGMENT_DURATION),
+            "-hls_key_info_file", str(video_dir / "key_info"),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_filename", str(video_dir / "%v" / "segments" / "segment_%03d.ts"),
+            "-hls_flags", "independent_segments",
+            "-hls_list_size", "0",
+            "-hls_base_url", "segments/",
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", " ".join(stream_map),
+            str(video_dir / "%v" / "stream.m3u8")
+        ]
+        return cmd
+
+    def _add_iframe_streams_to_master(self, video_dir: Path):
+        """Advertise each rendition's I-frame playlist in master.m3u8 for trick play"""
+        master_path = video_dir / "master.m3u8"
+        lines = master_path.read_text().rstrip("\n").split("\n")
+        for rendition in self.abr_ladder:
+            lines.append(
+                f'#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH={rendition["video_bitrate"] * 1000},'
+                f'URI="{rendition["name"]}/iframes.m3u8"'
+            )
+        master_path.write_text("\n".join(lines) + "\n")
+
+    def _probe_source(self, input_file: Path) -> dict:
+        """Source video properties from ffprobe; empty if it is unavailable"""
+        probe_cmd = [
+            FFPROBE_PATH, "-v", "error",
+            "-select_streams", "v:0",
+            "-show_entries", "stream=width,height,codec_name",
+            "-of", "json",
+            str(input_file)
+        ]
+        try:
+            output = subprocess.run(probe_cmd, check=True, capture_output=True, text=True).stdout
+            streams = json.loads(output).get("streams") or [{}]
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"⚠ Could not probe {input_file.name}: {str(e)}")
+            return {}
+        return {
+            "width": streams[0].get("width"),
+            "height": streams[0].get("height"),
+            "video_codec": streams[0].get("codec_name")
+        }
+
+    def _has_audio(self, input_file: Path) -> bool:
+        """Whether the source has an audio stream; assumed so if ffprobe is unavailable"""
+        probe_cmd = [
+            FFPROBE_PATH, "-v", "error",
+            "-select_streams", "a:0",
+            "-show_entries", "stream=index",
+            "-of", "json",
+            str(input_file)
+        ]
+        try:
+            output = subprocess.run(probe_cmd, check=True, capture_output=True, text=True).stdout
+            return bool(json.loads(output).get("streams"))
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f"⚠ Could not probe {input_file.name} for audio: {str(e)}")
+            return True
+
+    def _playlist_stats(self, rendition_dir: Path) -> dict:
+        """Duration, segment count and size of one rendition's stream.m3u8"""
+        duration = 0.0
+        segment_count = 0
+        total_bytes = 0
+        for line in (rendition_dir / "stream.m3u8").read_text().splitlines():
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration += float(line[len("#EXTINF:"):].split(",")[0])
+            elif line and not line.startswith("#"):
+                segment_count += 1
+                total_bytes += (rendition_dir / "segments" / line.rsplit("/", 1)[-1]).stat().st_size
+        return {"duration": duration, "segment_count": segment_count, "total_bytes": total_bytes}
+
+    def _extract_frame(self, segment: Path, key: bytes, scale_filter: str, output_file: Path):
+        """Grab a finished segment's first frame, the keyframe it was cut on.
+
+        Only that one frame of the small segment file is decoded. Grabs run
+        under the ffmpeg slot of the encode they accompany.
+        """
+        frame_cmd = [
+            FFMPEG_PATH, "-v", "error",
+            *_decrypting_input(segment, key),
+            "-frames:v", "1",
+            "-vf", scale_filter,
+            "-q:v", "4",
+            "-y", str(output_file)
+        ]
+        subprocess.run(frame_cmd, check=True, capture_output=True, text=True)
+
+    def _segment_positions(self, playlist_path: Path) -> List[float]:
+        """Start times of the segments in a finished stream playlist"""
+        positions = []
+        position = 0.0
+        duration = None
+        for line in playlist_path.read_text().splitlines():
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",")[0])
+            elif line and not line.startswith("#") and duration is not None:
+                positions.append(position)
+                position += duration
+                duration = None
+        return positions
+
+    def _start_thumbnails(self, video_dir: Path, rendition_dir: Path, key: bytes,
+                          encoding_done: threading.Event) -> Future:
+        """Run _create_thumbnails on its own thread while the stream is encoded"""
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        future = executor.submit(self._create_thumbnails, video_dir, rendition_dir, key, encoding_done)
+        executor.shutdown(wait=False)
+        return future
+
+    def _create_thumbnails(self, video_dir: Path, rendition_dir: Path, key: bytes,
+                           encoding_done: threading.Event) -> Dict[str, str]:
+        """Write thumbnails/poster.jpg, sprite.jpg and thumbnails.vtt.
+
+        Like the pipelined upload, this watches rendition_dir's segments/
+        and takes every segment but the newest as finished, and the rest
+        once encoding_done is set; a tile is grabbed from each finished
+        segment's first frame. Tiles are sampled evenly down to max_tiles
+        by keeping every step-th segment and doubling the step whenever
+        there would be more; tiles already grabbed for dropped segments are
+        discarded. Each tile covers the time until the next one in the
+        WebVTT track. Returns the files' paths relative to the video
+        directory, for metadata.json.
+        """
+        config = self.thumbnail_config
+        segments_dir = rendition_dir / "segments"
+        thumbnails_dir = video_dir / "thumbnails"
+        tiles_dir = thumbnails_dir / "tiles"
+        tiles_dir.mkdir(parents=True, exist_ok=True)
+
+        width, height = config["tile_width"], config["tile_height"]
+        tile_filter = (
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+        )
+
+        segments = []
+        grabs = []
+        step = 1
+        with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+            while True:
+                finished = encoding_done.is_set()
+                written = sorted(segments_dir.glob("segment_*.ts"), key=_segment_index)
+                ready = written if finished else written[:-1]
+                for segment in ready[len(segments):]:
+                    index = len(segments)
+                    segments.append(segment)
+                    while len(segments) > config["max_tiles"] * step:
+                        step *= 2
+                    if index % step == 0:
+                        grabs.append(pool.submit(
+                            self._extract_frame, segment, key, tile_filter, tiles_dir / f"keyframe_{index:06d}.jpg"
+                        ))
+                if finished:
+                    break
+                encoding_done.wait(SEGMENT_POLL_INTERVAL)
+
+            if not segments:
+                shutil.rmtree(thumbnails_dir)
+                return {}
+
+            # Poster about a tenth of the way in, past any fade from black
+            kept = list(range(0, len(segments), step))
+            poster_index = kept[min(len(kept) - 1, max(1, len(kept) // 10))]
+            grabs.append(pool.submit(
+                self._extract_frame, segments[poster_index], key,
+                f"scale={config['poster_width']}:-2", thumbnails_dir / "poster.jpg"
+            ))
+            for future in grabs:
+                future.result()
+
+        for number, index in enumerate(kept):
+            (tiles_dir / f"keyframe_{index:06d}.jpg").rename(tiles_dir / f"tile_{number:04d}.jpg")
+        columns = min(config["columns"], len(kept))
+        rows = -(-len(kept) // columns)
+        sprite_cmd = [
+            FFMPEG_PATH, "-v", "error",
+            "-i", str(tiles_dir / "tile_%04d.jpg"),
+            "-vf", f"tile={columns}x{rows}",
+            "-frames:v", "1",
+            "-q:v", "4",
+            "-y", str(thumbnails_dir / "sprite.jpg")
+        ]
+        subprocess.run(sprite_cmd, check=True, capture_output=True, text=True)
+        shutil.rmtree(tiles_dir)
+
+        # The playlist, written once the encode is done, has the start times
+        playlist_path = rendition_dir / "stream.m3u8"
+        positions = self._segment_positions(playlist_path)
+        duration = self._playlist_stats(rendition_dir)["duration"]
+        starts = [positions[index] for index in kept]
+        cues = ["WEBVTT", ""]
+        for number, start in enumerate(starts):
+            end = starts[number + 1] if number + 1 < len(starts) else duration
+            x, y = (number % columns) * width, (number // columns) * height
+            cues.append(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}")
+            cues.append(f"sprite.jpg#xywh={x},{y},{width},{height}")
+            cues.append("")
+        (thumbnails_dir / "thumbnails.vtt").write_text("\n".join(cues))
+
+        return {"poster": "thumbnails/poster.jpg", "thumbnails": "thumbnails/thumbnails.vtt"}
+
+    def _finish_thumbnails(self, video_name: str, video_dir: Path, thumbnails: Future) -> Dict[str, str]:
+        """Wait for the thumbnail stage; a failure only costs the title its thumbnails"""
         try:
-            # Generate temporary iframe playlist
-            iframe_cmd = [
-                FFMPEG_PATH,
-                "-i", str(input_file),
-                "-map", "0:v",
-                "-c:v", "copy",
-                "-f", "hls",
-                "-hls_time", str(SEGMENT_DURATION),
-                "-hls_playlist_type", "vod",
-                "-hls_flags", "independent_segments+iframes_only",
-                "-hls_segment_type", "fmp4",
-                "-hls_list_size", "0",
-                str(temp_dir / "iframes.m3u8")
+            return thumbnails.result()
+        except subprocess.CalledProcessError as e:
+            print(f"⚠ Thumbnails for {video_name} failed, continuing without them: {e.stderr}")
+        except Exception as e:
+            print(f"⚠ Thumbnails for {video_name} failed, continuing without them: {str(e)}")
+        shutil.rmtree(video_dir / "thumbnails", ignore_errors=True)
+        return {}
+
+    def _write_metadata(self, video_name: str, input_file: Path, video_dir: Path, rendition_dirs: List[Path],
+                        extra: dict = None):
+        """Write metadata.json, the title's catalog entry uploaded with its playlists"""
+        renditions = []
+        for rendition_dir in rendition_dirs:
+            stats = self._playlist_stats(rendition_dir)
+            stats["bitrate"] = int(stats["total_bytes"] * 8 / stats["duration"]) if stats["duration"] else None
+            renditions.append(stats)
+
+        metadata = {
+            "name": video_name,
+            "duration": round(renditions[0]["duration"], 3),
+            **self._probe_source(input_file),
+            "bitrate": max(rendition["bitrate"] or 0 for rendition in renditions) or None,
+            "segment_duration": SEGMENT_DURATION,
+            "segment_count": sum(rendition["segment_count"] for rendition in renditions),
+            "total_bytes": sum(rendition["total_bytes"] for rendition in renditions),
+            "ingested_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            **(extra or {})
+        }
+        if self.abr_ladder:
+            metadata["renditions"] = [
+                {
+                    "name": rendition["name"],
+                    "height": rendition["height"],
+                    "bitrate": stats["bitrate"],
+                    "segment_count": stats["segment_count"],
+                    "total_bytes": stats["total_bytes"]
+                }
+                for rendition, stats in zip(self.abr_ladder, renditions)
             ]
-            
-            subprocess.run(iframe_cmd, check=True, capture_output=True, text=True)
-            
-            # Move only the m3u8 file
-            shutil.move(str(temp_dir / "iframes.m3u8"), str(video_dir / "iframes.m3u8"))
-            
-        finally:
-            # Clean up temporary directory
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir)
+
+        with open(video_dir / "metadata.json", "w") as f:
+            json.dump(metadata, f, separators=(",", ":"))
+        return metadata
+
+    def _encode_and_upload_segments(self, video_name: str, stream_cmd: list, video_dir: Path,
+                                    segment_dirs: List[Path], manifest: IngestManifest) -> SegmentUploader:
+        """Run ffmpeg and upload each segment as soon as it is finished.
+
+        ffmpeg writes each rendition's segments strictly in order, so every
+        segment except the newest one in a directory is complete; the newest
+        are picked up once ffmpeg exits.
+        """
+        uploader = self.storage.start_segment_upload(video_name, manifest=manifest)
+        submitted = set()
+        log_path = video_dir / "ffmpeg.log"
+
+        with open(log_path, "w") as log:
+            process = subprocess.Popen(stream_cmd, stdout=subprocess.DEVNULL, stderr=log)
+            try:
+                while True:
+                    finished = process.poll() is not None
+                    for segments_dir in segment_dirs:
+                        segments = sorted(segments_dir.glob("segment_*.ts"), key=_segment_index)
+                        ready = segments if finished else segments[:-1]
+                        for segment in ready:
+                            object_key = f"videos/{video_name}/{segment.relative_to(video_dir).as_posix()}"
+                            if object_key not in submitted:
+                                submitted.add(object_key)
+                                uploader.submit(segment, object_key)
+                    if finished:
+                        break
+                    time.sleep(SEGMENT_POLL_INTERVAL)
+            except BaseException:
+                process.kill()
+                process.wait()
+                uploader.finish()
+                raise
+
+        if process.returncode != 0:
+            uploader.finish()
+            raise subprocess.CalledProcessError(process.returncode, stream_cmd, stderr=log_path.read_text())
+
+        print(f"✓ ffmpeg finished, {len(submitted)} segments queued for upload")
+        return uploader
 
     def process_video(self, input_file: Path) -> bool:
-        """Process a single video file and upload to storage."""
+        """Process a single video file and upload to storage.
+
+        Progress is recorded in the video's manifest. A rerun for the same
+        source skips a title that already completed, and resumes a failed
+        upload from the existing encode, only uploading what is missing.
+        """
         video_name = input_file.stem
         print(f"\n=== Processing video: {video_name} ===")
+        stats = self.video_stats.setdefault(video_name, {})
+
+        video_dir = self.output_dir / video_name
+        source = self._source_fingerprint(input_file)
+        manifest = IngestManifest.load(video_dir, source)
+        if manifest is not None and manifest.completed:
+            print("✓ Already ingested from this source, nothing to do")
+            return True
+        if manifest is not None and manifest.encoded:
+            print("Resuming from the existing encode...")
+            return self._upload_video(video_name, video_dir, manifest, None, stats)
 
         # Setup directories
         dirs = self._setup_video_directory(video_name)
-        video_dir = dirs["video_dir"]
-        segments_dir = dirs["segments_dir"]
+        rendition_dirs = dirs["rendition_dirs"]
+        manifest = IngestManifest(video_dir, source)
+        manifest.save()
 
         try:
             # Generate encryption key
             key, key_url = self._generate_key()
+            if self.abr_ladder:
+                # Rendition playlists sit one level below the shared key
+                key_url = f"../{key_url}"
             self._write_key_file(video_dir, key, key_url)
 
             # Generate main stream playlist
-            print("1. Generating main stream playlist...")
-            stream_cmd = [
-                FFMPEG_PATH,
-                "-i", str(input_file),
-                "-hls_time", str(SEGMENT_DURATION),
-                "-hls_key_info_file", str(video_dir / "key_info"),
-                "-hls_playlist_type", "vod",
-                "-hls_segment_filename", str(segments_dir / "segment_%03d.ts"),
-                "-hls_flags", "independent_segments",
-                "-hls_list_size", "0",
-                "-hls_base_url", "segments/",
-                "-c", "copy",
-                str(video_dir / "stream.m3u8")
-            ]
-            subprocess.run(stream_cmd, check=True, capture_output=True, text=True)
-            print("✓ Main stream playlist generated!")
-            
-            # Generate iframe playlist
-            print("2. Generating iframe playlist...")
-            self._create_iframe_playlist(input_file, video_dir)
-            print("✓ Iframe playlist generated!")
-
-            # Upload to storage
+            if self.abr_ladder:
+                print(f"1. Encoding {len(self.abr_ladder)} renditions and master playlist...")
+                stream_cmd = self._abr_command(input_file, video_dir)
+            else:
+                print("1. Generating main stream playlist...")
+                stream_cmd = self._stream_command(input_file, video_dir)
+            segment_dirs = [rendition_dir / "segments" for rendition_dir in rendition_dirs]
+            uploader = None
+
+            # Thumbnails are grabbed from segments as ffmpeg finishes them, on
+            # their own thread alongside ffmpeg
+            encoding_done = threading.Event()
+            thumbnails = None
+            if self.thumbnail_config:
+                thumbnails = self._start_thumbnails(video_dir, rendition_dirs[0], key, encoding_done)
+
+            # The title keeps its ffmpeg slot until its thumbnails are done as
+            # well; the grabs share it rather than queueing for another
+            thumbnail_files = {}
+            with self._ffmpeg_slots:
+                started = time.monotonic()
+                try:
+                    if self.pipelined_upload:
+                        # Segments go up while ffmpeg is still producing the rest
+                        uploader = self._encode_and_upload_segments(video_name, stream_cmd, video_dir,
+                                                                    segment_dirs, manifest)
+                    else:
+                        subprocess.run(stream_cmd, check=True, capture_output=True, text=True)
+                    print("✓ Main stream playlist generated!")
+                finally:
+                    encoding_done.set()
+                stats["encode_seconds"] = time.monotonic() - started
+
+                # The iframe playlists are derived from the segments just written
+                print("2. Generating iframe playlist...")
+                keyframes = []
+                for rendition_dir in rendition_dirs:
+                    keyframes = self._create_iframe_playlist(rendition_dir, rendition_dir / "segments", key)
+                if self.abr_ladder:
+                    self._add_iframe_streams_to_master(video_dir)
+                print(f"✓ Iframe playlist generated ({len(keyframes)} keyframes)!")
+
+                # Pipelined segment uploads carry on in the background while the
+                # thumbnail stage finishes
+                if thumbnails is not None:
+                    started = time.monotonic()
+                    thumbnail_files = self._finish_thumbnails(video_name, video_dir, thumbnails)
+                    if thumbnail_files:
+                        if uploader is not None:
+                            for path in sorted((video_dir / "thumbnails").iterdir()):
+                                uploader.submit(path, f"videos/{video_name}/thumbnails/{path.name}")
+                        print("✓ Poster, sprite sheet and thumbnail track generated!")
+                    # Time spent waiting for thumbnails after the encode finished
+                    stats["thumbnail_seconds"] = time.monotonic() - started
+
+            metadata = self._write_metadata(video_name, input_file, video_dir, rendition_dirs, thumbnail_files)
+            print(f"✓ Metadata written ({metadata['duration']:.1f}s, {metadata['total_bytes']} bytes)")
+            manifest.mark_encoded()
+
+        except subprocess.CalledProcessError as e:
+            print(f"❌ Error processing {video_name}: {e.stderr}")
+            return False
+        except Exception as e:
+            print(f"❌ Error processing {video_name}: {str(e)}")
+            return False
+
+        return self._upload_video(video_name, video_dir, manifest, uploader, stats)
+
+    def _upload_video(self, video_name: str, video_dir: Path, manifest: IngestManifest,
+                      uploader: Optional[SegmentUploader], stats: dict) -> bool:
+        """Upload an encoded video, skipping objects already in storage"""
+        try:
             print("3. Uploading to storage...")
-            if self.storage.upload_video_files(video_name, video_dir):
+            started = time.monotonic()
+            with self._upload_slots:
+                if uploader is not None:
+                    # Playlists and key go last so the title only appears once complete
+                    result = uploader.finish()
+                    if result:
+                        self.storage.upload_control_files(video_name, video_dir, result, manifest)
+                    print(result.summary())
+                else:
+                    result = self.storage.upload_video_files(video_name, video_dir, manifest=manifest)
+            stats["upload_seconds"] = time.monotonic() - started
+            manifest.save()
+
+            if result:
                 print("✓ Successfully uploaded all files!")
-                # Clean up local files after successful upload
-                shutil.rmtree(video_dir)
+                # Clean up local files after successful upload, keeping the
+                # manifest so a rerun knows this title is done
+                for path in video_dir.iterdir():
+                    if path.name == MANIFEST_FILENAME:
+                        continue
+                    if path.is_dir():
+                        shutil.rmtree(path)
+                    else:
+                        path.unlink()
+                manifest.mark_completed()
                 return True
             return False
 
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Error processing {video_name}: {e.stderr}")
+        except Exception as e:
+            print(f"❌ Error uploading {video_name}: {str(e)}")
             return False
+
+    def _process_isolated(self, input_file: Path) -> bool:
+        """Run process_video so that no failure can escape into the rest of the batch"""
+        started = time.monotonic()
+        try:
+            return self.process_video(input_file)
         except Exception as e:
-            print(f"❌ Error processing {video_name}: {str(e)}")
+            print(f"❌ Unexpected error processing {input_file.stem}: {str(e)}")
             return False
+        finally:
+            stats = self.video_stats.setdefault(input_file.stem, {})
+            stats["total_seconds"] = time.monotonic() - started
+
+    def process_all_videos(self, parallel_videos: int = None) -> bool:
+        """Process all MP4 files in the input directory.
 
-    def process_all_videos(self) -> bool:
-        """Process all MP4 files in the input directory."""
+        Up to parallel_videos titles are processed at once (1 keeps the
+        original one-at-a-time behaviour); a failed title never stops the
+        rest of the batch.
+        """
         mp4_files = list(self.input_dir.glob("*.mp4"))
         
         if not mp4_files:
@@ -186,17 +755,35 @@ class VideoProcessor:
             print(f"Please place MP4 files in: {self.input_dir}")
             return False
 
-        print(f"\nFound {len(mp4_files)} MP4 files to process.")
+        parallel_videos = parallel_videos or self.parallel_videos
+        print(f"\nFound {len(mp4_files)} MP4 files to process ({parallel_videos} at a time).")
         
-        successful = 0
-        for input_file in mp4_files:
-            if self.process_video(input_file):
-                successful += 1
+        batch_started = time.monotonic()
+        outcomes = {}
+        if parallel_videos <= 1:
+            for input_file in mp4_files:
+                outcomes[input_file.stem] = self._process_isolated(input_file)
+        else:
+            with ThreadPoolExecutor(max_workers=parallel_videos) as pool:
+                futures = {pool.submit(self._process_isolated, input_file): input_file for input_file in mp4_files}
+                for future in as_completed(futures):
+                    outcomes[futures[future].stem] = future.result()
+        successful = sum(1 for ok in outcomes.values() if ok)
 
         print(f"\n=== Processing Summary ===")
         print(f"Total videos: {len(mp4_files)}")
         print(f"Successfully processed: {successful}")
         print(f"Failed: {len(mp4_files) - successful}")
+        print(f"Wall-clock time: {time.monotonic() - batch_started:.1f}s")
+        print(f"\n{'Video':<30} {'Status':<8} {'Encode':>9} {'Upload':>9} {'Total':>9}")
+        for video_name in sorted(outcomes):
+            stats = self.video_stats.get(video_name, {})
+            timings = [
+                f"{stats[key]:>8.1f}s" if key in stats else f"{'-':>9}"
+                for key in ("encode_seconds", "upload_seconds", "total_seconds")
+            ]
+            status = "ok" if outcomes[video_name] else "FAILED"
+            print(f"{video_name:<30} {status:<8} {' '.join(timings)}")
         
         return successful == len(mp4_files)
 
@@ -206,14 +793,24 @@ def main():
     # Initialize storage handler with both configurations
     storage = LeasewebStorageHandler(
         control_config=LEASEWEB_CONTROL_CONFIG,
-        cdn_config=LEASEWEB_CDN_CONFIG
+        cdn_config=LEASEWEB_CDN_CONFIG,
+        upload_concurrency=UPLOAD_CONCURRENCY,
+        max_retries=UPLOAD_MAX_RETRIES,
+        retry_backoff=UPLOAD_RETRY_BACKOFF,
+        inventory_ttl=INVENTORY_CACHE_TTL
     )
     
     # Initialize video processor
     processor = VideoProcessor(
         input_dir=INPUT_DIR,
         output_dir=OUTPUT_DIR,
-        storage_handler=storage
+        storage_handler=storage,
+        pipelined_upload=PIPELINED_UPLOAD,
+        parallel_videos=INGEST_PARALLEL_VIDEOS,
+        ffmpeg_concurrency=INGEST_FFMPEG_CONCURRENCY,
+        upload_concurrency=INGEST_UPLOAD_CONCURRENCY,
+        abr_ladder=ABR_LADDER,
+        thumbnail_config=THUMBNAIL_CONFIG
     )
 
     # Step 1: Validate environment
@@ -0,0 +1,101 @@
+import threading
+from typing import Optional
+
+
+class HedgePolicy:
+    """Decides when an upstream GET is hedged and caps how many are.
+
+    The hedge delay is either fixed (fixed_delay seconds) or, with a
+    percentile, that percentile of the recent time-to-headers samples
+    (a window of the last `window` responses, recomputed every few dozen
+    samples), never below min_delay. Dynamic hedging stays off until
+    min_samples responses have been seen.
+
+    Hedges are paid for from a token bucket: every GET earns `budget`
+    tokens (up to `burst`) and every hedge spends one. Extra upstream load
+    is therefore bounded by budget, e.g. 0.05 allows at most 5% more
+    requests however slow the origin gets.
+    """
+
+    def __init__(self, fixed_delay: float = 0, percentile: float = 0, min_delay: float = 0.01,
+                 window: int = 1000, min_samples: int = 100, budget: float = 0.05, burst: float = 10):
+        self.fixed_delay = fixed_delay
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.budget = budget
+        self.burst = burst
+
+        self._lock = threading.Lock()
+        self._samples = []
+        self._next = 0
+        self._since_recompute = 0
+        self._recompute_every = max(window // 20, 10)
+        self._threshold = None
+        self._tokens = burst
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0 and (self.fixed_delay > 0 or self.percentile > 0)
+
+    def record(self, latency: float):
+        """Add a time-to-headers sample from a successful upstream response"""
+        if not self.percentile:
+            return
+        with self._lock:
+            if len(self._samples) < self.window:
+                self._samples.append(latency)
+            else:
+                self._samples[self._next] = latency
+                self._next = (self._next + 1) % self.window
+            self._since_recompute += 1
+            due = self._threshold is None or self._since_recompute >= self._recompute_every
+            if due and len(self._samples) >= self.min_samples:
+                self._since_recompute = 0
+                ordered = sorted(self._samples)
+                value = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+                self._threshold = max(value, self.min_delay)
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a new GET, or None to not hedge it.
+
+        Each call also earns the GET its share of the hedge budget.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.budget)
+            if self.fixed_delay > 0:
+                return self.fixed_delay
+            return self._threshold
+
+    def try_spend(self) -> bool:
+        """Take a token for a hedge; False once the budget is used up"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.hedges += 1
+                return True
+            self.denied += 1
+            return False
+
+    def record_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            threshold = self.fixed_delay if self.fixed_delay > 0 else self._threshold
+            return {
+                "enabled": self.enabled,
+                "delay_ms": round(threshold * 1000, 1) if threshold is not None else None,
+                "samples": len(self._samples),
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "denied_by_budget": self.denied,
+                "tokens": round(self._tokens, 2)
+            }
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Upload progress is flushed to disk at most this often (seconds); the
+# final state is always saved explicitly
+MANIFEST_SAVE_INTERVAL = 1.0
+
+
+def file_md5(path) -> str:
+    """Hex MD5 of a file, the same digest S3 reports as ETag for single-part uploads"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """Local record of how far a video's ingest got, kept in <video_dir>/manifest.json.
+
+    It records the source the output was encoded from, whether ffmpeg
+    finished, and the content hash of every object uploaded so far. A rerun
+    with the same source resumes from it instead of re-encoding, and only
+    uploads objects that are not already in storage.
+    """
+
+    def __init__(self, video_dir: Path, source: dict, data: dict = None):
+        self.path = Path(video_dir) / MANIFEST_FILENAME
+        self._data = data or {"source": source, "encoded": False, "completed": False, "objects": {}}
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+
+    @classmethod
+    def load(cls, video_dir: Path, source: dict) -> Optional['IngestManifest']:
+        """Return the saved manifest if it was produced from this same source, else None"""
+        try:
+            with open(Path(video_dir) / MANIFEST_FILENAME, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("source") != source:
+            return None
+        return cls(video_dir, source, data)
+
+    @property
+    def encoded(self) -> bool:
+        return self._data["encoded"]
+
+    @property
+    def completed(self) -> bool:
+        return self._data["completed"]
+
+    def mark_encoded(self):
+        with self._lock:
+            self._data["encoded"] = True
+        self.save()
+
+    def mark_completed(self):
+        with self._lock:
+            self._data["completed"] = True
+        self.save()
+
+    def is_uploaded(self, object_key: str, md5: str) -> bool:
+        with self._lock:
+            return self._data["objects"].get(object_key) == md5
+
+    def mark_uploaded(self, object_key: str, md5: str):
+        with self._lock:
+            self._data["objects"][object_key] = md5
+            due = time.monotonic() - self._last_save >= MANIFEST_SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def save(self):
+        """Atomically write the manifest so a crash never leaves it half-written"""
+        with self._lock:
+            payload = json.dumps(self._data, indent=2)
+            self._last_save = time.monotonic()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w") as tmp:
+                tmp.write(payload)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,100 @@
+import re
+import posixpath
+from typing import Iterable, Iterator
+
+# Mount point the rewritten URIs are served under
+PROXY_PREFIX = b'/proxy/'
+
+# Quoted URI attribute of tags such as EXT-X-KEY, EXT-X-MAP, EXT-X-MEDIA
+# and EXT-X-I-FRAME-STREAM-INF
+URI_ATTRIBUTE = re.compile(rb'URI="([^"]*)"')
+
+# URIs that already point somewhere absolute and are left untouched
+ABSOLUTE_URI = re.compile(rb'^(?:[A-Za-z][A-Za-z0-9+.-]*:|/)')
+
+
+def is_playlist(head: bytes) -> bool:
+    """Whether a body (or its first chunk) starts like an M3U8 playlist"""
+    return head.lstrip().startswith(b'#EXTM3U')
+
+
+class PlaylistRewriter:
+    """Rewrites every URI in an M3U8 playlist to go through the proxy.
+
+    Works on bytes, one line at a time, so a playlist never has to be
+    decoded or held as one string. Bare URI lines (segments, variant
+    playlists) and URI="..." attributes inside tags are both resolved
+    against base_dir, the playlist's own directory in the proxied path
+    space. Absolute URIs are kept as they are.
+    """
+
+    def __init__(self, base_dir: str, prefix: bytes = PROXY_PREFIX):
+        self.base_dir = base_dir.encode('utf-8').strip(b'/')
+        self.prefix = prefix
+        # Segments share a handful of directories, so each relative directory
+        # is resolved once and the file names are appended to it
+        self._dirs = {}
+        # Trailing partial line of the last chunk fed in
+        self._pending = b''
+
+    def _resolve_dir(self, directory: bytes) -> bytes:
+        resolved = self._dirs.get(directory)
+        if resolved is None:
+            resolved = posixpath.normpath(posixpath.join(self.base_dir, directory))
+            resolved = self.prefix + (b'' if resolved == b'.' else resolved + b'/')
+            self._dirs[directory] = resolved
+        return resolved
+
+    def rewrite_uri(self, uri: bytes) -> bytes:
+        if not uri or uri[:1] == b'/' or (b':' in uri and ABSOLUTE_URI.match(uri)):
+            return uri
+        path, mark, query = uri.partition(b'?')
+        directory, _, filename = path.rpartition(b'/')
+        if filename in (b'', b'.', b'..'):
+            return self.prefix + posixpath.normpath(posixpath.join(self.base_dir, path)) + mark + query
+        return self._resolve_dir(directory) + filename + mark + query
+
+    def _rewrite_attribute(self, match) -> bytes:
+        return b'URI="' + self.rewrite_uri(match.group(1)) + b'"'
+
+    def rewrite_line(self, line: bytes) -> bytes:
+        line = line.strip()
+        if not line:
+            return line
+        if line.startswith(b'#'):
+            if b'URI="' in line:
+                return URI_ATTRIBUTE.sub(self._rewrite_attribute, line)
+            return line
+        return self.rewrite_uri(line)
+
+    def feed(self, chunk: bytes) -> bytes:
+        """Rewrite the lines completed by chunk, holding back a trailing partial line"""
+        lines = (self._pending + chunk).split(b'\n')
+        self._pending = lines.pop()
+        rewrite_line = self.rewrite_line
+        return b''.join([rewrite_line(line) + b'\n' for line in lines])
+
+    def finish(self) -> bytes:
+        """Rewrite the last line, when the playlist does not end with a newline"""
+        pending, self._pending = self._pending, b''
+        return self.rewrite_line(pending) + b'\n' if pending else b''
+
+    def rewrite(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield the rewritten playlist as the input chunks arrive"""
+        self._pending = b''
+        for chunk in chunks:
+            rewritten = self.feed(chunk)
+            if rewritten:
+                yield rewritten
+        rewritten = self.finish()
+        if rewritten:
+            yield rewritten
+
+    def rewrite_bytes(self, body: bytes) -> bytes:
+        """Rewrite a playlist that is already in memory"""
+        return b''.join(self.rewrite((body,)))
+
+
+def rewrite_playlist(body: bytes, playlist_path: str) -> bytes:
+    """Rewrite the playlist served at playlist_path (e.g. 'videos/<name>/stream.m3u8')"""
+    return PlaylistRewriter(posixpath.dirname(playlist_path)).rewrite_bytes(body)
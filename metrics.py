@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import bisect
+import logging
+import tempfile
+import threading
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from cache hits to slow CDN fetches
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counters and histograms of exited workers, merged into one file
+RETIRED_SNAPSHOT = 'retired.json'
+
+# name -> (type, help) for everything the proxy records
+METRIC_DEFINITIONS = {
+    'proxy_requests_total': ('counter', 'Proxy requests by kind, response status and cache outcome'),
+    'proxy_response_bytes_total': ('counter', 'Response body bytes sent to clients'),
+    'proxy_upstream_responses_total': ('counter', 'CDN responses by status'),
+    'proxy_in_flight_requests': ('gauge', 'Requests currently being handled or streamed'),
+    'proxy_request_duration_seconds': ('histogram', 'Time until the response body was fully sent'),
+    'proxy_ttfb_seconds': ('histogram', 'Time until the response headers were ready'),
+    'proxy_upstream_duration_seconds': ('histogram', 'Time until the CDN response headers arrived'),
+    'proxy_stage_duration_seconds': ('histogram', 'Time spent in each proxy stage'),
+}
+
+
+def request_kind(path: str) -> str:
+    """Coarse request class used as a label, keeping label cardinality low"""
+    if not path.startswith('/proxy/'):
+        return 'other'
+    if path.endswith('.m3u8'):
+        return 'playlist'
+    return 'segment'
+
+
+def _label_key(labels: dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms for one worker process.
+
+    Updates are plain dict operations under a lock. With a directory, each
+    worker periodically writes its numbers to <directory>/<pid>-<start>.json
+    and render() sums the files of every worker, so whichever gunicorn
+    worker answers /metrics reports totals for the whole server. When a
+    worker has exited, its counters and histograms are merged into
+    retired.json, so they never go backwards, and its file is deleted; its
+    gauges are dropped. A worker counts as alive only if its pid exists and
+    that process started no later than the snapshot says, so a reused pid
+    does not bring a dead worker back.
+    """
+
+    def __init__(self, directory: str = None, flush_interval: float = 5.0, buckets=DEFAULT_BUCKETS):
+        self.directory = Path(directory) if directory else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}  # key -> [bucket counts..., +Inf count, sum]
+        self._pid = os.getpid()
+        self._started = int(time.time() * 1000)
+        self._flusher_started = False
+
+    def _check_process(self):
+        # A forked worker starts from zero instead of re-reporting the
+        # parent's numbers under its own file
+        if self._pid != os.getpid():
+            self._reset()
+        if self.directory is not None and not self._flusher_started:
+            self._flusher_started = True
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_process()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name: str, delta: float, **labels):
+        """Move a gauge up or down"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._check_process()
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._check_process()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def request_started(self):
+        self.add('proxy_in_flight_requests', 1)
+
+    def request_finished(self, path: str, status: int, duration: float, ttfb: float,
+                         body_bytes: int = None, fields: dict = None):
+        """Record a finished request; fields are the request's access log fields"""
+        fields = fields or {}
+        kind = request_kind(path)
+        self.add('proxy_in_flight_requests', -1)
+        self.inc('proxy_requests_total', kind=kind, status=str(status), cache=fields.get('cache', 'none'))
+        self.observe('proxy_request_duration_seconds', duration, kind=kind)
+        self.observe('proxy_ttfb_seconds', ttfb, kind=kind)
+        if body_bytes:
+            self.inc('proxy_response_bytes_total', int(body_bytes), kind=kind)
+        if fields.get('upstream_ms') is not None:
+            self.observe('proxy_upstream_duration_seconds', fields['upstream_ms'] / 1000, kind=kind)
+            self.inc('proxy_upstream_responses_total', status=str(fields['upstream_status']))
+
+    def timed(self, stage: str):
+        """Decorator recording a function's wall time as a proxy stage"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe('proxy_stage_duration_seconds', time.perf_counter() - started, stage=stage)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._check_process()
+            return {
+                "pid": self._pid,
+                "started": self._started,
+                "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                "gauges": [[name, dict(labels), value] for (name, labels), value in self._gauges.items()],
+                "histograms": [[name, dict(labels), values] for (name, labels), values in self._histograms.items()]
+            }
+
+    def _snapshot_path(self) -> Path:
+        return self.directory / f"{self._pid}-{self._started}.json"
+
+    def flush(self):
+        """Atomically write this worker's numbers for the other workers to read"""
+        if self.directory is None:
+            return
+        payload = json.dumps(self.snapshot())
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(payload)
+        os.replace(tmp_path, self._snapshot_path())
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f"Failed to write metrics snapshot: {str(e)}")
+
+    def _collect(self) -> List[dict]:
+        own = self.snapshot()
+        if self.directory is None:
+            return [own]
+        self.flush()
+        snapshots = [own]
+        own_path = self._snapshot_path()
+        retired = []
+        for path in self.directory.glob('*.json'):
+            if path == own_path or path.name == RETIRED_SNAPSHOT:
+                continue
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if _process_alive(snapshot.get('pid'), snapshot.get('started')):
+                snapshots.append(snapshot)
+            else:
+                retired.append(path)
+        if retired:
+            self._retire(retired)
+        try:
+            snapshots.append(json.loads((self.directory / RETIRED_SNAPSHOT).read_text()))
+        except (OSError, ValueError):
+            pass
+        return snapshots
+
+    def _retire(self, paths: List[Path]):
+        """Merge exited workers' snapshots into retired.json and delete them"""
+        lock_file = open(self.directory / '.retire.lock', 'w')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            retired_path = self.directory / RETIRED_SNAPSHOT
+            try:
+                merged = json.loads(retired_path.read_text())
+            except (OSError, ValueError):
+                merged = {"pid": None, "counters": [], "gauges": [], "histograms": []}
+
+            # Another worker may have retired some of these while we waited
+            done = []
+            for path in paths:
+                try:
+                    merged = _merge_snapshots(merged, json.loads(path.read_text()), len(self.buckets) + 2)
+                except (OSError, ValueError):
+                    continue
+                done.append(path)
+            if not done:
+                return
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp:
+                tmp.write(json.dumps(merged))
+            os.replace(tmp_path, retired_path)
+            for path in done:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+        finally:
+            lock_file.close()
+
+    def render(self) -> str:
+        """Totals across all workers in the Prometheus text exposition format"""
+        totals: Dict[str, Dict[Tuple, object]] = {}
+        for snapshot in self._collect():
+            for kind in ('counters', 'gauges'):
+                for name, labels, value in snapshot[kind]:
+                    series = totals.setdefault(name, {})
+                    key = _label_key(labels)
+                    series[key] = series.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                if len(values) != len(self.buckets) + 2:
+                    continue  # written with a different bucket layout
+                series = totals.setdefault(name, {})
+                key = _label_key(labels)
+                current = series.get(key)
+                series[key] = values if current is None else [a + b for a, b in zip(current, values)]
+
+        lines = []
+        for name, (metric_type, help_text) in METRIC_DEFINITIONS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for key, value in sorted(totals.get(name, {}).items()):
+                if metric_type == 'histogram':
+                    lines.extend(self._render_histogram(name, dict(key), value))
+                else:
+                    lines.append(f"{name}{_format_labels(dict(key))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, name: str, labels: dict, values: list) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+def _merge_snapshots(merged: dict, snapshot: dict, histogram_size: int) -> dict:
+    """Sum snapshot's counters and histograms into merged; gauges are dropped"""
+    counters = {(name, _label_key(labels)): value for name, labels, value in merged['counters']}
+    for name, labels, value in snapshot['counters']:
+        key = (name, _label_key(labels))
+        counters[key] = counters.get(key, 0) + value
+    histograms = {(name, _label_key(labels)): values for name, labels, values in merged['histograms']}
+    for name, labels, values in snapshot['histograms']:
+        if len(values) != histogram_size:
+            continue  # written with a different bucket layout
+        key = (name, _label_key(labels))
+        current = histograms.get(key)
+        histograms[key] = values if current is None else [a + b for a, b in zip(current, values)]
+    return {
+        "pid": None,
+        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        "gauges": [],
+        "histograms": [[name, dict(labels), values] for (name, labels), values in histograms.items()]
+    }
+
+
+def _process_alive(pid, started=None) -> bool:
+    """Whether pid runs and, given the snapshot's start (ms), is the process that wrote it"""
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if started is None:
+        return True
+    process_started = _process_start_time(pid)
+    # A process started after the snapshot's worker is a new owner of the pid
+    return process_started is None or process_started <= started / 1000 + 1
+
+
+def _process_start_time(pid: int):
+    """Start of a process in seconds since the epoch, where /proc has it"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesised command name; starttime is field 22
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime '))
+        return boot_time + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape_label(str(value))}"' for name, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
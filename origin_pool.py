@@ -0,0 +1,504 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+import httpx
+import requests
+
+from circuit_breaker import CLOSED, HALF_OPEN, CircuitBreaker, CircuitOpenError
+from concurrency_limit import AdaptiveConcurrencyLimit, ConcurrencyLimitExceeded
+from hedging import HedgePolicy
+
+logger = logging.getLogger(__name__)
+
+# Failures that make a GET worth retrying on another origin; an origin whose
+# circuit opened since the request started is skipped the same way
+FAILOVER_EXCEPTIONS = (requests.Timeout, requests.ConnectionError, CircuitOpenError)
+ASYNC_FAILOVER_EXCEPTIONS = (httpx.TimeoutException, httpx.NetworkError, CircuitOpenError)
+
+# 501 Not Implemented is about the request, not the origin's health; the
+# proxy retries it itself with different headers
+NOT_ORIGIN_FAILURES = (501,)
+
+# A failed request counts as a response this slow (seconds) in an origin's
+# latency average, so a failing origin sinks below the working ones
+FAILURE_LATENCY_PENALTY = 5.0
+
+
+class Origin:
+    """One CDN origin and what the proxy has learned about it"""
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url.rstrip('/')
+        self.breaker = breaker
+        self.latency = None  # EWMA of time to response headers, seconds
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.breaker.state == CLOSED
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+
+class OriginPool:
+    """CDN origins with health checking and latency-aware failover.
+
+    Requests go to the healthy origin with the lowest moving average of
+    time to response headers; an origin not measured yet is tried first so
+    every origin gets a latency estimate. A GET that times out, cannot
+    connect or gets a 5xx (other than 501) moves on to the next origin.
+
+    Each origin has a circuit breaker: failure_threshold failures in a row
+    take it out of rotation for circuit_reset_timeout seconds, after which
+    a single request probes it. With several origins a background health
+    check (a HEAD of health_check_path, where anything below 500 counts as
+    up) also opens circuits and lets an open one be probed early. When no
+    origin can take a request, get() raises CircuitOpenError at once
+    instead of waiting on a dead CDN.
+
+    An optional AdaptiveConcurrencyLimit caps the GETs in flight in this
+    worker, counting each until its response is closed; get() raises
+    ConcurrencyLimitExceeded over the limit.
+
+    With a HedgePolicy, a GET still waiting for headers after the policy's
+    delay is also sent to the next origin (or again to the same one when
+    it is the last) and the first good response wins, as far as the
+    policy's budget allows. All requests are idempotent GETs, so the
+    duplicate is harmless.
+    """
+
+    def __init__(self, urls: List[str], health_check_interval: float = 10, health_check_path: str = '/',
+                 health_check_timeout: float = 2, failure_threshold: int = 3, circuit_reset_timeout: float = 10,
+                 circuit_max_reset_timeout: float = 120, ewma_alpha: float = 0.3, hedging: HedgePolicy = None,
+                 hedge_workers: int = 16, concurrency_limit: AdaptiveConcurrencyLimit = None):
+        if not urls:
+            raise ValueError("At least one CDN origin is required")
+        self.origins = [
+            Origin(url, CircuitBreaker(failure_threshold, circuit_reset_timeout, circuit_max_reset_timeout))
+            for url in urls
+        ]
+        self.health_check_interval = health_check_interval
+        self.health_check_path = '/' + health_check_path.lstrip('/')
+        self.health_check_timeout = health_check_timeout
+        self.ewma_alpha = ewma_alpha
+        self.hedging = hedging
+        self.concurrency_limit = concurrency_limit
+        self.hedge_workers = hedge_workers
+
+        self._lock = threading.Lock()
+        self._checker_pid = None
+        self._executor = None
+        self._executor_pid = None
+        self._hedge_threads_busy = 0
+        self.failovers = 0
+
+    def ordered(self) -> List[Origin]:
+        """Origins to try, in order: one due a probe, then the healthy ones by latency.
+
+        Raises CircuitOpenError when every origin's circuit is open.
+        """
+        self._ensure_health_checker()
+        available = [origin for origin in self.origins if origin.breaker.available()]
+        if not available:
+            retry_after = min(origin.breaker.retry_after() for origin in self.origins)
+            raise CircuitOpenError("Circuit open for every CDN origin", retry_after)
+        probing = [origin for origin in available if origin.breaker.state == HALF_OPEN]
+        with self._lock:
+            healthy = [origin for origin in available if origin not in probing]
+            # Random tie-break spreads load across origins with equal estimates
+            healthy.sort(key=lambda origin: (origin.latency or 0.0, random.random()))
+        return probing + healthy
+
+    def record_success(self, origin: Origin, latency: float):
+        if self.hedging is not None:
+            self.hedging.record(latency)
+        with self._lock:
+            origin.requests += 1
+            self._update_latency(origin, latency)
+        if origin.breaker.record_success():
+            logger.warning(f"Circuit closed for CDN origin {origin.url}")
+
+    def record_failure(self, origin: Origin):
+        with self._lock:
+            origin.requests += 1
+            origin.failures += 1
+            self._update_latency(origin, FAILURE_LATENCY_PENALTY)
+        if origin.breaker.record_failure():
+            logger.warning(f"Circuit opened for CDN origin {origin.url} after "
+                           f"{origin.breaker.consecutive_failures} consecutive failures, "
+                           f"retrying in {origin.breaker.retry_after():.0f}s")
+
+    def _update_latency(self, origin: Origin, latency: float):
+        if origin.latency is None:
+            origin.latency = latency
+        else:
+            origin.latency += self.ewma_alpha * (latency - origin.latency)
+
+    def _ensure_health_checker(self):
+        # One checker thread per worker process, started on first use; a
+        # single origin has nowhere to fail over to, so it is not checked
+        if len(self.origins) < 2:
+            return
+        with self._lock:
+            if self._checker_pid == os.getpid():
+                return
+            self._checker_pid = os.getpid()
+        threading.Thread(target=self._health_check_loop, name='origin-health-check', daemon=True).start()
+
+    def check_health(self, session: requests.Session):
+        for origin in self.origins:
+            try:
+                response = session.head(origin.url + self.health_check_path, timeout=self.health_check_timeout)
+                up = response.status_code < 500
+            except requests.RequestException:
+                up = False
+            if not up and origin.breaker.trip():
+                logger.warning(f"Circuit opened for CDN origin {origin.url} by a failed health check")
+            elif up:
+                origin.breaker.allow_probe()
+
+    def _health_check_loop(self):
+        session = requests.Session()
+        while True:
+            time.sleep(self.health_check_interval)
+            try:
+                self.check_health(session)
+            except Exception as e:
+                logger.error(f"Origin health check failed: {str(e)}")
+
+    # Sync clients (app.py)
+
+    def _hedge_delay(self) -> Optional[float]:
+        return self.hedging.delay() if self.hedging is not None else None
+
+    def _can_hedge(self) -> bool:
+        # A hedged GET needs two free executor threads; when they are all
+        # busy with slow fetches, a plain request beats queueing behind them
+        with self._lock:
+            return self._hedge_threads_busy + 2 <= self.hedge_workers
+
+    def _submit(self, *args) -> Future:
+        executor = self._hedge_executor()
+        with self._lock:
+            self._hedge_threads_busy += 1
+        future = executor.submit(self._attempt, *args)
+        future.add_done_callback(self._release_hedge_thread)
+        return future
+
+    def _release_hedge_thread(self, future):
+        with self._lock:
+            self._hedge_threads_busy -= 1
+
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix='hedge')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _attempt(self, client, origin: Origin, path: str, headers: Optional[dict]) -> requests.Response:
+        _acquire_circuit(origin)
+        started = time.perf_counter()
+        try:
+            response = client.get(f"{origin.url}/{path}", headers=headers)
+        except FAILOVER_EXCEPTIONS:
+            self.record_failure(origin)
+            raise
+        except BaseException:
+            origin.breaker.release()
+            raise
+        if _origin_failed(response.status_code):
+            self.record_failure(origin)
+        else:
+            self.record_success(origin, time.perf_counter() - started)
+        return response
+
+    def get(self, client, path: str, headers: dict = None) -> requests.Response:
+        """GET path from the best origin, failing over (or hedging) to the others.
+
+        Under a concurrency limit the request holds its slot until the
+        returned response is closed, so callers must close it.
+        """
+        if self.concurrency_limit is None:
+            return self._get(client, path, headers)
+        self._acquire_limit()
+        started = time.perf_counter()
+        try:
+            response = self._get(client, path, headers)
+        except CircuitOpenError:
+            self.concurrency_limit.release()
+            raise
+        except BaseException:
+            self.concurrency_limit.release(time.perf_counter() - started, dropped=True)
+            raise
+        slot = _LimitSlot(self.concurrency_limit, time.perf_counter() - started, _origin_failed(response.status_code))
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                slot.release()
+
+        response.close = close_and_release
+        return response
+
+    def _acquire_limit(self):
+        if not self.concurrency_limit.try_acquire():
+            raise ConcurrencyLimitExceeded(
+                f"Over the limit of {int(self.concurrency_limit.limit)} upstream requests in flight",
+                self.concurrency_limit.retry_after
+            )
+
+    def _get(self, client, path: str, headers: Optional[dict]) -> requests.Response:
+        origins = self.ordered()
+        delay = self._hedge_delay()
+        last_error = None
+        index = 0
+        while index < len(origins):
+            try:
+                if delay is not None and self._can_hedge():
+                    response, used = self._hedged_get(
+                        client, origins[index], _hedge_target(origins, index), path, headers, delay
+                    )
+                else:
+                    response, used = self._attempt(client, origins[index], path, headers), 1
+            except FAILOVER_EXCEPTIONS as e:
+                last_error = e
+                index += getattr(e, 'origins_used', 1)
+                self._count_failover(index < len(origins))
+                continue
+            index += used
+            if _origin_failed(response.status_code) and index < len(origins):
+                response.close()
+                self._count_failover(True)
+                continue
+            return response
+        raise last_error
+
+    def _count_failover(self, failing_over: bool):
+        if failing_over:
+            with self._lock:
+                self.failovers += 1
+
+    def _hedged_get(self, client, first: Origin, second: Origin, path: str, headers: Optional[dict], delay: float):
+        """Return (response, origins used); the slower response is closed once it arrives"""
+        primary = self._submit(client, first, path, headers)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedging.try_spend():
+            return primary.result(), 1
+
+        used = 1 if second is first else 2
+        hedge = self._submit(client, second, path, headers)
+        pending = {primary, hedge}
+        last_error = None
+        fallback = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except FAILOVER_EXCEPTIONS as e:
+                    last_error = e
+                    continue
+                if _origin_failed(response.status_code) and pending:
+                    fallback = fallback or response
+                    continue
+                if future is hedge:
+                    self.hedging.record_win()
+                for loser in pending:
+                    loser.add_done_callback(_close_response)
+                if fallback is not None and fallback is not response:
+                    fallback.close()
+                return response, used
+        if fallback is not None:
+            return fallback, used
+        last_error.origins_used = used
+        raise last_error
+
+    # Async clients (asgi_app.py)
+
+    async def _attempt_async(self, client: httpx.AsyncClient, origin: Origin, path: str,
+                             headers: Optional[dict]) -> httpx.Response:
+        _acquire_circuit(origin)
+        started = time.perf_counter()
+        try:
+            response = await client.send(
+                client.build_request('GET', f"{origin.url}/{path}", headers=headers), stream=True
+            )
+        except ASYNC_FAILOVER_EXCEPTIONS:
+            self.record_failure(origin)
+            raise
+        except BaseException:
+            # Includes cancellation of a hedge's loser
+            origin.breaker.release()
+            raise
+        if _origin_failed(response.status_code):
+            self.record_failure(origin)
+        else:
+            self.record_success(origin, time.perf_counter() - started)
+        return response
+
+    async def get_async(self, client: httpx.AsyncClient, path: str, headers: dict = None) -> httpx.Response:
+        """Async counterpart of get() for the httpx client, returning a streamed response"""
+        if self.concurrency_limit is None:
+            return await self._get_async(client, path, headers)
+        self._acquire_limit()
+        started = time.perf_counter()
+        try:
+            response = await self._get_async(client, path, headers)
+        except CircuitOpenError:
+            self.concurrency_limit.release()
+            raise
+        except BaseException:
+            self.concurrency_limit.release(time.perf_counter() - started, dropped=True)
+            raise
+        slot = _LimitSlot(self.concurrency_limit, time.perf_counter() - started, _origin_failed(response.status_code))
+        aclose = response.aclose
+
+        # httpx also closes the response itself once the body is read
+        async def aclose_and_release():
+            try:
+                await aclose()
+            finally:
+                slot.release()
+
+        response.aclose = aclose_and_release
+        return response
+
+    async def _get_async(self, client: httpx.AsyncClient, path: str, headers: Optional[dict]) -> httpx.Response:
+        origins = self.ordered()
+        delay = self._hedge_delay()
+        last_error = None
+        index = 0
+        while index < len(origins):
+            try:
+                if delay is not None:
+                    response, used = await self._hedged_get_async(
+                        client, origins[index], _hedge_target(origins, index), path, headers, delay
+                    )
+                else:
+                    response, used = await self._attempt_async(client, origins[index], path, headers), 1
+            except ASYNC_FAILOVER_EXCEPTIONS as e:
+                last_error = e
+                index += getattr(e, 'origins_used', 1)
+                self._count_failover(index < len(origins))
+                continue
+            index += used
+            if _origin_failed(response.status_code) and index < len(origins):
+                await response.aclose()
+                self._count_failover(True)
+                continue
+            return response
+        raise last_error
+
+    async def _hedged_get_async(self, client, first: Origin, second: Origin, path: str, headers: Optional[dict],
+                                delay: float):
+        primary = asyncio.ensure_future(self._attempt_async(client, first, path, headers))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.hedging.try_spend():
+            return await primary, 1
+
+        used = 1 if second is first else 2
+        hedge = asyncio.ensure_future(self._attempt_async(client, second, path, headers))
+        pending = {primary, hedge}
+        last_error = None
+        fallback = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    response = task.result()
+                except ASYNC_FAILOVER_EXCEPTIONS as e:
+                    last_error = e
+                    continue
+                if _origin_failed(response.status_code) and pending:
+                    fallback = fallback or response
+                    continue
+                if task is hedge:
+                    self.hedging.record_win()
+                for loser in pending:
+                    loser.add_done_callback(_close_response_async)
+                    loser.cancel()
+                if fallback is not None and fallback is not response:
+                    await fallback.aclose()
+                return response, used
+        if fallback is not None:
+            return fallback, used
+        last_error.origins_used = used
+        raise last_error
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "origins": [origin.stats() for origin in self.origins],
+                "failovers": self.failovers,
+                "hedging": self.hedging.stats() if self.hedging is not None else None,
+                "concurrency_limit": self.concurrency_limit.stats() if self.concurrency_limit is not None else None
+            }
+
+
+class _LimitSlot:
+    """A concurrency limit slot held until the response body is closed.
+
+    The limit adapts to the time to response headers, which measures the
+    CDN; how long the body takes also depends on the client.
+    """
+
+    def __init__(self, limit: AdaptiveConcurrencyLimit, latency: float, dropped: bool):
+        self._limit = limit
+        self._latency = latency
+        self._dropped = dropped
+        self._lock = threading.Lock()
+        self._released = False
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limit.release(self._latency, dropped=self._dropped)
+
+
+def _origin_failed(status_code: int) -> bool:
+    """Whether a response counts against its origin (and is worth failing over)"""
+    return status_code >= 500 and status_code not in NOT_ORIGIN_FAILURES
+
+
+def _acquire_circuit(origin: Origin):
+    if not origin.breaker.acquire():
+        raise CircuitOpenError(f"Circuit open for CDN origin {origin.url}", origin.breaker.retry_after())
+
+
+def _hedge_target(origins: List[Origin], index: int) -> Origin:
+    # Hedge to the next origin, or retry the same one when there is no other:
+    # a second connection usually misses whatever stalled the first
+    return origins[index + 1] if index + 1 < len(origins) else origins[index]
+
+
+def _close_response_async(task):
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+def _close_response(future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
@@ -0,0 +1,142 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+class CachedPlaylist:
+    """A rewritten playlist body plus the upstream object and validators it came from"""
+
+    __slots__ = ('body', 'etag', 'last_modified', 'expires_at', 'upstream_path')
+
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str], expires_at: float,
+                 upstream_path: Optional[str] = None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.upstream_path = upstream_path
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def can_revalidate(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+    def validator_headers(self) -> dict:
+        """Conditional request headers for revalidating this entry upstream"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class PlaylistCache:
+    """In-process LRU cache of already-rewritten m3u8 playlists.
+
+    Entries are keyed by proxy path and bounded both by count and by total
+    bytes. Once an entry's TTL passes it is kept so it can be revalidated
+    upstream with its ETag/Last-Modified instead of being refetched.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get(self, key: str) -> Optional[CachedPlaylist]:
+        """Return the entry for key, fresh or stale, marking it recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.is_fresh():
+                self.hits += 1
+            return entry
+
+    def put(self, key: str, body: bytes, etag: str = None, last_modified: str = None,
+            upstream_path: str = None) -> CachedPlaylist:
+        """Store a rewritten playlist, evicting least recently used entries.
+
+        upstream_path records which CDN object the body came from (the
+        original or its precomputed variant), so revalidation asks for the
+        same object.
+        """
+        entry = CachedPlaylist(body, etag, last_modified, time.monotonic() + self.ttl, upstream_path)
+        if len(body) > self.max_bytes:
+            return entry
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[key] = entry
+            self._bytes += len(body)
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+        return entry
+
+    def refresh(self, entry: CachedPlaylist):
+        """Extend an entry's lifetime after upstream confirmed it unchanged"""
+        with self._lock:
+            entry.expires_at = time.monotonic() + self.ttl
+            self.revalidations += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry.body)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations
+            }
+
+
+class ExpiringSet:
+    """Bounded set whose members drop out ttl seconds after being added"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key: str):
+        with self._lock:
+            self._expiry.pop(key, None)
+            self._expiry[key] = time.monotonic() + self.ttl
+            while len(self._expiry) > self.max_entries:
+                self._expiry.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            expires_at = self._expiry.get(key)
+            if expires_at is None:
+                return False
+            if time.monotonic() >= expires_at:
+                del self._expiry[key]
+                return False
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._expiry)
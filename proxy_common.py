@@ -0,0 +1,112 @@
+import math
+import time
+import posixpath
+
+from m3u8_parser import PlaylistRewriter, is_playlist
+
+# Proxy behaviour shared by the Flask app (app.py) and the ASGI engine (asgi_app.py)
+
+# Size of the chunks relayed to the client when streaming segments from the CDN
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Headers added to every successful proxy response
+PROXY_RESPONSE_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, OPTIONS',
+    'Access-Control-Allow-Headers': '*',
+    'Cache-Control': 'public, max-age=3600'
+}
+
+
+# Client headers passed through to the CDN for segment and key requests
+FORWARDED_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since')
+
+# CDN headers relayed to the client so it can revalidate and resume
+RELAYED_RESPONSE_HEADERS = ('Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified')
+
+# Ingest publishes each playlist a second time, already rewritten for the
+# proxy, as <name>.proxy.m3u8 next to the original
+PRECOMPUTED_PLAYLIST_SUFFIX = '.proxy.m3u8'
+
+
+def precomputed_playlist_path(playlist_path):
+    """Path of the proxy-ready variant of a playlist, or None if it already is one"""
+    if playlist_path.endswith(PRECOMPUTED_PLAYLIST_SUFFIX) or not playlist_path.endswith('.m3u8'):
+        return None
+    return playlist_path[:-len('.m3u8')] + PRECOMPUTED_PLAYLIST_SUFFIX
+
+
+def extract_video_name(target_path):
+    """Return the video name from a 'videos/<name>/...' proxy path, or None"""
+    path_parts = target_path.split('/')
+    if len(path_parts) >= 2 and path_parts[0] == 'videos':
+        return path_parts[1]
+    return None
+
+
+def validate_m3u8(content):
+    """Return an error message if the playlist body (bytes) is unusable, otherwise None"""
+    if not content.strip():
+        return "Empty m3u8 file received"
+    if not is_playlist(content):
+        return "Invalid m3u8 file format"
+    return None
+
+
+class PlaylistBody:
+    """Collects an upstream playlist as its chunks arrive, rewriting URIs on the way.
+
+    The original body is never joined into one buffer unless it is kept
+    for the access log; only the rewritten body is, for the playlist cache.
+    A proxy-ready variant (rewrite=False) is collected as it is.
+    """
+
+    def __init__(self, target_path, rewrite=True, keep_original=False):
+        self.rewriter = PlaylistRewriter(posixpath.dirname(target_path)) if rewrite else None
+        # Enough of the start of the body to validate it
+        self.head = b''
+        self.rewrite_seconds = 0.0
+        self._parts = []
+        self._original = [] if keep_original else None
+
+    def feed(self, chunk):
+        if len(self.head.lstrip()) < len(b'#EXTM3U'):
+            self.head += chunk
+        if self._original is not None:
+            self._original.append(chunk)
+        if self.rewriter is None:
+            self._parts.append(chunk)
+            return
+        started = time.perf_counter()
+        self._parts.append(self.rewriter.feed(chunk))
+        self.rewrite_seconds += time.perf_counter() - started
+
+    def finish(self):
+        """Return the whole (rewritten) body"""
+        if self.rewriter is not None:
+            self._parts.append(self.rewriter.finish())
+        return b''.join(self._parts)
+
+    def original(self):
+        return b''.join(self._original or ())
+
+
+def get_content_type(path):
+    """Determine content type based on file extension"""
+    if path.endswith('.m3u8'):
+        return 'application/vnd.apple.mpegurl'
+    elif path.endswith('.ts'):
+        return 'video/mp2t'
+    elif path.endswith('.key'):
+        return 'application/octet-stream'
+    elif path.endswith('.jpg'):
+        return 'image/jpeg'
+    elif path.endswith('.vtt'):
+        return 'text/vtt'
+    else:
+        return 'application/octet-stream'
+
+
+def retry_after_header(seconds):
+    """Retry-After value for a request shed by a circuit breaker or the concurrency limit"""
+    return str(max(math.ceil(seconds), 1))
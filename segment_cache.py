@@ -0,0 +1,268 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Only immutable objects are cached on disk; playlists live in PlaylistCache
+CACHEABLE_EXTENSIONS = ('.ts', '.key')
+
+# Largest chunk a FillReader hands out at once
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class FillReader:
+    """Iterates over a cache entry while SegmentCache fills it.
+
+    Reads follow the writer through the temporary file, waiting when they
+    catch up, and stop at the end of what the fill managed to write.
+    """
+
+    def __init__(self, file):
+        self._file = file
+        self._condition = threading.Condition()
+        self._written = 0
+        self._done = False
+        self._position = 0
+
+    def advance(self, written: int):
+        with self._condition:
+            self._written = written
+            self._condition.notify_all()
+
+    def finish(self):
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        with self._condition:
+            while self._position >= self._written and not self._done:
+                self._condition.wait()
+            available = self._written - self._position
+        if available <= 0:
+            raise StopIteration
+        data = self._file.read(min(available, READ_CHUNK_SIZE))
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class SegmentCache:
+    """On-disk cache of segments and keys shared by every worker on the host.
+
+    Objects are written to a temporary file and atomically renamed into
+    place, so a reader in another worker never sees a partial file. The
+    cache is kept under a byte budget by evicting least recently used
+    (``lru``) or least frequently used (``lfu``) entries. Recency is the
+    file mtime, touched on every hit; frequency is the length of a small
+    ``.hits`` sidecar that each hit appends one byte to.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, policy: str = 'lru', evict_to: float = 0.9):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown segment cache eviction policy: {policy}")
+
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.evict_to = evict_to
+        self._tmp_dir = self.directory / 'tmp'
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+        # Lock files for coalescing fetches across workers (see SingleFlight);
+        # never evicted, since unlinking a held lock file breaks the exclusion
+        self.lock_dir = self.directory / 'locks'
+
+        # Bytes this worker has added since it last measured the directory
+        self._lock = threading.Lock()
+        self._added_since_scan = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def is_cacheable(target_path: str) -> bool:
+        return target_path.endswith(CACHEABLE_EXTENSIONS)
+
+    def _path_for(self, key: str) -> Path:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return self.directory / digest[:2] / digest
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Return the cached file for key and record the access, or None"""
+        path = self._path_for(key)
+        try:
+            if self.policy == 'lru':
+                os.utime(path)
+            else:
+                os.stat(path)
+                with open(f"{path}.hits", 'ab') as hits:
+                    hits.write(b'.')
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def etag_for(self, path: Path) -> Optional[str]:
+        """Return the upstream ETag recorded when path was filled, if any"""
+        try:
+            with open(f"{path}.etag", 'r') as f:
+                return f.read() or None
+        except OSError:
+            return None
+
+    def fill_in_background(self, key: str, chunks: Iterable[bytes], expected_length: Optional[int] = None,
+                           etag: Optional[str] = None, on_done: Iterable[Callable[[], None]] = ()) -> 'FillReader':
+        """Write chunks to the cache on a background thread, as fast as upstream sends them.
+
+        Returns a reader over the body as it lands in the temporary file, so
+        a slow client neither slows the fill nor delays the commit that
+        other requests wait for. The entry is only committed once the whole
+        body has been written. Closing the reader early leaves the fill
+        running; on_done callbacks run when it ends, committed or not.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        progress = FillReader(open(tmp_path, 'rb'))
+        threading.Thread(
+            target=self._fill, args=(key, chunks, fd, tmp_path, expected_length, etag, progress, list(on_done)),
+            name='segment-fill', daemon=True
+        ).start()
+        return progress
+
+    def _fill(self, key, chunks, fd, tmp_path, expected_length, etag, progress, on_done):
+        path = self._path_for(key)
+        written = 0
+        committed = False
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in chunks:
+                    tmp.write(chunk)
+                    tmp.flush()
+                    written += len(chunk)
+                    progress.advance(written)
+
+            if expected_length is None or written == expected_length:
+                path.parent.mkdir(exist_ok=True)
+                if etag:
+                    self._write_atomic(f"{path}.etag", etag.encode('utf-8'))
+                os.replace(tmp_path, path)
+                committed = True
+        except Exception as e:
+            logger.warning(f"Segment cache fill failed for {key}: {str(e)}")
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            if not committed:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            progress.finish()
+            for callback in on_done:
+                callback()
+
+        with self._lock:
+            if committed:
+                self.stores += 1
+            self._added_since_scan += written
+            should_evict = self._added_since_scan > self.max_bytes * (1 - self.evict_to)
+        if should_evict:
+            self.evict()
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Bring the cache back under its byte budget.
+
+        Only one worker evicts at a time; the others skip the scan.
+        """
+        lock_file = open(self.directory / '.evict.lock', 'w')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return
+
+            entries = []
+            total = 0
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir() or shard.name in (self._tmp_dir.name, self.lock_dir.name):
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(('.hits', '.etag')):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    hits = 0
+                    if self.policy == 'lfu':
+                        try:
+                            hits = os.path.getsize(f"{entry.path}.hits")
+                        except OSError:
+                            pass
+                    entries.append((hits, stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            with self._lock:
+                self._added_since_scan = 0
+
+            if total <= self.max_bytes:
+                return
+
+            # Fewest hits first for LFU (mtime breaks ties), oldest first for LRU
+            entries.sort()
+            target = self.max_bytes * self.evict_to
+            removed = 0
+            for _, _, size, path in entries:
+                if total <= target:
+                    break
+                for victim in (path, f"{path}.hits", f"{path}.etag"):
+                    try:
+                        os.unlink(victim)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                removed += 1
+
+            with self._lock:
+                self.evictions += removed
+            logger.info(f"Segment cache evicted {removed} entries, {total} bytes remain")
+        finally:
+            lock_file.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": str(self.directory),
+                "policy": self.policy,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions
+            }
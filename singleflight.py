@@ -0,0 +1,129 @@
+import time
+import zlib
+import threading
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+# Cross-worker lock files are striped so the lock directory stays bounded
+LOCK_STRIPES = 4096
+
+
+class Flight:
+    """Leadership of one in-flight upstream fetch, released when it completes"""
+
+    def __init__(self, group: 'SingleFlight', key: str, event: threading.Event, lock_file=None):
+        self._group = group
+        self._key = key
+        self._event = event
+        self._lock_file = lock_file
+        self._released = False
+
+    def release(self):
+        """Wake every waiter for this key; safe to call more than once"""
+        if self._released:
+            return
+        self._released = True
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+        self._group._finish(self._key, self._event)
+
+
+class SingleFlight:
+    """Coalesce concurrent upstream fetches of the same key.
+
+    The first caller for a key becomes the leader and gets a Flight to
+    release once its fetch has filled the cache; other callers wait for
+    that release and then re-check the cache instead of going upstream.
+    With a lock_dir, leadership is also held as an flock on a lock file so
+    workers on the same host coalesce through the shared disk cache.
+    """
+
+    def __init__(self, lock_dir: str = None, wait_timeout: float = 30.0):
+        self.lock_dir = Path(lock_dir) if lock_dir and fcntl is not None else None
+        if self.lock_dir is not None:
+            self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def _lock_path(self, key: str) -> Path:
+        return self.lock_dir / f"{zlib.crc32(key.encode('utf-8')) % LOCK_STRIPES}.lock"
+
+    def acquire(self, key: str) -> Optional[Flight]:
+        """Become the leader for key, or return None if a fetch is already running"""
+        with self._lock:
+            if key in self._inflight:
+                self.followers += 1
+                return None
+            event = threading.Event()
+            self._inflight[key] = event
+
+        lock_file = None
+        if self.lock_dir is not None:
+            lock_file = open(self._lock_path(key), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                self._finish(key, event)
+                with self._lock:
+                    self.followers += 1
+                return None
+
+        with self._lock:
+            self.leaders += 1
+        return Flight(self, key, event, lock_file)
+
+    def wait(self, key: str) -> bool:
+        """Block until the current leader for key finishes; False on timeout"""
+        with self._lock:
+            event = self._inflight.get(key)
+
+        if event is not None:
+            finished = event.wait(self.wait_timeout)
+        elif self.lock_dir is not None:
+            finished = self._wait_for_lock_file(key)
+        else:
+            finished = True
+
+        if not finished:
+            with self._lock:
+                self.timeouts += 1
+        return finished
+
+    def _wait_for_lock_file(self, key: str) -> bool:
+        deadline = time.monotonic() + self.wait_timeout
+        with open(self._lock_path(key), 'a') as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    return True
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        return False
+                    time.sleep(0.02)
+
+    def _finish(self, key: str, event: threading.Event):
+        with self._lock:
+            if self._inflight.get(key) is event:
+                del self._inflight[key]
+        event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._inflight),
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "timeouts": self.timeouts
+            }
@@ -1,10 +1,57 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
+from botocore.exceptions import ClientError
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
+from typing import Dict, Optional
 import os
+import random
+import threading
+import time
+from ingest_manifest import IngestManifest, file_md5
+from m3u8_parser import rewrite_playlist
+from proxy_common import precomputed_playlist_path
+from video_catalog import change_log_key
+
+# Objects at least this large are uploaded in parts by upload_file, and
+# their ETag is then not the content MD5
+MULTIPART_THRESHOLD = TransferConfig().multipart_threshold
+
+# One entry of a bucket listing; etag is None when not yet known
+RemoteObject = namedtuple('RemoteObject', ['size', 'etag', 'last_modified'])
+
+
+class UploadResult:
+    """Aggregated outcome of uploading a video's files"""
+
+    def __init__(self, video_name: str):
+        self.video_name = video_name
+        self.uploaded = []
+        self.skipped = []  # already in storage with identical content
+        self.failed = {}  # object key -> last error message
+
+    def __bool__(self):
+        return not self.failed
+
+    def summary(self) -> str:
+        total = len(self.uploaded) + len(self.skipped) + len(self.failed)
+        if not self.failed:
+            return f"Uploaded {len(self.uploaded)} objects for {self.video_name} ({len(self.skipped)} already in storage)"
+        lines = [f"{len(self.failed)} of {total} objects failed for {self.video_name}:"]
+        lines += [f"  {key}: {error}" for key, error in sorted(self.failed.items())]
+        return "\n".join(lines)
+
 
 class LeasewebStorageHandler:
-    def __init__(self, control_config, cdn_config):
+    def __init__(self, control_config, cdn_config, upload_concurrency: int = 8,
+                 max_retries: int = 3, retry_backoff: float = 0.5, inventory_ttl: float = 300):
+        # Validate required configuration
+        if not control_config['access_key'] or not control_config['secret_key']:
+            raise ValueError("Missing required environment variables: LEASEWEB_ACCESS_KEY and/or LEASEWEB_SECRET_KEY")
+
         # Initialize control bucket client
         self.control_session = boto3.client(
             's3',
@@ -12,7 +59,7 @@ class LeasewebStorageHandler:
             aws_access_key_id=control_config['access_key'],
             aws_secret_access_key=control_config['secret_key'],
             region_name=control_config['region'],
-            config=Config(signature_version='s3v4')
+            config=Config(signature_version='s3v4', max_pool_connections=max(upload_concurrency, 10))
         )
         self.control_bucket = control_config['bucket_name']
 
@@ -23,10 +70,20 @@ class LeasewebStorageHandler:
             aws_access_key_id=cdn_config['access_key'],
             aws_secret_access_key=cdn_config['secret_key'],
             region_name=cdn_config['region'],
-            config=Config(signature_version='s3v4')
+            config=Config(signature_version='s3v4', max_pool_connections=max(upload_concurrency, 10))
         )
         self.cdn_bucket = cdn_config['bucket_name']
 
+        # Parallel upload tuning
+        self.upload_concurrency = upload_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        # Cached bucket listings: (bucket, prefix) -> (listed at, {key: RemoteObject})
+        self.inventory_ttl = inventory_ttl
+        self._listings = {}
+        self._listings_lock = threading.Lock()
+
     def check_connection(self):
         """Check if we can connect to both storage buckets"""
         try:
@@ -43,11 +100,119 @@ class LeasewebStorageHandler:
             print(f"Failed to connect to storage: {str(e)}")
             return False
 
+    def _upload_with_retry(self, session, bucket: str, local_path: str, object_key: str, md5: str = None):
+        """Upload one object, retrying with exponential backoff and jitter.
+
+        The content MD5 is stored as object metadata, because multipart
+        uploads get an ETag that is not the plain MD5. Raises the last error
+        once all attempts are used up.
+        """
+        extra_args = {'Metadata': {'md5': md5}} if md5 else None
+        for attempt in range(self.max_retries + 1):
+            try:
+                session.upload_file(local_path, bucket, object_key, ExtraArgs=extra_args)
+                self._record_upload(bucket, local_path, object_key, md5)
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * (0.5 + random.random())
+                print(f"Retrying {object_key} in {delay:.1f}s after error: {str(e)}")
+                time.sleep(delay)
+
+    def _listing(self, session, bucket: str, prefix: str, refresh: bool = False) -> Dict[str, RemoteObject]:
+        """Cached index of every object under prefix, from paginated list_objects_v2"""
+        with self._listings_lock:
+            cached = self._listings.get((bucket, prefix))
+        if cached is not None and not refresh and time.monotonic() - cached[0] < self.inventory_ttl:
+            return cached[1]
+
+        index = {}
+        paginator = session.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                index[item['Key']] = RemoteObject(item['Size'], item['ETag'].strip('"'), item['LastModified'])
+
+        with self._listings_lock:
+            self._listings[(bucket, prefix)] = (time.monotonic(), index)
+        return index
+
+    def _record_upload(self, bucket: str, local_path: str, object_key: str, md5: Optional[str]):
+        """Keep cached listings current after an upload instead of relisting"""
+        size = os.path.getsize(local_path)
+        etag = md5 if size < MULTIPART_THRESHOLD else None
+        with self._listings_lock:
+            for (listed_bucket, prefix), (_, index) in self._listings.items():
+                if listed_bucket == bucket and object_key.startswith(prefix):
+                    index[object_key] = RemoteObject(size, etag, datetime.now(timezone.utc))
+
+    def list_objects(self, session, bucket: str, prefix: str, refresh: bool = False) -> Dict[str, RemoteObject]:
+        """Return key -> RemoteObject(size, etag, last_modified) for every object under prefix.
+
+        Listings are cached for inventory_ttl seconds and updated as this
+        handler uploads, so diffing local output against a bucket costs a
+        few list calls instead of one HEAD per object.
+        """
+        index = self._listing(session, bucket, prefix, refresh)
+        with self._listings_lock:
+            return dict(index)
+
+    def inventory(self, video_name: str, refresh: bool = False) -> Dict[str, RemoteObject]:
+        """Everything stored for a video across the control and CDN buckets"""
+        prefix = f"videos/{video_name}/"
+        index = self.list_objects(self.cdn_session, self.cdn_bucket, prefix, refresh)
+        index.update(self.list_objects(self.control_session, self.control_bucket, prefix, refresh))
+        return index
+
+    def object_matches(self, session, bucket: str, object_key: str, md5: str) -> bool:
+        """Check whether the bucket already holds object_key with this content hash.
+
+        Answered from the video's cached listing; only objects whose listed
+        ETag is not their MD5 (multipart uploads) need a HEAD for the md5
+        metadata.
+        """
+        prefix = '/'.join(object_key.split('/')[:2]) + '/'
+        try:
+            index = self._listing(session, bucket, prefix)
+            with self._listings_lock:
+                listed = index.get(object_key)
+            if listed is None:
+                return False
+            if listed.etag == md5:
+                return True
+        except ClientError:
+            pass  # listing not permitted, fall back to HEAD
+
+        try:
+            head = session.head_object(Bucket=bucket, Key=object_key)
+        except ClientError:
+            return False
+        return head.get('ETag', '').strip('"') == md5 or head.get('Metadata', {}).get('md5') == md5
+
+    def _sync_object(self, session, bucket: str, local_path: str, object_key: str,
+                     manifest: IngestManifest = None) -> bool:
+        """Upload one object unless storage already holds identical content.
+
+        Skipping needs a manifest; without one the object is always
+        uploaded. Returns False if the upload was skipped.
+        """
+        if manifest is None:
+            self._upload_with_retry(session, bucket, local_path, object_key)
+            return True
+
+        md5 = file_md5(local_path)
+        if manifest.is_uploaded(object_key, md5) or self.object_matches(session, bucket, object_key, md5):
+            manifest.mark_uploaded(object_key, md5)
+            return False
+        self._upload_with_retry(session, bucket, local_path, object_key, md5)
+        manifest.mark_uploaded(object_key, md5)
+        return True
+
     def upload_control_file(self, local_path: str, object_key: str) -> bool:
         """Upload control files (m3u8, key) to control bucket"""
         try:
             print(f"Uploading control file {local_path} to {object_key}...")
-            self.control_session.upload_file(local_path, self.control_bucket, object_key)
+            self._upload_with_retry(self.control_session, self.control_bucket, local_path, object_key)
             print(f"Successfully uploaded control file {object_key}")
             return True
         except Exception as e:
@@ -58,41 +223,112 @@ class LeasewebStorageHandler:
         """Upload segment files to CDN bucket"""
         try:
             print(f"Uploading segment {local_path} to {object_key}...")
-            self.cdn_session.upload_file(local_path, self.cdn_bucket, object_key)
+            self._upload_with_retry(self.cdn_session, self.cdn_bucket, local_path, object_key)
             print(f"Successfully uploaded segment {object_key}")
             return True
         except Exception as e:
             print(f"Failed to upload segment {object_key}: {str(e)}")
             return False
 
-    def upload_video_files(self, video_name: str, video_dir: Path) -> bool:
-        """Upload all files related to a video to their respective buckets"""
+    def start_segment_upload(self, video_name: str, concurrency: int = None,
+                             manifest: IngestManifest = None) -> 'SegmentUploader':
+        """Start a parallel uploader that segments can be submitted to as they appear"""
+        return SegmentUploader(self, UploadResult(video_name), concurrency or self.upload_concurrency, manifest)
+
+    def upload_control_files(self, video_name: str, video_dir: Path, result: UploadResult,
+                             manifest: IngestManifest = None) -> UploadResult:
+        """Upload control files (metadata, key, iframe playlists, stream playlists) to the control bucket.
+
+        metadata.json goes first, so every title that shows up in the
+        control bucket has its catalog entry. Rendition playlists of an ABR
+        title sit in one directory per rendition. Each stream.m3u8 goes
+        after its iframes.m3u8 and master.m3u8 goes last, so a title only
+        becomes playable once everything it references is already in
+        storage. Every playlist is preceded by its proxy-ready variant.
+        With a manifest, files already in storage with the same content are
+        skipped. Once all of them are up, the title is announced in the
+        catalog's change log so the proxies pick it up without a full
+        bucket listing.
+        """
+        playlist_dirs = sorted(path.parent for path in video_dir.glob("*/stream.m3u8")) + [video_dir]
+        playlists = []
+        for playlist_dir in playlist_dirs:
+            playlists += [playlist_dir / "iframes.m3u8", playlist_dir / "stream.m3u8"]
+        playlists.append(video_dir / "master.m3u8")
+
+        local_files = [video_dir / "metadata.json", video_dir / "key.key"]
+        for playlist in playlists:
+            if playlist.exists():
+                local_files += [self._write_proxy_playlist(video_name, video_dir, playlist), playlist]
+
+        for local_file in local_files:
+            if local_file.exists():
+                object_key = f"videos/{video_name}/{local_file.relative_to(video_dir).as_posix()}"
+                try:
+                    print(f"Uploading control file {local_file} to {object_key}...")
+                    if self._sync_object(self.control_session, self.control_bucket, str(local_file),
+                                         object_key, manifest):
+                        print(f"Successfully uploaded control file {object_key}")
+                        result.uploaded.append(object_key)
+                    else:
+                        print(f"Control file {object_key} already in storage, skipped")
+                        result.skipped.append(object_key)
+                except Exception as e:
+                    print(f"Failed to upload control file {object_key}: {str(e)}")
+                    result.failed[object_key] = str(e)
+                    break
+
+        if not result.failed:
+            try:
+                self.control_session.put_object(Bucket=self.control_bucket, Key=change_log_key(video_name), Body=b'')
+            except Exception as e:
+                # The next full catalog listing still finds the title
+                print(f"Failed to announce {video_name} in the catalog change log: {str(e)}")
+        return result
+
+    def _write_proxy_playlist(self, video_name: str, video_dir: Path, playlist: Path) -> Path:
+        """Write <name>.proxy.m3u8 next to a playlist, with its URIs already rewritten.
+
+        The rewrite only depends on the title and the playlist's own path,
+        so the proxy can serve this variant byte-for-byte.
+        """
+        object_key = f"videos/{video_name}/{playlist.relative_to(video_dir).as_posix()}"
+        variant = playlist.with_name(precomputed_playlist_path(playlist.name))
+        variant.write_bytes(rewrite_playlist(playlist.read_bytes(), object_key))
+        return variant
+
+    def upload_video_files(self, video_name: str, video_dir: Path, concurrency: int = None,
+                           manifest: IngestManifest = None) -> UploadResult:
+        """Upload all files related to a video to their respective buckets.
+
+        Segments are uploaded in parallel (concurrency=1 uploads them one by
+        one), then the control files. The returned UploadResult is falsy if
+        any object failed and lists exactly which keys did.
+        """
+        uploader = self.start_segment_upload(video_name, concurrency, manifest)
+        result = uploader.result
         try:
-            # 1. Upload control files (m3u8, key) to control bucket
-            control_files = [
-                (video_dir / "key.key", f"videos/{video_name}/key.key"),
-                (video_dir / "stream.m3u8", f"videos/{video_name}/stream.m3u8"),
-                (video_dir / "iframes.m3u8", f"videos/{video_name}/iframes.m3u8")
-            ]
-
-            for local_file, object_key in control_files:
-                if local_file.exists():
-                    if not self.upload_control_file(str(local_file), object_key):
-                        return False
-
-            # 2. Upload segments to CDN bucket
-            segments_dir = video_dir / "segments"
-            for segment in segments_dir.glob("*.ts"):
-                object_key = f"videos/{video_name}/segments/{segment.name}"
-                if not self.upload_segment_file(str(segment), object_key):
-                    return False
-
-            print(f"Successfully uploaded all files for {video_name}")
-            return True
+            # 1. Upload segments to CDN bucket, from every rendition's segments/,
+            # along with the poster, sprite sheet and thumbnail track
+            segments = sorted(video_dir.glob("segments/*.ts")) + sorted(video_dir.glob("*/segments/*.ts"))
+            segments += sorted(video_dir.glob("thumbnails/*"))
+            print(f"Uploading {len(segments)} segments with up to {uploader.concurrency} in parallel...")
+            for segment in segments:
+                uploader.submit(segment, f"videos/{video_name}/{segment.relative_to(video_dir).as_posix()}")
+            uploader.finish()
+
+            # 2. Upload control files (m3u8, key) to control bucket once
+            # every segment they reference is in place
+            if result:
+                self.upload_control_files(video_name, video_dir, result, manifest)
 
         except Exception as e:
+            uploader.finish()
             print(f"Error uploading video files for {video_name}: {str(e)}")
-            return False
+            result.failed.setdefault(f"videos/{video_name}/", str(e))
+
+        print(result.summary())
+        return result
 
     def generate_presigned_url(self, object_key: str, expiration: int = 3600) -> str:
         """Generate a presigned URL for an object from the control bucket"""
@@ -108,4 +344,40 @@ class LeasewebStorageHandler:
             return url
         except Exception as e:
             print(f"Error generating presigned URL: {str(e)}")
-            return None 
\ No newline at end of file
+            return None 
+
+
+class SegmentUploader:
+    """Bounded thread pool uploading segments to the CDN bucket as they are submitted"""
+
+    def __init__(self, handler: LeasewebStorageHandler, result: UploadResult, concurrency: int,
+                 manifest: IngestManifest = None):
+        self.handler = handler
+        self.result = result
+        self.concurrency = concurrency
+        self.manifest = manifest
+        self._pool = ThreadPoolExecutor(max_workers=concurrency)
+        self._futures = {}
+
+    def submit(self, local_path, object_key: str):
+        future = self._pool.submit(
+            self.handler._sync_object,
+            self.handler.cdn_session, self.handler.cdn_bucket, str(local_path), object_key, self.manifest
+        )
+        self._futures[future] = object_key
+
+    def finish(self) -> UploadResult:
+        """Wait for every submitted upload and record its outcome"""
+        for future in as_completed(self._futures):
+            object_key = self._futures[future]
+            try:
+                if future.result():
+                    self.result.uploaded.append(object_key)
+                else:
+                    self.result.skipped.append(object_key)
+            except Exception as e:
+                print(f"Failed to upload segment {object_key}: {str(e)}")
+                self.result.failed[object_key] = str(e)
+        self._futures = {}
+        self._pool.shutdown(wait=True)
+        return self.result
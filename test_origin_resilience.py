@@ -0,0 +1,174 @@
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from concurrency_limit import AdaptiveConcurrencyLimit
+from hedging import HedgePolicy
+from origin_pool import _origin_failed
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(monkeypatch, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return CircuitBreaker(**kwargs), clock
+
+
+def test_breaker_opens_after_consecutive_failures(monkeypatch):
+    breaker, _ = make_breaker(monkeypatch, failure_threshold=3, reset_timeout=10)
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.acquire()
+    assert breaker.retry_after() == 10
+
+
+def test_breaker_half_open_admits_one_probe_then_closes(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch, failure_threshold=1, reset_timeout=10, half_open_probes=1)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.acquire()
+    assert not breaker.acquire()
+    assert breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.acquire()
+
+
+def test_breaker_failed_probe_doubles_open_time_up_to_the_cap(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch, failure_threshold=1, reset_timeout=10, max_reset_timeout=30)
+    breaker.record_failure()
+    for expected in (20, 30, 30):
+        clock.now += breaker.retry_after()
+        assert breaker.acquire()
+        assert breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.retry_after() == expected
+
+    # A success resets the open time to reset_timeout
+    clock.now += breaker.retry_after()
+    breaker.acquire()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.retry_after() == 10
+
+
+def test_breaker_released_probe_can_be_taken_again(monkeypatch):
+    breaker, clock = make_breaker(monkeypatch, failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.acquire()
+    breaker.release()
+    assert breaker.acquire()
+
+
+def test_breaker_trip_and_allow_probe(monkeypatch):
+    breaker, _ = make_breaker(monkeypatch, reset_timeout=10)
+    assert breaker.trip()
+    assert not breaker.trip()
+    assert breaker.state == OPEN
+    breaker.allow_probe()
+    assert breaker.state == HALF_OPEN
+    assert breaker.available()
+
+
+def test_not_implemented_is_not_an_origin_failure():
+    assert _origin_failed(500)
+    assert _origin_failed(503)
+    assert not _origin_failed(501)
+    assert not _origin_failed(404)
+
+
+def test_limit_rejects_over_the_limit():
+    limit = AdaptiveConcurrencyLimit(initial_limit=2, min_limit=1)
+    assert limit.try_acquire()
+    assert limit.try_acquire()
+    assert not limit.try_acquire()
+    assert limit.stats()["rejected"] == 1
+    limit.release()
+    assert limit.try_acquire()
+
+
+def test_limit_grows_additively_while_busy_and_fast():
+    limit = AdaptiveConcurrencyLimit(initial_limit=4, max_limit=5, latency_threshold=1.0)
+    for _ in range(4):
+        assert limit.try_acquire()
+    limit.release(0.1)
+    assert limit.limit == 4.25
+
+    # Under half the limit in use there is no evidence more would help
+    for _ in range(3):
+        limit.release()
+    limit.try_acquire()
+    limit.release(0.1)
+    assert limit.limit == 4.25
+
+    for _ in range(50):
+        for _ in range(4):
+            limit.try_acquire()
+        for _ in range(4):
+            limit.release(0.1)
+    assert limit.limit == 5
+
+
+def test_limit_backs_off_on_slow_or_dropped_requests():
+    limit = AdaptiveConcurrencyLimit(initial_limit=10, min_limit=8, backoff_ratio=0.9, latency_threshold=1.0)
+    limit.try_acquire()
+    limit.release(2.0)
+    assert limit.limit == 9
+    limit.try_acquire()
+    limit.release(0.1, dropped=True)
+    assert limit.limit == 8.1
+    limit.try_acquire()
+    limit.release(0.1, dropped=True)
+    assert limit.limit == 8
+
+
+def test_limit_release_without_latency_leaves_limit_alone():
+    limit = AdaptiveConcurrencyLimit(initial_limit=4)
+    limit.try_acquire()
+    limit.release()
+    assert limit.limit == 4
+    assert limit.stats()["in_flight"] == 0
+
+
+def test_hedge_budget_is_earned_per_request_and_capped_by_burst():
+    policy = HedgePolicy(fixed_delay=0.05, budget=0.5, burst=2)
+    assert policy.try_spend()
+    assert policy.try_spend()
+    assert not policy.try_spend()
+    assert policy.stats()["denied_by_budget"] == 1
+
+    # Each GET earns half a token
+    policy.delay()
+    assert not policy.try_spend()
+    policy.delay()
+    assert policy.try_spend()
+
+    for _ in range(10):
+        policy.delay()
+    assert policy.stats()["tokens"] == 2
+    assert policy.stats()["hedges"] == 3
+
+
+def test_hedging_is_off_without_a_budget_or_delay():
+    assert HedgePolicy(fixed_delay=0.05, budget=0).delay() is None
+    assert HedgePolicy(budget=0.05).delay() is None
+
+
+def test_hedge_delay_follows_the_latency_percentile():
+    policy = HedgePolicy(percentile=90, min_delay=0.01, window=100, min_samples=100)
+    for i in range(99):
+        policy.record(i / 1000)
+    assert policy.delay() is None
+    policy.record(0.099)
+    assert policy.delay() == 0.09
@@ -8,6 +8,8 @@ from threading import Thread
 import requests
 from config import LEASEWEB_CONFIG
 from storage_handler import LeasewebStorageHandler
+from m3u8_parser import rewrite_playlist
+from proxy_common import get_content_type
 
 class VideoProxyHandler(http.server.SimpleHTTPRequestHandler):
     storage_handler = None  # Will be set when server starts
@@ -46,12 +48,11 @@ class VideoProxyHandler(http.server.SimpleHTTPRequestHandler):
                     
                     # If this is an m3u8 file, modify the URLs
                     if video_path.endswith('.m3u8'):
-                        content = self.modify_m3u8_urls(content.decode('utf-8'))
-                        content = content.encode('utf-8')
+                        content = rewrite_playlist(content, video_path)
                     
                     # Send response
                     self.send_response(200)
-                    self.send_header('Content-Type', self.get_content_type(video_path))
+                    self.send_header('Content-Type', get_content_type(video_path))
                     self.send_header('Content-Length', len(content))
                     self.end_headers()
                     self.wfile.write(content)
@@ -68,38 +69,6 @@ class VideoProxyHandler(http.server.SimpleHTTPRequestHandler):
             # Serve local files
             super().do_GET()
 
-    def get_content_type(self, path):
-        if path.endswith('.m3u8'):
-            return 'application/vnd.apple.mpegurl'
-        elif path.endswith('.ts'):
-            return 'video/mp2t'
-        elif path.endswith('.key'):
-            return 'application/octet-stream'
-        else:
-            return 'application/octet-stream'
-
-    def modify_m3u8_urls(self, content):
-        """Modify URLs in m3u8 file to use our proxy"""
-        lines = content.split('\n')
-        modified_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line.endswith('.ts') or line.endswith('.m3u8') or line.endswith('.key'):
-                # Convert the segment path to our proxy URL
-                if not line.startswith('http'):
-                    if line.startswith('segments/'):
-                        # For segment files, add video parameter
-                        modified_lines.append(f'/proxy/{line}?video={self.video_name}')
-                    else:
-                        modified_lines.append(f'/proxy/{line}')
-                else:
-                    modified_lines.append(line)
-            else:
-                modified_lines.append(line)
-        
-        return '\n'.join(modified_lines)
-
 class VideoPlayerTester:
     def __init__(self, storage_handler: LeasewebStorageHandler):
         self.storage = storage_handler
@@ -0,0 +1,115 @@
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import PROXY_UPSTREAM_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Headers sent with every request to the CDN
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': '*/*',
+    'Accept-Encoding': 'identity',  # Request uncompressed content
+    'Connection': 'keep-alive'
+}
+
+
+class UpstreamClient:
+    """Pooled keep-alive HTTP client used for every request to the CDN"""
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, max_retries: int,
+                 backoff_factor: float, connect_timeout: float, read_timeout: float, status_retries: int = None):
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Retry connection failures and transient gateway errors, but never a
+        # read timeout: a stalled segment should fail fast, not take 3x30s.
+        # status_retries=0 leaves gateway errors to the caller, e.g. to fail
+        # over to another origin at once instead of after the backoff.
+        retry = Retry(
+            total=max_retries,
+            read=0,
+            status=max_retries if status_retries is None else status_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            raise_on_status=False
+        )
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def request(self, method: str, url: str, headers: dict = None, timeout=None, **kwargs) -> requests.Response:
+        """Send a request through the shared connection pool"""
+        with self._lock:
+            self._requests += 1
+        try:
+            return self.session.request(method, url, headers=headers, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def get(self, url: str, headers: dict = None, timeout=None, stream: bool = True) -> requests.Response:
+        """GET a CDN object, streaming the body by default"""
+        return self.request('GET', url, headers=headers, timeout=timeout, stream=stream)
+
+    def head(self, url: str, headers: dict = None, timeout=None) -> requests.Response:
+        """HEAD a CDN object"""
+        return self.request('HEAD', url, headers=headers, timeout=timeout)
+
+    def stats(self) -> dict:
+        """Report request counts and how often pooled connections were reused"""
+        opened = 0
+        served = 0
+        pools = list(self._adapter.poolmanager.pools._container.values())
+        for pool in pools:
+            opened += pool.num_connections
+            served += pool.num_requests
+
+        reused = max(served - opened, 0)
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "requests": self._requests,
+                "errors": self._errors,
+                "pools": len(pools),
+                "connections_opened": opened,
+                "connections_reused": reused,
+                "reuse_ratio": round(reused / served, 4) if served else 0.0
+            }
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_upstream_client(config: dict = None) -> UpstreamClient:
+    """Return this worker's upstream client, creating it on first use.
+
+    The client is keyed by process id so that sockets opened before a
+    gunicorn fork (e.g. with --preload) are never shared between workers.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = UpstreamClient(**(config or PROXY_UPSTREAM_CONFIG))
+                _client_pid = pid
+                logger.info(f"Created upstream connection pool for worker {pid}")
+    return _client
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Titles shown when the control bucket cannot be listed (no credentials)
+FALLBACK_VIDEOS = ['fly', 'song', 'sparkle', 'maverick', 'transformers', 'whiplash']
+
+# Parallel metadata.json fetches while filling in newly listed titles
+METADATA_FETCH_CONCURRENCY = 8
+
+# Ingest drops an empty catalog/added/<UTC time>-<name> object into the
+# control bucket once a title is published; keys sort by time, so the
+# catalog can list just the titles added since its last refresh
+CHANGE_LOG_PREFIX = 'catalog/added/'
+CHANGE_LOG_TIME_FORMAT = '%Y%m%dT%H%M%S%fZ'
+
+# Change log entries are listed again from this many seconds before the
+# last refresh, to catch ingest hosts whose clocks run behind
+CHANGE_LOG_SKEW = 300
+
+# Longest wait between listing attempts while the bucket cannot be listed
+MAX_REFRESH_BACKOFF = 600
+
+
+def change_log_key(name: str, when: datetime = None, prefix: str = CHANGE_LOG_PREFIX) -> str:
+    """Key of the change log entry announcing a newly published title"""
+    when = when or datetime.now(timezone.utc)
+    return f"{prefix}{when.strftime(CHANGE_LOG_TIME_FORMAT)}-{name}"
+
+
+class VideoCatalog:
+    """In-memory, sorted index of the titles under videos/ in the control bucket.
+
+    A background thread refreshes the index every refresh_interval seconds.
+    With list_added, most refreshes only list the change log ingest writes
+    and insert the titles added since the previous one; the bucket's
+    ``videos/<name>/`` prefixes are listed in full every
+    full_refresh_interval, which is also when removed titles drop out.
+    Without it every refresh is a full listing. Requests are always
+    answered from the current index; one that finds it older than
+    refresh_interval wakes the refresher early and is still served the
+    stale copy (stale-while-revalidate). Only an index older than stale_ttl,
+    or none at all, makes a request wait for a fresh listing. Lookups are a
+    binary search on the sorted names, so prefix search and pagination stay
+    cheap with tens of thousands of titles.
+
+    A failed listing keeps the last good index serving (or fallback, if
+    there never was one), and further attempts back off exponentially up
+    to MAX_REFRESH_BACKOFF seconds instead of running on every request.
+
+    With load_metadata, each title's ingest-time metadata.json is fetched
+    once by the refresher, only for titles it has not seen yet, and kept
+    in memory for describe().
+    """
+
+    def __init__(self, list_names: Callable[[], List[str]], refresh_interval: float = 60,
+                 stale_ttl: float = 3600, load_metadata: Callable[[str], Optional[dict]] = None,
+                 list_added: Callable[[float], List[str]] = None, full_refresh_interval: float = 3600,
+                 fallback: List[str] = ()):
+        self._list_names = list_names
+        self._list_added = list_added
+        self._load_metadata = load_metadata
+        self.refresh_interval = refresh_interval
+        self.stale_ttl = stale_ttl
+        self.full_refresh_interval = full_refresh_interval
+        self.fallback = sorted(set(fallback), key=str.lower)
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._names = []  # sorted by lowercase name
+        self._keys = []  # lowercase names, parallel to _names, for bisect
+        self._loaded_at = None
+        self._full_listing_at = None
+        self._added_since = None  # epoch seconds the next change log listing starts from
+        self._failures = 0
+        self._retry_at = 0.0
+        self._metadata = {}  # name -> metadata dict, or None for titles without one
+        self._refresher_pid = None
+        self.refreshes = 0
+        self.full_refreshes = 0
+        self.refresh_errors = 0
+
+    def refresh(self):
+        """Update the index from the bucket; the old one serves until then"""
+        with self._refresh_lock:
+            if not self._retry_due():
+                return
+            started = time.time()
+            with self._lock:
+                full = (self._list_added is None or self._full_listing_at is None
+                        or time.monotonic() - self._full_listing_at >= self.full_refresh_interval)
+                since = self._added_since
+            try:
+                listed = self._list_names() if full else self._list_added(since)
+            except Exception as e:
+                self._refresh_failed(e)
+                return
+
+            with self._lock:
+                if full:
+                    names = sorted(set(listed), key=str.lower)
+                    self._full_listing_at = time.monotonic()
+                    self.full_refreshes += 1
+                else:
+                    added = set(listed).difference(self._names)
+                    names = sorted(added.union(self._names), key=str.lower) if added else self._names
+                if names is not self._names:
+                    self._names = names
+                    self._keys = [name.lower() for name in names]
+                self._loaded_at = time.monotonic()
+                self._added_since = started - CHANGE_LOG_SKEW
+                self._failures = 0
+                self._retry_at = 0.0
+                self.refreshes += 1
+
+    def _refresh_failed(self, error: Exception):
+        with self._lock:
+            self.refresh_errors += 1
+            self._failures += 1
+            backoff = min(self.refresh_interval * 2 ** (self._failures - 1), MAX_REFRESH_BACKOFF)
+            self._retry_at = time.monotonic() + backoff
+            if self._loaded_at is None and not self._names:
+                self._names = self.fallback
+                self._keys = [name.lower() for name in self.fallback]
+        logger.error(f"Video catalog refresh failed, retrying in {backoff:.0f}s: {str(error)}")
+
+    def _retry_due(self) -> bool:
+        with self._lock:
+            return time.monotonic() >= self._retry_at
+
+    def _ensure_refresher(self):
+        # Started lazily (and once per worker process) so forking servers
+        # do not inherit a dead thread from the parent
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        threading.Thread(target=self._refresh_loop, name='video-catalog-refresh', daemon=True).start()
+
+    def fill_metadata(self):
+        """Fetch metadata for listed titles that have none cached yet"""
+        if self._load_metadata is None:
+            return
+        with self._lock:
+            names = self._names
+            known = self._metadata
+            missing = [name for name in names if name not in known]
+        if not missing:
+            return
+
+        def fetch(name):
+            try:
+                return name, self._load_metadata(name)
+            except Exception as e:
+                # Left out of the cache so the next refresh tries again
+                logger.error(f"Failed to load metadata for {name}: {str(e)}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=METADATA_FETCH_CONCURRENCY) as pool:
+            fetched = dict(result for result in pool.map(fetch, missing) if result is not None)
+
+        with self._lock:
+            # Drop titles that are no longer listed
+            listed = set(self._names)
+            self._metadata = {
+                name: metadata for name, metadata in {**self._metadata, **fetched}.items() if name in listed
+            }
+
+    def describe(self, name: str) -> dict:
+        """The catalog entry for a title: its name plus any cached metadata"""
+        with self._lock:
+            metadata = self._metadata.get(name)
+        return {**(metadata or {}), "name": name}
+
+    def _refresh_loop(self):
+        while True:
+            with self._lock:
+                backoff = self._retry_at - time.monotonic()
+            self._wakeup.wait(max(self.refresh_interval, backoff))
+            self._wakeup.clear()
+            if not self._retry_due():
+                continue
+            self.refresh()
+            self.fill_metadata()
+
+    def _age(self) -> Optional[float]:
+        with self._lock:
+            if self._loaded_at is None:
+                return None
+            return time.monotonic() - self._loaded_at
+
+    def _current(self) -> Tuple[list, list]:
+        self._ensure_refresher()
+        age = self._age()
+        if (age is None or age > self.stale_ttl) and self._retry_due():
+            # Names only; the refresher fills in metadata in the background
+            self.refresh()
+            if self._load_metadata is not None:
+                self._wakeup.set()
+        elif age is None or age > self.refresh_interval:
+            self._wakeup.set()
+        with self._lock:
+            return self._names, self._keys
+
+    def search(self, prefix: str = '', offset: int = 0, limit: int = 50) -> Tuple[int, List[str]]:
+        """Return (total matches, one page of names) for a case-insensitive name prefix"""
+        names, keys = self._current()
+        prefix = prefix.lower()
+        if prefix:
+            start = bisect.bisect_left(keys, prefix)
+            end = bisect.bisect_left(keys, prefix + '\uffff', lo=start)
+        else:
+            start, end = 0, len(names)
+        page_start = min(start + offset, end)
+        return end - start, names[page_start:min(page_start + limit, end)]
+
+    def stats(self) -> dict:
+        age = self._age()
+        with self._lock:
+            return {
+                "titles": len(self._names),
+                "with_metadata": sum(1 for metadata in self._metadata.values() if metadata),
+                "age_seconds": round(age, 1) if age is not None else None,
+                "refreshes": self.refreshes,
+                "full_refreshes": self.full_refreshes,
+                "refresh_errors": self.refresh_errors,
+                "consecutive_failures": self._failures
+            }
+
+
+def bucket_video_lister(session, bucket: str, prefix: str = 'videos/') -> Callable[[], List[str]]:
+    """Return a callable listing the title directories directly under prefix"""
+    def list_names():
+        names = []
+        paginator = session.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                names.append(common_prefix['Prefix'][len(prefix):].rstrip('/'))
+        return names
+    return list_names
+
+
+def bucket_change_lister(session, bucket: str, prefix: str = CHANGE_LOG_PREFIX) -> Callable[[float], List[str]]:
+    """Return a callable listing the titles announced in the change log since a time (epoch seconds)"""
+    def list_added(since):
+        start_after = prefix
+        if since is not None:
+            start_after += datetime.fromtimestamp(since, timezone.utc).strftime(CHANGE_LOG_TIME_FORMAT)
+        names = []
+        paginator = session.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, StartAfter=start_after):
+            for obj in page.get('Contents', []):
+                names.append(obj['Key'][len(prefix):].split('-', 1)[-1])
+        return names
+    return list_added
+
+
+def bucket_metadata_loader(session, bucket: str, prefix: str = 'videos/') -> Callable[[str], Optional[dict]]:
+    """Return a callable fetching a title's metadata.json, or None if it was never written"""
+    def load_metadata(name):
+        try:
+            response = session.get_object(Bucket=bucket, Key=f"{prefix}{name}/metadata.json")
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+    return load_metadata